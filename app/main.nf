@@ -1,7 +1,7 @@
 #!/usr/bin/env nextflow
 
 include { BAM_TO_FASTQ } from './modules/bam_to_fastq.nf'
-include { CONTAMINATION_REMOVAL } from './modules/contamination_removal.nf'
+include { CONTAMINATION_REMOVAL; CONTAMINATION_REMOVAL_BATCH } from './modules/contamination_removal.nf'
 include { FASTQC } from './modules/fastqc.nf'
 include { PRIMER_AUTODETECTION } from './modules/primer_autodetection.nf'
 include { NCOV2019_ARTIC_NF_PIPELINE } from './modules/ncov2019_artic.nf'
@@ -42,14 +42,35 @@ workflow {
         params.rik_ref_genome_fasta,
         samples.fastq.mix(BAM_TO_FASTQ.out)
     )
+    // The gate of each sample, keyed by sample id: "passed", or "no_reads". The downstream stages skip the gated samples
+    if (params.contamination_removal_batch) {
+        CONTAMINATION_REMOVAL_BATCH(CONTAMINATION_REMOVAL.out.ch_rik_output.collect())
+        ch_contamination_removal_csvs = CONTAMINATION_REMOVAL_BATCH.out.ch_contamination_removal_csv
+        ch_contamination_removal_gate = CONTAMINATION_REMOVAL_BATCH.out.ch_contamination_removal_gate
+            .flatten()
+            .map { gate -> [gate.name - "_contamination_removal_gate.txt", gate] }
+    } else {
+        ch_contamination_removal_csvs = CONTAMINATION_REMOVAL.out.ch_contamination_removal_csv.collect()
+        ch_contamination_removal_gate = CONTAMINATION_REMOVAL.out.ch_contamination_removal_gate
+            .map { meta, gate -> [meta.SAMPLE_ID, gate] }
+    }
     FASTQC(
-        CONTAMINATION_REMOVAL.out.ch_cleaned_fastq
-    )
-    PRIMER_AUTODETECTION(
-        CONTAMINATION_REMOVAL.out.ch_cleaned_fastq
+        gate_passed(CONTAMINATION_REMOVAL.out.ch_cleaned_fastq, ch_contamination_removal_gate)
     )
+    if (params.primer_autodetection_fused) {
+        ch_primer_detected = CONTAMINATION_REMOVAL.out.ch_primer_detected
+        ch_primer_data = CONTAMINATION_REMOVAL.out.ch_primer_data
+        ch_read_stats = CONTAMINATION_REMOVAL.out.ch_read_stats
+    } else {
+        PRIMER_AUTODETECTION(
+            with_gate(CONTAMINATION_REMOVAL.out.ch_cleaned_fastq, ch_contamination_removal_gate)
+        )
+        ch_primer_detected = PRIMER_AUTODETECTION.out.ch_primer_detected
+        ch_primer_data = PRIMER_AUTODETECTION.out.ch_primer_data
+        ch_read_stats = PRIMER_AUTODETECTION.out.ch_read_stats
+    }
     // Add the primer to metadata
-    ch_ncov_input = PRIMER_AUTODETECTION.out.ch_primer_detected.map {
+    ch_ncov_input = gate_passed(ch_primer_detected, ch_contamination_removal_gate).map {
         it ->
             it[0]["PRIMER"] = it[2].text
             [it[0], it[1]]
@@ -67,10 +88,31 @@ workflow {
     // // submit results
     SUBMIT_ANALYSIS_RUN_RESULTS(
         ch_metadata, // Original metadata input file
-        CONTAMINATION_REMOVAL.out.ch_contamination_removal_csv.collect(),
-        PRIMER_AUTODETECTION.out.ch_primer_data.collect(),
+        ch_contamination_removal_csvs,
+        ch_primer_data.collect(),
+        ch_read_stats.collect(),
         NCOV2019_ARTIC_NF_PIPELINE.out.ch_ncov_qc_csv.collect(),
         PANGOLIN_PIPELINE.out.ch_pangolin_lineage_csv.collect(),
     )
 
-}
\ No newline at end of file
+}
+
+/*
+ * Add the contamination removal gate file of the sample to each item (a tuple starting with the sample meta).
+ * The gates are keyed by sample id
+ */
+def with_gate(ch_items, ch_gate) {
+    ch_items
+        .map { it -> [it[0].SAMPLE_ID, it] }
+        .join(ch_gate)
+        .map { it -> it[1] + [it[2]] }
+}
+
+/*
+ * Keep the items (tuples starting with the sample meta) of the samples let through by the contamination removal gate
+ */
+def gate_passed(ch_items, ch_gate) {
+    with_gate(ch_items, ch_gate)
+        .filter { it -> it[-1].text.trim() == "passed" }
+        .map { it -> it[0..-2] }
+}
@@ -2,22 +2,40 @@
  * Run: read-it-and-keep
  * https://github.com/GlobalPathogenAnalysisService/read-it-and-keep
  * This tool keeps the reads that match the provided target genome.
+ * If params.primer_autodetection_fused, the primer autodetection runs in this process too, see below
  */
 
+include { primer_autodetection_command } from './primer_autodetection.nf'
+
 process CONTAMINATION_REMOVAL {
-  publishDir "${params.output_path}/contamination_removal", mode: 'copy', overwrite: true, pattern: '{*_contamination_removal.csv,cleaned_fastq/*.fastq.gz,counting/*.txt}'
+  publishDir "${params.output_path}/contamination_removal", mode: 'copy', overwrite: true, pattern: '{*_contamination_removal.csv,*_contamination_removal_gate.txt,cleaned_fastq/*.fastq.gz,counting/*.txt}'
+  publishDir "${params.output_path}/primer_autodetection", mode: 'copy', overwrite: true, pattern: '{*_primer_data.csv,*_primer_detection.csv,*_primer_stats.json,*_primer_timings.json,*_read_stats.csv,*_read_length_histogram.csv}'
 
   input:
     val ref_genome_fasta
     tuple val(meta), path(read_paths)
 
   output:
-    path "*_contamination_removal.csv", emit: ch_contamination_removal_csv
-    path "counting/*.txt"
+    // Not if params.contamination_removal_batch, see CONTAMINATION_REMOVAL_BATCH
+    path "*_contamination_removal.csv", optional: true, emit: ch_contamination_removal_csv
+    path "counting/*.txt", emit: ch_rik_output
+    // "passed", or "no_reads" if read-it-and-keep kept no reads: the sample has no cleaned fastq nor primer
+    // autodetection output then, so that FASTQC, PRIMER_AUTODETECTION and ncov are not run on it.
+    // Not if params.contamination_removal_batch, see CONTAMINATION_REMOVAL_BATCH
+    tuple val(meta), path("${sample_id}_contamination_removal_gate.txt"), optional: true, emit: ch_contamination_removal_gate
 
     // This is optional because there may be no output file if there are no reads
     tuple val(meta), path("cleaned_fastq/${sample_id}_*.fastq.gz"), optional: true, emit: ch_cleaned_fastq
 
+    // Only if params.primer_autodetection_fused, same outputs as PRIMER_AUTODETECTION
+    path "*_primer_data.csv", optional: true, emit: ch_primer_data
+    path "*_primer_detection.csv", optional: true, emit: ch_primer_coverage
+    path "*_primer_stats.json", optional: true, emit: ch_primer_stats
+    path "*_read_stats.csv", optional: true, emit: ch_read_stats
+    path "*_read_length_histogram.csv", optional: true, emit: ch_read_length_histogram
+    path "*_primer_timings.json", optional: true, emit: ch_primer_timings
+    tuple val(meta), path("cleaned_fastq/${sample_id}_*.fastq.gz"), path("${sample_id}_primer.txt"), optional: true, emit: ch_primer_detected
+
   script:
 
     // Common Variables to both
@@ -27,6 +45,83 @@ process CONTAMINATION_REMOVAL {
     // As we will use the path and not reconstruct it elsewhere
     cleaned_fastq_file_1 = "cleaned_fastq/${sample_id}_1.fastq.gz"
     output_csv = "${sample_id}_contamination_removal.csv"
+    gate_file = "${sample_id}_contamination_removal_gate.txt"
+    if (params.contamination_removal_batch) {
+      // the csv file and the gate are written by CONTAMINATION_REMOVAL_BATCH, which validates the read counts.
+      // Without reads kept, read-it-and-keep writes no cleaned fastq and the fused primer autodetection no output
+      contamination_removal_csv_command = ""
+      contamination_removal_gate_command = ""
+    } else {
+      contamination_removal_csv_command = """
+      python ${PSGA_ROOT_PATH}/scripts/contamination_removal.py \
+        --input-path "${rik_output_file}" \
+        --output-csv-path "${output_csv}" \
+        --sample-id "${sample_id}" \
+        --gate-path "${gate_file}"
+      """
+      contamination_removal_gate_command = """
+      if [ "\$(cat ${gate_file})" != "passed" ]; then
+        # no reads kept: skip the downstream processes of the sample
+        echo "No reads kept for ${sample_id}"
+        rm -f cleaned_fastq/${sample_id}_*.fastq.gz ${sample_id}_primer* ${sample_id}_read_*
+      fi
+      """
+    }
+
+    // Primer autodetection fused with the contamination removal (opt-in).
+    // read-it-and-keep writes its first output fastq into a named pipe, which is copied (tee) both to the
+    // output file and to the primer autodetection reading stdin. The cleaned fastq is decompressed once,
+    // while it is being written, and no separate primer autodetection task is scheduled.
+    // tee -p keeps writing the output file if the primer autodetection stops reading early (--max-reads, --confidence)
+    rik_output_fastq_1 = params.sequencing_technology == 'illumina' ? "out.reads_1.fastq.gz" : "out.reads.fastq.gz"
+    fused_primer_autodetection_start = ""
+    fused_primer_autodetection_end = ""
+    if (params.primer_autodetection_fused) {
+      fused_primer_autodetection_start = """
+      mkfifo ${rik_output_fastq_1}
+      tee -p primer_autodetection_input.fastq.gz < ${rik_output_fastq_1} \
+      | ${primer_autodetection_command(sample_id, "-", task.cpus)} &
+      primer_autodetection_pid=\$!
+      """
+      fused_primer_autodetection_end = """
+      # If there are no reads, read-it-and-keep never opens the named pipe: open it to release tee (no-op otherwise)
+      python -c "import os; os.close(os.open('${rik_output_fastq_1}', os.O_WRONLY | os.O_NONBLOCK))" 2>/dev/null || true
+      wait \$primer_autodetection_pid
+      rm -f ${rik_output_fastq_1}
+      if [ -s primer_autodetection_input.fastq.gz ]; then
+        mv -f primer_autodetection_input.fastq.gz ${rik_output_fastq_1}
+      else
+        # as in the pipeline without fusion, there is no primer autodetection output for samples without reads
+        rm -f primer_autodetection_input.fastq.gz ${sample_id}_primer* ${sample_id}_read_*
+      fi
+      """
+    }
+
+    // read-it-and-keep writes plain gzip: if params.primer_autodetection_sample_blocks, its first output fastq is
+    // written into a named pipe and converted to BGZF (still readable by any gzip reader) while it is being written,
+    // so that PRIMER_AUTODETECTION reads only evenly spaced blocks of the cleaned fastq. Not if
+    // params.primer_autodetection_fused, as the primer autodetection reads a stream then
+    cleaned_fastq_bgzf_start = ""
+    cleaned_fastq_bgzf_end = ""
+    if (params.primer_autodetection_sample_blocks && !params.primer_autodetection_fused) {
+      cleaned_fastq_bgzf_start = """
+      mkfifo ${rik_output_fastq_1}
+      gzip -cd < ${rik_output_fastq_1} | bgzip -c -@ ${task.cpus} > ${rik_output_fastq_1}.bgzf &
+      cleaned_fastq_bgzf_pid=\$!
+      """
+      cleaned_fastq_bgzf_end = """
+      # If there are no reads, read-it-and-keep never opens the named pipe: open it to release gzip (no-op otherwise)
+      python -c "import os; os.close(os.open('${rik_output_fastq_1}', os.O_WRONLY | os.O_NONBLOCK))" 2>/dev/null || true
+      wait \$cleaned_fastq_bgzf_pid
+      rm -f ${rik_output_fastq_1}
+      # without reads, bgzip writes the end of file block only: as without BGZF, there is no output file then
+      if [ -n "\$(gzip -cd < ${rik_output_fastq_1}.bgzf | head -c 1)" ]; then
+        mv -f ${rik_output_fastq_1}.bgzf ${rik_output_fastq_1}
+      else
+        rm -f ${rik_output_fastq_1}.bgzf
+      fi
+      """
+    }
 
     // NOTE: readItAndKeep always compresses the output, not matter what the input was so assume filename is .gz
     // This was gzipping the input file, but it doesn't seem to be necessary
@@ -38,7 +133,8 @@ process CONTAMINATION_REMOVAL {
       cleaned_fastq_file_2 = "cleaned_fastq/${sample_id}_2.fastq.gz"
       """
       mkdir -p cleaned_fastq counting
-
+      ${fused_primer_autodetection_start}
+      ${cleaned_fastq_bgzf_start}
       readItAndKeep \
         --tech ${params.sequencing_technology} \
         --ref_fasta ${ref_genome_fasta} \
@@ -46,7 +142,8 @@ process CONTAMINATION_REMOVAL {
         --reads2 ${reads_file_2} \
         --outprefix out 2>&1 \
       | tee ${rik_output_file}
-
+      ${fused_primer_autodetection_end}
+      ${cleaned_fastq_bgzf_end}
       # If there are no reads there will be no output file
       if [ -f out.reads_1.fastq.gz ] && [ -f out.reads_2.fastq.gz ]; then
         mv -f out.reads_1.fastq.gz ${cleaned_fastq_file_1}
@@ -55,10 +152,8 @@ process CONTAMINATION_REMOVAL {
         echo "No reads output file found for ${sample_id}"
       fi
 
-      python ${PSGA_ROOT_PATH}/scripts/contamination_removal.py \
-        --input-path "${rik_output_file}" \
-        --output-csv-path "${output_csv}" \
-        --sample-id "${sample_id}"
+      ${contamination_removal_csv_command}
+      ${contamination_removal_gate_command}
       """
     }
 
@@ -66,14 +161,16 @@ process CONTAMINATION_REMOVAL {
       reads_file_1 = read_paths
       """
       mkdir -p cleaned_fastq counting
-
+      ${fused_primer_autodetection_start}
+      ${cleaned_fastq_bgzf_start}
       readItAndKeep \
         --tech ${params.sequencing_technology} \
         --ref_fasta ${ref_genome_fasta} \
         --reads1 ${reads_file_1} \
         --outprefix out 2>&1 \
       | tee ${rik_output_file}
-
+      ${fused_primer_autodetection_end}
+      ${cleaned_fastq_bgzf_end}
       # If there are no reads there will be no output file
       if [ -f out.reads.fastq.gz ]; then
         mv -f out.reads.fastq.gz ${cleaned_fastq_file_1}
@@ -81,10 +178,37 @@ process CONTAMINATION_REMOVAL {
         echo "No reads output file found for ${sample_id}"
       fi
 
-      python ${PSGA_ROOT_PATH}/scripts/contamination_removal.py \
-        --input-path "${rik_output_file}" \
-        --output-csv-path "${output_csv}" \
-        --sample-id "${sample_id}"
+      ${contamination_removal_csv_command}
+      ${contamination_removal_gate_command}
       """
     }
-}
\ No newline at end of file
+}
+
+/*
+ * Parse the read-it-and-keep outputs of all the samples into contamination_removal.csv and the gate file of each
+ * sample (params.contamination_removal_batch)
+ */
+process CONTAMINATION_REMOVAL_BATCH {
+  // the gate files are published next to contamination_removal.csv, as without batch
+  publishDir "${params.output_path}/contamination_removal", mode: 'copy', overwrite: true, saveAs: { filename -> file(filename).name }
+
+  input:
+    path rik_output_files
+
+  output:
+    path "contamination_removal.csv", emit: ch_contamination_removal_csv
+    // <sample_id>_contamination_removal_gate.txt, as written by CONTAMINATION_REMOVAL without batch
+    path "gates/*_contamination_removal_gate.txt", emit: ch_contamination_removal_gate
+
+  script:
+    // the read-it-and-keep outputs are staged as <sample_id>.txt
+    """
+    mkdir -p gates
+    python ${PSGA_ROOT_PATH}/scripts/contamination_removal.py \
+      --batch \
+      --input-path . \
+      --output-csv-path contamination_removal.csv \
+      --gate-dir gates \
+      --threads ${task.cpus}
+    """
+}
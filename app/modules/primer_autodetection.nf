@@ -1,21 +1,27 @@
 process PRIMER_AUTODETECTION {
-  publishDir "${params.output_path}/primer_autodetection", mode: 'copy', overwrite: true, pattern: '{*_primer_data.csv,*_primer_detection.csv}'
+  publishDir "${params.output_path}/primer_autodetection", mode: 'copy', overwrite: true, pattern: '{*_primer_data.csv,*_primer_detection.csv,*_primer_stats.json,*_primer_timings.json,*_read_stats.csv,*_read_length_histogram.csv}'
 
   input:
-    tuple val(meta), path(read_paths)
+    // the gate written by CONTAMINATION_REMOVAL: a gated sample has no primer autodetection output
+    tuple val(meta), path(read_paths), path(contamination_removal_gate)
 
   output:
-    path "*_primer_data.csv", emit: ch_primer_data
-    path "*_primer_detection.csv", emit: ch_primer_coverage
+    path "*_primer_data.csv", optional: true, emit: ch_primer_data
+    path "*_primer_detection.csv", optional: true, emit: ch_primer_coverage
+    // Prefix cache hit rate and reads consumed by the scan
+    path "*_primer_stats.json", optional: true, emit: ch_primer_stats
+    // Only if params.primer_autodetection_read_stats
+    path "*_read_stats.csv", optional: true, emit: ch_read_stats
+    path "*_read_length_histogram.csv", optional: true, emit: ch_read_length_histogram
+    // Only if params.primer_autodetection_timings
+    path "*_primer_timings.json", optional: true, emit: ch_primer_timings
 
     // Primer is written to a file so it can be added to metadata
-    tuple val(meta), path(read_paths), path("${sample_id}_primer.txt"), emit: ch_primer_detected
+    tuple val(meta), path(read_paths), path("${sample_id}_primer.txt"), optional: true, emit: ch_primer_detected
 
   script:
 
     sample_id = meta.SAMPLE_ID
-    primer_index="/primer_schemes/SARS-CoV-2_primer_index.csv"
-
     if (params.sequencing_technology == "illumina") {
       read_path = read_paths[0]
     } else {
@@ -23,10 +29,56 @@ process PRIMER_AUTODETECTION {
     }
 
     """
-    python ${PSGA_ROOT_PATH}/scripts/primer_autodetection.py \
-      --primer-index "${primer_index}" \
-      --sample-fastq "${read_path}" \
-      --sample-id "${sample_id}" \
-      --primer-input ${params.kit}
+    ${primer_autodetection_command(sample_id, read_path, task.cpus, contamination_removal_gate)}
     """
 }
+
+/*
+ * The primer_autodetection.py command line of a sample.
+ * Shared with the primer autodetection fused into CONTAMINATION_REMOVAL, which reads the sample fastq from stdin ("-")
+ * while the gate of the sample is not known yet (no gate_file)
+ */
+def primer_autodetection_command(sample_id, sample_fastq, cpus, gate_file = null) {
+    def primer_index = "/primer_schemes/SARS-CoV-2_primer_index.bundle"
+
+    def early_stopping_opts = ""
+    if (params.primer_autodetection_max_reads) {
+      early_stopping_opts += " --max-reads ${params.primer_autodetection_max_reads}"
+    }
+    if (params.primer_autodetection_confidence) {
+      early_stopping_opts += " --confidence ${params.primer_autodetection_confidence}"
+    }
+    if (params.primer_autodetection_sample_blocks) {
+      early_stopping_opts += " --sample-blocks ${params.primer_autodetection_sample_blocks}"
+    }
+
+    def engine_opts = ""
+    if (params.primer_autodetection_engine) {
+      engine_opts = "--engine ${params.primer_autodetection_engine}"
+    }
+    if (params.primer_autodetection_shared_index_dir) {
+      engine_opts += " --shared-index-dir ${params.primer_autodetection_shared_index_dir}"
+    }
+
+    def cache_opts = ""
+    if (params.primer_autodetection_cache_dir) {
+      cache_opts = "--cache-dir ${params.primer_autodetection_cache_dir}"
+    }
+
+    def gate_opts = gate_file ? "--contamination-removal-gate \"${gate_file}\"" : ""
+    def read_stats_opts = params.primer_autodetection_read_stats ? "--read-stats" : ""
+    def timings_opts = params.primer_autodetection_timings ? "--timings" : ""
+
+    return """python \${PSGA_ROOT_PATH}/scripts/primer_autodetection.py \\
+      --primer-index "${primer_index}" \\
+      --sample-fastq "${sample_fastq}" \\
+      --sample-id "${sample_id}" \\
+      --primer-input ${params.kit} \\
+      --workers ${cpus} \\
+      ${engine_opts} \\
+      ${early_stopping_opts} \\
+      ${cache_opts} \\
+      ${gate_opts} \\
+      ${read_stats_opts} \\
+      ${timings_opts}"""
+}
@@ -2,6 +2,7 @@
 
 include { submit_results as submit_contamination_removal_results } from './submit_results.nf'
 include { submit_results as submit_primer_autodetection_results } from './submit_results.nf'
+include { submit_results as submit_read_stats_results } from './submit_results.nf'
 include { submit_results as submit_ncov_qc_results } from './submit_results.nf'
 include { submit_results as submit_pangolin_results } from './submit_results.nf'
 
@@ -17,6 +18,7 @@ process submit_pipeline_results_files {
     path ch_metadata
     path ch_contamination_removal_csv_file
     path ch_primer_autodetection_csv_file
+    path ch_read_stats_csv_file
     path ch_ncov_qc_result_csv_file
     path ch_pangolin_csv_file
 
@@ -27,6 +29,9 @@ process submit_pipeline_results_files {
     path "*.log"
 
   script:
+  // the read statistics columns are added to the results only if they were computed
+  read_stats_opt = params.primer_autodetection_read_stats ? "--read-stats-csv-file \"${ch_read_stats_csv_file}\"" : ""
+  contamination_removal_batch_opt = params.contamination_removal_batch ? "--contamination-removal-batch" : ""
   """
   optional_opts=""
   if [[ -f "${ch_contamination_removal_csv_file}" ]]; then
@@ -47,6 +52,8 @@ process submit_pipeline_results_files {
     --metadata-file "${ch_metadata}" \
     --output-path "${params.output_path}" \
     --sequencing-technology "${params.sequencing_technology}" \
+    ${read_stats_opt} \
+    ${contamination_removal_batch_opt} \
     \${optional_opts}
   """
 }
@@ -60,6 +67,7 @@ workflow SUBMIT_ANALYSIS_RUN_RESULTS {
         ch_metadata
         ch_contamination_removal_csvs
         ch_primer_autodetection_csvs
+        ch_read_stats_csvs
         ch_ncov_qc_csvs
         ch_pangolin_csvs
     main:
@@ -68,20 +76,32 @@ workflow SUBMIT_ANALYSIS_RUN_RESULTS {
             // ncov was not executed. Therefore, mock contamination removal, primer_autodetection and ncov
             ch_contamination_removal_submitted = ch_contamination_removal_csvs
             ch_primer_autodetection_submitted = ch_primer_autodetection_csvs
+            ch_read_stats_submitted = ch_read_stats_csvs
             ch_ncov_qc_submitted = ch_ncov_qc_csvs
         } else {
-            ch_contamination_removal_submitted = submit_contamination_removal_results(
-                ch_contamination_removal_csvs,
-                'contamination_removal.csv',
-                'sample_id',
-                'contamination_removal'
-            )
+            if ( params.contamination_removal_batch ) {
+                // already the csv file of all the samples, see CONTAMINATION_REMOVAL_BATCH
+                ch_contamination_removal_submitted = ch_contamination_removal_csvs
+            } else {
+                ch_contamination_removal_submitted = submit_contamination_removal_results(
+                    ch_contamination_removal_csvs,
+                    'contamination_removal.csv',
+                    'sample_id',
+                    'contamination_removal'
+                )
+            }
             ch_primer_autodetection_submitted = submit_primer_autodetection_results(
                 ch_primer_autodetection_csvs,
                 'primer_autodetection.csv',
                 'sample_id',
                 'primer_autodetection'
             )
+            ch_read_stats_submitted = submit_read_stats_results(
+                ch_read_stats_csvs,
+                'read_stats.csv',
+                'sample_id',
+                'primer_autodetection'
+            )
             ch_ncov_qc_submitted = submit_ncov_qc_results(
                 ch_ncov_qc_csvs,
                 'ncov_qc.csv',
@@ -103,6 +123,7 @@ workflow SUBMIT_ANALYSIS_RUN_RESULTS {
             ch_metadata,
             ch_contamination_removal_submitted.ifEmpty(file(params.contamination_removal_empty_csv)),
             ch_primer_autodetection_submitted.ifEmpty(file(params.primer_autodetection_empty_csv)),
+            ch_read_stats_submitted.ifEmpty(file(params.read_stats_empty_csv)),
             ch_ncov_qc_submitted.ifEmpty(file(params.ncov_qc_empty_csv)),
             ch_pangolin_submitted.ifEmpty(file(params.pangolin_empty_csv)),
         )
@@ -0,0 +1,54 @@
+from pathlib import Path
+import csv
+import click
+
+from app.scripts.fetch_primers import generate_primer_index_bundle, FASTA
+from app.scripts.primer_cols import PRIMER_NAME, FASTA_PATH
+from app.scripts.util.primer_index_bundle import BUNDLE_SUFFIX
+
+
+@click.command()
+@click.option(
+    "--primer-index",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    required=True,
+    help="path to the primer index CSV file",
+)
+@click.option(
+    "--path-prefix",
+    type=str,
+    default="",
+    help="prefix to add to the scheme FASTA paths stored in the primer index (e.g. the primer schemes parent dir)",
+)
+@click.option(
+    "--output-bundle",
+    type=click.Path(file_okay=True, dir_okay=False, writable=True),
+    default=None,
+    help=f"path of the bundle to generate. Default is the primer index path with suffix {BUNDLE_SUFFIX}",
+)
+@click.option(
+    "--fuzzy-primers",
+    is_flag=True,
+    default=False,
+    help="Also store the primer sequences with one mismatch (reported separately from the exact hits)",
+)
+def build_primer_index_bundle(primer_index: str, path_prefix: str, output_bundle: str, fuzzy_primers: bool) -> None:
+    """
+    Generate the primer index bundle of an existing primer index CSV file (as generated by fetch_primers.py).
+
+    e.g.
+    python build_primer_index_bundle.py \
+        --primer-index /primer_schemes/SARS-CoV-2_primer_index.csv
+    """
+    with open(primer_index, newline="") as index_csv:
+        schemes = {
+            row[PRIMER_NAME]: {FASTA: Path(f"{path_prefix}{row[FASTA_PATH]}")} for row in csv.DictReader(index_csv)
+        }
+
+    bundle_path = Path(output_bundle) if output_bundle else Path(primer_index).with_suffix(BUNDLE_SUFFIX)
+    generate_primer_index_bundle(bundle_path, schemes, fuzzy_primers)
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    build_primer_index_bundle()
@@ -1,32 +1,41 @@
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
 import csv
 import click
 
+from app.scripts.util.contamination_removal_gate import (
+    CONTAMINATION_REMOVAL_GATE_SUFFIX,
+    GATE_NO_READS,
+    GATE_PASSED,
+    write_gate_file,
+)
 
 CONTAMINATION_REMOVAL_SAMPLE_ID_COL = "sample_id"
 CONTAMINATION_REMOVAL_CONTAMINATED_READS_COL = "contaminated_reads"
 CONTAMINATION_REMOVAL_PRESERVED_READS_COL = "preserved_reads"
-EXPECTED_CONTAMINATION_REMOVAL_HEADERS = {
+CONTAMINATION_REMOVAL_HEADERS = [
     CONTAMINATION_REMOVAL_SAMPLE_ID_COL,
     CONTAMINATION_REMOVAL_CONTAMINATED_READS_COL,
     CONTAMINATION_REMOVAL_PRESERVED_READS_COL,
-}
+]
+EXPECTED_CONTAMINATION_REMOVAL_HEADERS = set(CONTAMINATION_REMOVAL_HEADERS)
+# the read-it-and-keep output file of a sample is named <sample_id><RIK_OUTPUT_SUFFIX>
+RIK_OUTPUT_SUFFIX = ".txt"
 
 
 def get_read_counts(input_path: Path) -> tuple[int, int]:
     """
-    Return the number of reads removed by read-it-and-keep
+    Return the number of reads removed by read-it-and-keep.
+    The output file is read line by line, e.g. "Input reads file 1\t75703" and "Input reads file 2\t0" -> 75703
     """
-
-    def _get_counting(lines: list[str], pattern: str) -> int:
-        """e.g. ["Input reads file 1\t75703", "Input reads file 2\t0"] -> 75703"""
-        return sum([int(line.split("\t")[1]) for line in lines if line.startswith(pattern)])
-
-    kept_reads = 0
+    input_reads = kept_reads = 0
     with open(input_path) as ifd:
-        lines = ifd.readlines()
-    input_reads = _get_counting(lines, "Input reads")
-    kept_reads = _get_counting(lines, "Kept reads")
+        for line in ifd:
+            if line.startswith("Input reads"):
+                input_reads += int(line.split("\t")[1])
+            elif line.startswith("Kept reads"):
+                kept_reads += int(line.split("\t")[1])
     contaminated_reads = input_reads - kept_reads
     if contaminated_reads < 0:
         raise ValueError(
@@ -42,23 +51,106 @@ def write_rik_output_csv(output_csv_path: Path, sample_id: str, contaminated_rea
     Write a CSV output file for read-it-and-keep
     """
     with open(output_csv_path, "w", newline="") as csvfile:
-        writer = csv.DictWriter(csvfile, fieldnames=list(EXPECTED_CONTAMINATION_REMOVAL_HEADERS))
+        writer = csv.DictWriter(csvfile, fieldnames=CONTAMINATION_REMOVAL_HEADERS)
         writer.writeheader()
-        writer.writerow(
-            {
-                CONTAMINATION_REMOVAL_SAMPLE_ID_COL: sample_id,
-                CONTAMINATION_REMOVAL_CONTAMINATED_READS_COL: contaminated_reads,
-                CONTAMINATION_REMOVAL_PRESERVED_READS_COL: kept_reads,
-            }
-        )
+        writer.writerow(_rik_output_row(sample_id, contaminated_reads, kept_reads))
+
 
+def _rik_output_row(sample_id: str, contaminated_reads: int, kept_reads: int) -> dict:
+    return {
+        CONTAMINATION_REMOVAL_SAMPLE_ID_COL: sample_id,
+        CONTAMINATION_REMOVAL_CONTAMINATED_READS_COL: contaminated_reads,
+        CONTAMINATION_REMOVAL_PRESERVED_READS_COL: kept_reads,
+    }
 
-def process_rik(input_path: Path, output_csv_path: Path, sample_id: str) -> None:
+
+def process_rik(
+    input_path: Path,
+    output_csv_path: Optional[Path],
+    sample_id: Optional[str],
+    gate_path: Optional[Path] = None,
+) -> None:
     """
-    Process the read-it-and-keep output file and store the number of removed reads in a csv file
+    Process the read-it-and-keep output file and store the number of removed reads in a csv file.
+    If gate_path is given, the gate of the sample is written to it too.
+    Without output_csv_path, only the gate is written (e.g. the csv file of the run is written by process_rik_batch)
     """
     contaminated_reads, kept_reads = get_read_counts(input_path)
-    write_rik_output_csv(output_csv_path, sample_id, contaminated_reads, kept_reads)
+    if output_csv_path:
+        write_rik_output_csv(output_csv_path, sample_id, contaminated_reads, kept_reads)
+    if gate_path:
+        write_gate_file(gate_path, kept_reads)
+
+
+def get_rik_output_paths(input_path: Path) -> list[tuple[str, Path]]:
+    """
+    Return the read-it-and-keep output files of a run, sorted by sample id.
+    The sample id is the name of the file without the suffix (e.g. counting/<sample_id>.txt)
+
+    :param input_path: a directory containing the output files, or a manifest file listing the output files one per
+        line (relative to the manifest directory, or absolute)
+    :return: the sample id and the path of each output file
+    """
+    if input_path.is_dir():
+        rik_output_paths = list(input_path.glob(f"*{RIK_OUTPUT_SUFFIX}"))
+    else:
+        with open(input_path) as manifest:
+            rik_output_paths = [input_path.parent / line.strip() for line in manifest if line.strip()]
+    if not rik_output_paths:
+        raise FileNotFoundError(f"No read-it-and-keep output file was found in {input_path}")
+    samples = sorted((path.name.removesuffix(RIK_OUTPUT_SUFFIX), path) for path in rik_output_paths)
+    sample_ids = [sample_id for sample_id, _ in samples]
+    if len(set(sample_ids)) != len(sample_ids):
+        raise ValueError(f"Duplicate sample ids in the read-it-and-keep output files of {input_path}")
+    return samples
+
+
+def iter_read_counts(samples: list[tuple[str, Path]], threads: int = 1) -> Iterator[tuple[str, int, int]]:
+    """
+    Yield the read counts of each sample in order, reading the files in a pool of threads if threads > 1
+    (e.g. to overlap the latency of a network filesystem)
+
+    :param samples: the sample id and the path of each read-it-and-keep output file
+    :param threads: the number of threads reading the files
+    :return: an iterator over the sample id, the number of contaminated reads and of kept reads
+    """
+
+    def _get_sample_read_counts(sample: tuple[str, Path]) -> tuple[str, int, int]:
+        sample_id, rik_output_path = sample
+        try:
+            return (sample_id, *get_read_counts(rik_output_path))
+        except ValueError as error:
+            raise ValueError(f"Sample {sample_id} ({rik_output_path}): {error}") from error
+
+    if threads > 1:
+        with ThreadPoolExecutor(threads) as executor:
+            yield from executor.map(_get_sample_read_counts, samples)
+    else:
+        yield from map(_get_sample_read_counts, samples)
+
+
+def process_rik_batch(
+    input_path: Path, output_csv_path: Path, threads: int = 1, gate_dir: Optional[Path] = None
+) -> int:
+    """
+    Process the read-it-and-keep output files of a run and store the number of removed reads of all the samples
+    in one csv file, sorted by sample id (as concatenating the csv files of process_rik)
+
+    :param input_path: a directory containing the output files, or a manifest file listing them
+    :param output_csv_path: the csv file of all the samples
+    :param threads: the number of threads reading the output files
+    :param gate_dir: if given, the gate of each sample is written to this directory, as process_rik does
+    :return: the number of samples
+    """
+    samples = get_rik_output_paths(input_path)
+    with open(output_csv_path, "w", newline="") as csvfile:
+        writer = csv.DictWriter(csvfile, fieldnames=CONTAMINATION_REMOVAL_HEADERS)
+        writer.writeheader()
+        for sample_id, contaminated_reads, kept_reads in iter_read_counts(samples, threads):
+            writer.writerow(_rik_output_row(sample_id, contaminated_reads, kept_reads))
+            if gate_dir:
+                write_gate_file(gate_dir / f"{sample_id}{CONTAMINATION_REMOVAL_GATE_SUFFIX}", kept_reads)
+    return len(samples)
 
 
 @click.command()
@@ -66,29 +158,79 @@ def process_rik(input_path: Path, output_csv_path: Path, sample_id: str) -> None
     "--input-path",
     type=click.Path(exists=True, file_okay=True, readable=True),
     required=True,
-    help="input directory containing the csv files to concatenate",
+    help="The read-it-and-keep output file. With --batch, the directory containing the output files of a run "
+    "(<sample_id>.txt) or a manifest file listing them",
 )
 @click.option(
     "--output-csv-path",
     type=click.Path(dir_okay=False, writable=True),
-    required=True,
-    help="output file name containing the concatenation of all the csv files in the current directory",
+    default=None,
+    help="output file name containing the concatenation of all the csv files in the current directory. "
+    "Required with --batch, optional with --gate-path",
 )
 @click.option(
     "--sample-id",
     type=str,
-    required=True,
-    help="The sample id",
+    default=None,
+    help="The sample id, required with --output-csv-path without --batch",
+)
+@click.option(
+    "--batch",
+    is_flag=True,
+    default=False,
+    help="Process the read-it-and-keep output files of all the samples of a run into one csv file",
+)
+@click.option(
+    "--threads",
+    type=click.IntRange(min=1),
+    default=1,
+    help="With --batch, the number of threads reading the output files (e.g. on a network filesystem)",
+)
+@click.option(
+    "--gate-path",
+    type=click.Path(dir_okay=False, writable=True),
+    default=None,
+    help=f"Write the gate of the sample to this file: {GATE_PASSED}, or {GATE_NO_READS} if no reads were "
+    "kept, so that the downstream processes skip the sample. Not with --batch",
+)
+@click.option(
+    "--gate-dir",
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    default=None,
+    help=f"With --batch, write the gate of each sample to <sample_id>{CONTAMINATION_REMOVAL_GATE_SUFFIX} "
+    "in this directory",
 )
 def contamination_removal(
     input_path: str,
-    output_csv_path: str,
-    sample_id: str,
+    output_csv_path: Optional[str],
+    sample_id: Optional[str],
+    batch: bool,
+    threads: int,
+    gate_path: Optional[str],
+    gate_dir: Optional[str],
 ) -> None:
     """
-    Concatenate the CSV files in the current directory
+    Store the number of reads removed by read-it-and-keep in a csv file, for a sample or for a run (--batch)
     """
-    process_rik(Path(input_path), Path(output_csv_path), sample_id)
+    if batch:
+        if gate_path:
+            raise click.UsageError("--gate-path is not supported with --batch")
+        if output_csv_path is None:
+            raise click.UsageError("--output-csv-path is required with --batch")
+        process_rik_batch(Path(input_path), Path(output_csv_path), threads, Path(gate_dir) if gate_dir else None)
+    elif gate_dir:
+        raise click.UsageError("--gate-dir requires --batch")
+    elif output_csv_path is None and gate_path is None:
+        raise click.UsageError("--output-csv-path or --gate-path is required")
+    elif output_csv_path is not None and sample_id is None:
+        raise click.UsageError("--sample-id is required with --output-csv-path without --batch")
+    else:
+        process_rik(
+            Path(input_path),
+            Path(output_csv_path) if output_csv_path else None,
+            sample_id,
+            Path(gate_path) if gate_path else None,
+        )
 
 
 if __name__ == "__main__":
@@ -1,6 +1,7 @@
 import shutil
 from pathlib import Path
-from typing import Any, Callable, Dict
+from typing import Any, Callable, Dict, Iterator, Optional
+from multiprocessing import Pool
 import re
 import csv
 import pickle as Pickle
@@ -8,9 +9,14 @@ import tempfile
 import click
 from git import Repo
 from Bio import SeqIO
+from Bio.Seq import reverse_complement
 import ahocorasick
 
 from app.scripts.primer_cols import PRIMER_INDEX_COLS, PRIMER_NAME, FASTA_PATH, PICKLE_PATH, TOTAL_NUM_PRIMER
+from app.scripts.util.data_loading import load_json, write_json
+from app.scripts.util.file_hash import file_fingerprint
+from app.scripts.util.primer_index_bundle import BUNDLE_SUFFIX, write_primer_index_bundle
+from app.scripts.util.primer_source_cache import extract_source_tarball, source_cache_path, store_source_tarball
 
 SARS_COV_2 = "SARS-CoV-2"
 EPI2ME_LABS = "epi2me-labs"
@@ -35,20 +41,55 @@ PICKLE = "pickle"
 
 SCHEME_TYPE = Dict[str, Dict[str, Path]]
 
+# the build manifest stores, for each scheme, the content hashes of its inputs and its primer sequences,
+# so that a rebuild only processes the schemes whose inputs changed
+BUILD_MANIFEST_SUFFIX = "_primer_build_manifest.json"
+# bump when the generated scheme files change, so that all the schemes are built again
+BUILD_MANIFEST_VERSION = 2
+PRIMER_SEQUENCES = "primer_sequences"
 
-def create_automaton(input_path: Path, filetype: str = FASTA) -> ahocorasick.Automaton:
+BASES = "ACGT"
+
+# the reference sequences parsed by this process, by content hash: the schemes of a build mostly share a reference
+REFERENCE_CACHE_SIZE = 8
+_REFERENCE_SEQUENCES: dict[str, str] = {}
+
+
+def hamming_neighbours(sequence: str) -> Iterator[str]:
     """
-    Store the reads in an Aho-Corasick automaton trie structure for primer look up
+    Generate the sequences at Hamming distance 1 from a sequence (one base substituted with another of A, C, G, T)
+
+    :param sequence: the primer sequence
+    :return: the iterator of the neighbour sequences
+    """
+    for position, base in enumerate(sequence):
+        for substitute in BASES:
+            if substitute != base:
+                yield f"{sequence[:position]}{substitute}{sequence[position + 1:]}"
+
+
+def create_automaton(input_path: Path, filetype: str = FASTA, fuzzy: bool = False) -> ahocorasick.Automaton:
+    """
+    Store the reads in an Aho-Corasick automaton trie structure for primer look up.
+    The value of each primer sequence is the sequence itself.
+    If fuzzy, the Hamming distance 1 neighbours of the primer sequences are stored too, so that reads with one
+    mismatch in the primer are found with the same lookup. The value of a neighbour is the primer sequence it
+    derives from, which tags it as a fuzzy hit. A neighbour equal to a primer sequence is stored as the primer
 
     :param input_path: the path of the input file to create the automaton for. File to be accessible with SeqIO.
     :param filetype: the type of file (e.g. FASTA)
+    :param fuzzy: whether to store the Hamming distance 1 neighbours of the primer sequences
     :return: the Aho-Corasick automaton object
     """
     automaton = ahocorasick.Automaton()
     with open(input_path, "r") as fd:
-        for record in SeqIO.parse(fd, filetype):
-            seq = str(record.seq)
-            automaton.add_word(seq, seq)
+        sequences = [str(record.seq) for record in SeqIO.parse(fd, filetype)]
+    if fuzzy:
+        for seq in sequences:
+            for neighbour in hamming_neighbours(seq):
+                automaton.add_word(neighbour, seq)
+    for seq in sequences:
+        automaton.add_word(seq, seq)
     return automaton
 
 
@@ -63,6 +104,30 @@ def dump_pickle(output_path: Path, object_to_pickle: Any) -> None:
         Pickle.dump(object_to_pickle, pickle_out)
 
 
+def load_reference_sequence(ref_fasta: Path, reference_hash: Optional[str] = None) -> str:
+    """
+    Return the sequence of a reference FASTA file holding a single record.
+    The sequence is parsed once per process for each distinct file content, whatever the path of the file
+    (e.g. the copy of the same reference in each scheme version directory)
+
+    :param ref_fasta: the reference FASTA file path
+    :param reference_hash: the content hash of the reference FASTA file (file_fingerprint), if already computed
+    :return: the reference sequence
+    """
+    if reference_hash is None:
+        reference_hash = file_fingerprint(ref_fasta)
+    if reference_hash not in _REFERENCE_SEQUENCES:
+        records = list(SeqIO.parse(ref_fasta, FASTA))
+        if not records:
+            raise ValueError(f"No reference sequence in {ref_fasta}")
+        if len(_REFERENCE_SEQUENCES) >= REFERENCE_CACHE_SIZE:
+            # evict the reference parsed first
+            del _REFERENCE_SEQUENCES[next(iter(_REFERENCE_SEQUENCES))]
+        # the reference fasta contains 1 single record
+        _REFERENCE_SEQUENCES[reference_hash] = str(records[-1].seq)
+    return _REFERENCE_SEQUENCES[reference_hash]
+
+
 def _decorate_with_new_line(method: Callable) -> Callable:
     """
     A decorator to automatically add a new line
@@ -83,14 +148,18 @@ def extract_primer_sequences(
     primer: str,
     strands_in_name: list[str] = None,
     left_strand: str = None,
-) -> None:
+    right_primers: bool = False,
+    reference_hash: Optional[str] = None,
+) -> list[str]:
     """
     Extract primer sequences from ref_fasta using coordinates in scheme_bed
     and generate a scheme_fasta containing these sequences.
-    Both left and right primer are needed in PCR sequecing, but here we only need the left primer,
+    Both left and right primer are needed in PCR sequecing. By default we only need the left primer,
     which aligns with the forward read, in order to detect the primers in samples.
     * left primer: forward read
     * right primer: reverse/complement read
+    If right_primers, the right primers are extracted too, reverse complemented: these are the sequences
+    at the beginning of the reads of the reverse strand, which then carry evidence for their scheme as well
 
     Some scheme bed files do not have `strand` (+, -).
     In these cases, the strand is obtained from the sequence name (e.g. _LEFT, _RIGHT).
@@ -102,6 +171,9 @@ def extract_primer_sequences(
     :param primer: the name of the primer (e.g. ARTIC_V4)
     :param strands_in_name: a list containing the strand names. These can be present in the primer name in the BED file
     :param left_strand: the name of the left strand, if specified in the primer name in the BED file
+    :param right_primers: whether to extract the reverse complemented right primers as well
+    :param reference_hash: the content hash of the reference FASTA file, if already computed
+    :return: the primer sequences written to scheme_fasta
     """
 
     if not strands_in_name:
@@ -114,42 +186,53 @@ def extract_primer_sequences(
     if not (scheme_bed and scheme_bed.is_file()):
         raise FileNotFoundError(f"File {scheme_bed} was not found")
 
-    # load the reference sequence
-    # the reference fasta contains 1 single record
-    for seq_record in SeqIO.parse(ref_fasta, FASTA):
-        ref_sequence = str(seq_record.seq)
+    ref_sequence = load_reference_sequence(ref_fasta, reference_hash)
+    primer_sequences = []
 
     with open(scheme_bed, newline="") as bedfile, open(scheme_fasta, "w") as outputfile:
         write = _decorate_with_new_line(outputfile.write)
 
-        def _write_primer(primer: str, bed_row: dict[str, str], seq_idx: int) -> None:
+        def _write_primer(primer: str, bed_row: dict[str, str], seq_idx: int, is_left: bool) -> None:
+            if not (is_left or right_primers):
+                return
             start = int(bed_row[START])
             end = int(bed_row[END])
             primer_sequence = ref_sequence[start:end]
+            if not is_left:
+                # the right primer, as stored at the beginning of the reverse read
+                primer_sequence = reverse_complement(primer_sequence)
             write(f">{primer}_primer_seq_{seq_idx}")
             write(primer_sequence)
+            primer_sequences.append(primer_sequence)
 
         bed_reader = csv.DictReader(bedfile, fieldnames=BED_COLS, delimiter="\t")
         for seq_idx, bed_row in enumerate(bed_reader):
-            # we only extract the forward primer, which matches the forward read
-            # and, if present, is stored at the beginning of the read
+            # the forward primer matches the forward read and, if present, is stored at the beginning of the read
             if bed_row[STRAND]:
-                if bed_row[STRAND] == "+":
-                    # forward strand, extract the sequence
-                    _write_primer(primer, bed_row, seq_idx)
+                if bed_row[STRAND] in ("+", "-"):
+                    _write_primer(primer, bed_row, seq_idx, is_left=bed_row[STRAND] == "+")
             else:
                 # bed_row[STRAND] is None, infer the strand from name if possible or raise error
                 try:
                     inferred_strand = next(s for s in strands_in_name if s in bed_row[NAME])
-                    if inferred_strand == left_strand:
-                        _write_primer(primer, bed_row, seq_idx)
+                    _write_primer(primer, bed_row, seq_idx, is_left=inferred_strand == left_strand)
                 except StopIteration as unknown_strand:
                     raise ValueError(
                         f"Unknown strand in {scheme_bed}. Cannot extract primer sequences"
                     ) from unknown_strand
 
+    return primer_sequences
+
 
-def prepare_dest_files(dest_schemes_path: Path, scheme_name: str, pathogen: str, version_path: Path) -> SCHEME_TYPE:
+def prepare_dest_files(
+    dest_schemes_path: Path,
+    scheme_name: str,
+    pathogen: str,
+    version_path: Path,
+    right_primers: bool = False,
+    fuzzy_primers: bool = False,
+    build: bool = True,
+) -> SCHEME_TYPE:
     """
     Prepare the primers destination files (e.g. reference fasta, scheme BED/FASTA/PICKLE)
 
@@ -157,7 +240,11 @@ def prepare_dest_files(dest_schemes_path: Path, scheme_name: str, pathogen: str,
     :param scheme_name: the name of the primer scheme
     :param pathogen: the name of the pathogen
     :param version_path: the path containing the primer version
-    :return: object storing fasta and pickle paths for each primer scheme
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param build: whether to generate the scheme FASTA and PICKLE files now. If not, only the reference FASTA and
+        the scheme BED are copied, and the scheme files are generated later by build_primer_schemes
+    :return: object storing reference, bed, fasta and pickle paths for each primer scheme
     """
     schemes = {}
     version_name = version_path.name
@@ -165,11 +252,10 @@ def prepare_dest_files(dest_schemes_path: Path, scheme_name: str, pathogen: str,
     version_name = version_name.replace(".", "-").replace("_", "-")
     dest_scheme_path = dest_schemes_path / scheme_name / SARS_COV_2 / version_name
     dest_scheme_path.mkdir(parents=True, exist_ok=True)
+    # the scheme FASTA and PICKLE files are generated from these
     primer_files = [
         f"{pathogen}.{REFERENCE}.{FASTA}",
         f"{pathogen}.{SCHEME}.{BED}",
-        f"{pathogen}.{SCHEME}.{FASTA}",
-        f"{pathogen}.{SCHEME}.{PICKLE}",
     ]
 
     for primer_file in version_path.iterdir():
@@ -182,19 +268,160 @@ def prepare_dest_files(dest_schemes_path: Path, scheme_name: str, pathogen: str,
     scheme_name_version = f"{scheme_name}_{version_name}"
     scheme_fasta_path = dest_scheme_path / f"{pathogen}.{SCHEME}.{FASTA}"
     scheme_pickle_path = dest_scheme_path / f"{pathogen}.{SCHEME}.{PICKLE}"
-    extract_primer_sequences(ref_fasta, scheme_bed, scheme_fasta_path, scheme_name_version)
-    # create an ahocorasick automaton object so that this is can
-    # be loaded quickly for all samples
-    automaton = create_automaton(scheme_fasta_path, FASTA)
-    # Serialise (pickle) the ahocorasick automaton object
-    dump_pickle(scheme_pickle_path, automaton)
+    if build:
+        build_scheme_files(
+            ref_fasta,
+            scheme_bed,
+            scheme_fasta_path,
+            scheme_pickle_path,
+            scheme_name_version,
+            right_primers,
+            fuzzy_primers,
+        )
     schemes[scheme_name_version] = {
+        REFERENCE: ref_fasta,
+        BED: scheme_bed,
         FASTA: scheme_fasta_path,
         PICKLE: scheme_pickle_path,
     }
     return schemes
 
 
+def build_scheme_files(
+    ref_fasta: Path,
+    scheme_bed: Path,
+    scheme_fasta: Path,
+    scheme_pickle: Path,
+    scheme_name_version: str,
+    right_primers: bool = False,
+    fuzzy_primers: bool = False,
+    reference_hash: Optional[str] = None,
+) -> list[str]:
+    """
+    Generate the scheme FASTA and PICKLE files of a primer scheme
+
+    :param ref_fasta: the reference FASTA file path
+    :param scheme_bed: the BED file containing coordinates of scheme primers
+    :param scheme_fasta: the FASTA file of the scheme primers to generate
+    :param scheme_pickle: the PICKLE file of the scheme automaton to generate
+    :param scheme_name_version: the name of the primer scheme and version (e.g. ARTIC_V4)
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param reference_hash: the content hash of the reference FASTA file, if already computed
+    :return: the primer sequences of the scheme
+    """
+    primer_sequences = extract_primer_sequences(
+        ref_fasta,
+        scheme_bed,
+        scheme_fasta,
+        scheme_name_version,
+        right_primers=right_primers,
+        reference_hash=reference_hash,
+    )
+    # create an ahocorasick automaton object so that this is can
+    # be loaded quickly for all samples
+    automaton = create_automaton(scheme_fasta, FASTA, fuzzy_primers)
+    # Serialise (pickle) the ahocorasick automaton object
+    dump_pickle(scheme_pickle, automaton)
+    return primer_sequences
+
+
+def load_build_manifest(manifest_path: Path, build_options: dict) -> dict:
+    """
+    Return the schemes of a build manifest, empty if the manifest is missing, unreadable,
+    or was written by another version or with other build options
+
+    :param manifest_path: the build manifest file
+    :param build_options: the options the scheme files are generated with
+    :return: the content hashes of the inputs and the primer sequences, for each scheme
+    """
+    try:
+        manifest = load_json(manifest_path)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != BUILD_MANIFEST_VERSION or manifest.get("options") != build_options:
+        return {}
+    return manifest.get("schemes", {})
+
+
+def build_primer_schemes(
+    pathogen: str,
+    dest_schemes_path: Path,
+    schemes: SCHEME_TYPE,
+    right_primers: bool = False,
+    fuzzy_primers: bool = False,
+    workers: int = 1,
+) -> dict[str, list[str]]:
+    """
+    Generate the scheme FASTA and PICKLE files of the schemes prepared with build=False, skipping the schemes whose
+    reference FASTA and scheme BED are unchanged since the last build (as recorded in the build manifest).
+    The changed schemes are built in a pool of processes. The directories of the schemes which are not
+    prepared anymore are removed. The build manifest is then updated
+
+    :param pathogen: the pathogen name
+    :param dest_schemes_path: the path storing the destination primer scheme files
+    :param schemes: object storing reference, bed, fasta and pickle paths for each primer scheme
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param workers: the number of processes building the schemes
+    :return: the primer sequences of each scheme, as in the scheme FASTA files
+    """
+    manifest_path = dest_schemes_path / f"{pathogen}{BUILD_MANIFEST_SUFFIX}"
+    build_options = {"right_primers": right_primers, "fuzzy_primers": fuzzy_primers}
+    previous_manifest = load_build_manifest(manifest_path, build_options)
+
+    manifest = {}
+    to_build = []
+    for scheme in sorted(schemes):
+        scheme_files = schemes[scheme]
+        manifest[scheme] = {
+            REFERENCE: file_fingerprint(scheme_files[REFERENCE]),
+            BED: file_fingerprint(scheme_files[BED]),
+        }
+        previous = previous_manifest.get(scheme, {})
+        unchanged = all(previous.get(key) == manifest[scheme][key] for key in (REFERENCE, BED))
+        if unchanged and scheme_files[FASTA].is_file() and scheme_files[PICKLE].is_file():
+            manifest[scheme][PRIMER_SEQUENCES] = previous[PRIMER_SEQUENCES]
+        else:
+            to_build.append(scheme)
+
+    print(f"Building {len(to_build)} primer schemes, {len(schemes) - len(to_build)} unchanged")
+    # consecutive schemes are built by the same worker: group them by reference, parsed once per worker
+    to_build.sort(key=lambda scheme: manifest[scheme][REFERENCE])
+    build_args = [
+        (
+            schemes[scheme][REFERENCE],
+            schemes[scheme][BED],
+            schemes[scheme][FASTA],
+            schemes[scheme][PICKLE],
+            scheme,
+            right_primers,
+            fuzzy_primers,
+            # hashed once for the build manifest, not again when loading the reference sequence
+            manifest[scheme][REFERENCE],
+        )
+        for scheme in to_build
+    ]
+    if workers > 1 and len(to_build) > 1:
+        with Pool(min(workers, len(to_build))) as pool:
+            primer_sequences = pool.starmap(build_scheme_files, build_args)
+    else:
+        primer_sequences = [build_scheme_files(*args) for args in build_args]
+    for scheme, scheme_primer_sequences in zip(to_build, primer_sequences):
+        manifest[scheme][PRIMER_SEQUENCES] = scheme_primer_sequences
+
+    # remove the scheme files of the schemes removed upstream
+    for scheme in set(previous_manifest) - set(manifest):
+        scheme_dir = previous_manifest[scheme].get("directory")
+        if scheme_dir:
+            shutil.rmtree(dest_schemes_path / scheme_dir, ignore_errors=True)
+    for scheme in manifest:
+        manifest[scheme]["directory"] = str(schemes[scheme][FASTA].parent.relative_to(dest_schemes_path))
+
+    write_json({"version": BUILD_MANIFEST_VERSION, "options": build_options, "schemes": manifest}, manifest_path)
+    return {scheme: manifest[scheme][PRIMER_SEQUENCES] for scheme in manifest}
+
+
 def raise_if_not_dir(source_schemes_path: Path) -> None:
     """
     Raise FileNotFoundError if source_schems_path is not a directory
@@ -206,7 +433,12 @@ def raise_if_not_dir(source_schemes_path: Path) -> None:
 
 
 def process_sars_cov_2_epi2me_labs_primers(
-    base_path: Path, source_schemes: str, dest_schemes_path: Path
+    base_path: Path,
+    source_schemes: str,
+    dest_schemes_path: Path,
+    right_primers: bool = False,
+    fuzzy_primers: bool = False,
+    build: bool = True,
 ) -> SCHEME_TYPE:
     """
     Process SARS-CoV-2 primer schemes in the epi2me-labs repo
@@ -214,7 +446,10 @@ def process_sars_cov_2_epi2me_labs_primers(
     :param base_path: the path to the epi2me-labs cloned repository
     :param source_schemes: the subpath to the primer schemes within the cloned repository
     :param dest_schemes_path: the path storing the destination primer scheme files
-    :return: object storing fasta and pickle paths for each primer scheme
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param build: whether to generate the scheme FASTA and PICKLE files now (see prepare_dest_files)
+    :return: object storing reference, bed, fasta and pickle paths for each primer scheme
     """
     schemes = {}
     source_schemes_path = base_path / source_schemes
@@ -223,18 +458,32 @@ def process_sars_cov_2_epi2me_labs_primers(
     for source_scheme_path in source_schemes_path.iterdir():
         scheme_name = source_scheme_path.name
         for version_path in source_scheme_path.iterdir():
-            schemes.update(prepare_dest_files(dest_schemes_path, scheme_name, SARS_COV_2, version_path))
+            schemes.update(
+                prepare_dest_files(
+                    dest_schemes_path, scheme_name, SARS_COV_2, version_path, right_primers, fuzzy_primers, build
+                )
+            )
     return schemes
 
 
-def process_sars_cov_2_quick_lab_primers(base_path: Path, source_schemes: str, dest_schemes_path: Path) -> SCHEME_TYPE:
+def process_sars_cov_2_quick_lab_primers(
+    base_path: Path,
+    source_schemes: str,
+    dest_schemes_path: Path,
+    right_primers: bool = False,
+    fuzzy_primers: bool = False,
+    build: bool = True,
+) -> SCHEME_TYPE:
     """
     Process SARS-CoV-2 ARTIC primer schemes in the quick-lab repo
 
     :param base_path: the path to the quick-lab cloned repository
     :param source_schemes: the subpath to the primer schemes within the cloned repository
     :param dest_schemes_path: the path storing the destination primer scheme files
-    :return: object storing fasta and pickle paths for each primer scheme
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param build: whether to generate the scheme FASTA and PICKLE files now (see prepare_dest_files)
+    :return: object storing reference, bed, fasta and pickle paths for each primer scheme
     """
     schemes = {}
     source_schemes_path = base_path / source_schemes
@@ -274,17 +523,25 @@ def process_sars_cov_2_quick_lab_primers(base_path: Path, source_schemes: str, d
                     bed_writer.writerow(record)
             source_bed.unlink()
 
-            schemes.update(prepare_dest_files(dest_schemes_path, scheme_name, SARS_COV_2, source_scheme_path))
+            schemes.update(
+                prepare_dest_files(
+                    dest_schemes_path, scheme_name, SARS_COV_2, source_scheme_path, right_primers, fuzzy_primers, build
+                )
+            )
     return schemes
 
 
-def generate_primer_index_file(pathogen: str, dest_schemes_path: Path, schemes: SCHEME_TYPE) -> None:
+def generate_primer_index_file(
+    pathogen: str, dest_schemes_path: Path, schemes: SCHEME_TYPE, num_primers: Optional[dict[str, int]] = None
+) -> None:
     """
     Generate an index summarising the primer fasta, pickle and primer number
 
     :param pathogen: the pathogen name
     :param dest_schemes_path: the path storing the destination primer scheme files
     :param schemes: object storing fasta and pickle paths for each primer scheme
+    :param num_primers: the number of primers of each scheme (e.g. from the build manifest),
+        counted from the scheme fasta files if not given
     """
     scheme_index_path = dest_schemes_path / f"{pathogen}_primer_index.csv"
     with open(scheme_index_path, "w", newline="") as outputfile:
@@ -295,19 +552,53 @@ def generate_primer_index_file(pathogen: str, dest_schemes_path: Path, schemes:
             pickle_file = schemes[scheme][PICKLE]
             fasta_path = Path("/") / Path(fasta_file).relative_to(scheme_index_path.parent.parent)
             pickle_path = Path("/") / Path(pickle_file).relative_to(scheme_index_path.parent.parent)
-            num_primers = len(list(SeqIO.parse(fasta_file, FASTA)))
+            if num_primers is not None:
+                scheme_num_primers = num_primers[scheme]
+            else:
+                scheme_num_primers = len(list(SeqIO.parse(fasta_file, FASTA)))
             writer.writerow(
                 {
                     PRIMER_NAME: scheme,
                     FASTA_PATH: fasta_path,
                     PICKLE_PATH: pickle_path,
-                    TOTAL_NUM_PRIMER: num_primers,
+                    TOTAL_NUM_PRIMER: scheme_num_primers,
                 }
             )
             print(f"Generated primer fasta and pickle files:\n - {fasta_path}\n - {pickle_path}")
     print(f"Generated primer index containing number of primers: {scheme_index_path}")
 
 
+def generate_primer_index_bundle(
+    bundle_path: Path,
+    schemes: SCHEME_TYPE,
+    fuzzy_primers: bool = False,
+    scheme_sequences: Optional[dict[str, list[str]]] = None,
+) -> None:
+    """
+    Generate a primer index bundle, holding the primer sequences of all the schemes and a prebuilt automaton,
+    so that primer autodetection can load the whole index with a single read
+
+    :param bundle_path: the path of the bundle to generate
+    :param schemes: object storing fasta and pickle paths for each primer scheme
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param scheme_sequences: the primer sequences of each scheme (e.g. as returned by build_primer_schemes),
+        parsed from the scheme fasta files if not given
+    """
+    if scheme_sequences is None:
+        scheme_sequences = {
+            scheme: [str(record.seq) for record in SeqIO.parse(schemes[scheme][FASTA], FASTA)] for scheme in schemes
+        }
+    num_primers = {scheme: len(sequences) for scheme, sequences in scheme_sequences.items()}
+    fuzzy_scheme_sequences = None
+    if fuzzy_primers:
+        fuzzy_scheme_sequences = {
+            scheme: [neighbour for sequence in sequences for neighbour in hamming_neighbours(sequence)]
+            for scheme, sequences in scheme_sequences.items()
+        }
+    checksum = write_primer_index_bundle(bundle_path, num_primers, scheme_sequences, fuzzy_scheme_sequences)
+    print(f"Generated primer index bundle: {bundle_path} (sha256: {checksum})")
+
+
 ORGANISE_PRIMERS = {
     SARS_COV_2: {
         EPI2ME_LABS: process_sars_cov_2_epi2me_labs_primers,
@@ -323,10 +614,18 @@ def prepare_primers(
     pathogen: str,
     source_schemes: str,
     dest_schemes_path: Path,
+    right_primers: bool = False,
+    fuzzy_primers: bool = False,
+    build: bool = True,
+    cache_dir: Optional[Path] = None,
+    offline: bool = False,
 ) -> SCHEME_TYPE:
     """
     An entry point function for cloning the repository and invoking the repository-specific function
     responsible for organising the primer data.
+    If cache_dir is given, the primer schemes of the repository at the commit are taken from the cache when present,
+    otherwise the repository is cloned and its primer schemes are stored in the cache.
+    If offline, the repository is never cloned: the primer schemes must be in the cache
 
     :param source_name: the name of the source (e.g. 'epi2me_labs')
     :param primer_repo: the repository URL storing the primers
@@ -334,15 +633,33 @@ def prepare_primers(
     :param pathogen: the pathogen name
     :param source_schemes: the subpath to the primer schemes within the cloned repository
     :param dest_schemes_path: the path storing the destination primer scheme files
-    :return: object storing fasta and pickle paths for each primer scheme
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param build: whether to generate the scheme FASTA and PICKLE files now (see prepare_dest_files)
+    :param cache_dir: the directory caching the primer schemes of each repository and commit
+    :param offline: whether to take the primer schemes from the cache only
+    :return: object storing reference, bed, fasta and pickle paths for each primer scheme
     """
+    cache_path = source_cache_path(cache_dir, primer_repo, repo_commit, source_schemes) if cache_dir else None
+    if offline and not (cache_path and cache_path.is_file()):
+        raise FileNotFoundError(f"Primer schemes of {primer_repo} on {repo_commit} not found in cache: {cache_path}")
+
     # use a temporary directory for cloning the repository
     with tempfile.TemporaryDirectory() as tmpdir:
-        print(f"Cloning repo {primer_repo} on {repo_commit}")
         repo_path = Path(tmpdir)
-        repo = Repo.clone_from(primer_repo, repo_path)
-        repo.git.checkout(repo_commit)
-        return ORGANISE_PRIMERS[pathogen][source_name](repo_path, source_schemes, dest_schemes_path)
+        if cache_path and cache_path.is_file():
+            print(f"Using cached primer schemes of repo {primer_repo} on {repo_commit}: {cache_path}")
+            extract_source_tarball(cache_path, repo_path)
+        else:
+            print(f"Cloning repo {primer_repo} on {repo_commit}")
+            repo = Repo.clone_from(primer_repo, repo_path)
+            repo.git.checkout(repo_commit)
+            if cache_path:
+                # cache the primer schemes as cloned, before they are organised in place
+                store_source_tarball(cache_path, repo_path, source_schemes)
+        return ORGANISE_PRIMERS[pathogen][source_name](
+            repo_path, source_schemes, dest_schemes_path, right_primers, fuzzy_primers, build
+        )
 
 
 @click.command()
@@ -364,13 +681,57 @@ def prepare_primers(
     default=SARS_COV_2,
     help="The name of the pathogen",
 )
+@click.option(
+    "--right-primers",
+    is_flag=True,
+    default=False,
+    help="Also store the reverse complemented right primers, so that the reads of the reverse strand are detected",
+)
+@click.option(
+    "--fuzzy-primers",
+    is_flag=True,
+    default=False,
+    help="Also store the primer sequences with one mismatch, so that reads with one sequencing error in the primer "
+    "are detected (reported separately from the exact hits)",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of processes building the primer schemes",
+)
+@click.option(
+    "--rebuild",
+    is_flag=True,
+    default=False,
+    help="Remove the destination directory and build all the primer schemes, ignoring the build manifest",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    default=None,
+    help="Directory caching the primer schemes of each repository and commit: used when present, populated otherwise",
+)
+@click.option(
+    "--offline",
+    is_flag=True,
+    default=False,
+    help="Never clone the primer repositories: take the primer schemes from --cache-dir only",
+)
 def fetch_primers(
     dependencies_file: str,
     dest_schemes: str,
     pathogen: str,
+    right_primers: bool,
+    fuzzy_primers: bool,
+    workers: int,
+    rebuild: bool,
+    cache_dir: Optional[str],
+    offline: bool,
 ) -> None:
     """
     Fetch the SARS-CoV-2 primers and pre-process the primer sequence fasta files.
+    Only the schemes whose reference or bed file changed since the previous run in dest_schemes are built again.
 
     e.g.
     python fetch_primers.py \
@@ -381,9 +742,18 @@ def fetch_primers(
     :param dependencies_file: the file storing the primer sources to use
     :param dest_schemes: the path storing the destination primer scheme files
     :param pathogen: the pathogen name
+    :param right_primers: whether to also store the reverse complemented right primers
+    :param fuzzy_primers: whether to also store the Hamming distance 1 neighbours of the primers in the automaton
+    :param workers: the number of processes building the primer schemes
+    :param rebuild: whether to build all the primer schemes from scratch
+    :param cache_dir: the directory caching the primer schemes of each repository and commit
+    :param offline: whether to take the primer schemes from the cache only
     """
+    if offline and not cache_dir:
+        raise click.UsageError("--offline requires --cache-dir")
     dest_schemes_path = Path(dest_schemes)
-    shutil.rmtree(dest_schemes_path, ignore_errors=True)
+    if rebuild:
+        shutil.rmtree(dest_schemes_path, ignore_errors=True)
 
     schemes = {}
 
@@ -395,10 +765,27 @@ def fetch_primers(
             repo_commit = row["commit"]
             source_schemes = row["source_schemes"]
             schemes.update(
-                prepare_primers(source_name, primer_repo, repo_commit, pathogen, source_schemes, dest_schemes_path)
+                prepare_primers(
+                    source_name,
+                    primer_repo,
+                    repo_commit,
+                    pathogen,
+                    source_schemes,
+                    dest_schemes_path,
+                    right_primers,
+                    fuzzy_primers,
+                    build=False,
+                    cache_dir=Path(cache_dir) if cache_dir else None,
+                    offline=offline,
+                )
             )
 
-    generate_primer_index_file(pathogen, dest_schemes_path, schemes)
+    scheme_sequences = build_primer_schemes(pathogen, dest_schemes_path, schemes, right_primers, fuzzy_primers, workers)
+    num_primers = {scheme: len(sequences) for scheme, sequences in scheme_sequences.items()}
+    generate_primer_index_file(pathogen, dest_schemes_path, schemes, num_primers)
+    generate_primer_index_bundle(
+        dest_schemes_path / f"{pathogen}_primer_index{BUNDLE_SUFFIX}", schemes, fuzzy_primers, scheme_sequences
+    )
 
 
 if __name__ == "__main__":
@@ -2,7 +2,7 @@ import csv
 import click
 
 from app.scripts.contamination_removal import EXPECTED_CONTAMINATION_REMOVAL_HEADERS
-from app.scripts.primer_cols import EXPECTED_PRIMER_AUTODETECTION_HEADERS
+from app.scripts.primer_cols import EXPECTED_PRIMER_AUTODETECTION_HEADERS, EXPECTED_READ_STATS_HEADERS
 from app.scripts.generate_pipeline_results_files import (
     EXPECTED_NCOV_HEADERS,
     EXPECTED_PANGOLIN_HEADERS,
@@ -18,7 +18,7 @@ def write_csv(filename: str, fieldnames: set[str]) -> None:
 @click.command()
 def generate_default_files() -> None:
     """
-    Generate empty CSV files for contamination removal, primer-autodetection, ncov and pangolin.
+    Generate empty CSV files for contamination removal, primer-autodetection, read statistics, ncov and pangolin.
     These are used as default results, if the corresponding nextflow channel is empty.
     This script is used by the dockerfile. It is not used by the pipeline directly.
 
@@ -26,6 +26,7 @@ def generate_default_files() -> None:
     """
     write_csv("contamination_removal_empty.csv", EXPECTED_CONTAMINATION_REMOVAL_HEADERS)
     write_csv("primer_autodetection_empty.csv", EXPECTED_PRIMER_AUTODETECTION_HEADERS)
+    write_csv("read_stats_empty.csv", EXPECTED_READ_STATS_HEADERS)
     write_csv("ncov_qc_empty.csv", EXPECTED_NCOV_HEADERS)
     write_csv("pangolin_empty.csv", EXPECTED_PANGOLIN_HEADERS)
 
@@ -1,4 +1,5 @@
 from pathlib import Path
+from typing import Optional
 from dataclasses import dataclass, field
 from functools import partial, reduce
 
@@ -13,6 +14,9 @@ from app.scripts.contamination_removal import (
 from app.scripts.primer_cols import (
     PRIMER_AUTODETECTION_SAMPLE_ID_COL,
     EXPECTED_PRIMER_AUTODETECTION_HEADERS,
+    OPTIONAL_PRIMER_AUTODETECTION_HEADERS,
+    READ_STATS_SAMPLE_ID_COL,
+    EXPECTED_READ_STATS_HEADERS,
 )
 from app.scripts.util.logger import get_structlog_logger, ERROR, WARNING, INFO
 from app.scripts.util.metadata import EXPECTED_HEADERS as EXPECTED_METADATA_HEADERS, SAMPLE_ID, ILLUMINA, ONT, UNKNOWN
@@ -120,15 +124,18 @@ class SampleIdResultFiles:
 
 
 def load_data_from_csv(
-    csv_file: str, expected_columns: set[str], sample_name_col_to_rename: str = None
+    csv_file: str,
+    expected_columns: set[str],
+    sample_name_col_to_rename: str = None,
+    optional_columns: Optional[set[str]] = None,
 ) -> pd.DataFrame:
     """
     Load the CSV content to a Pandas dataframe. An arbitrary column name used to indentify the sample id
-    can be renamed to "sample_id"
+    can be renamed to "sample_id". The optional columns may be present in addition to the expected columns
     """
     if csv_file:
         df = pd.read_csv(Path(csv_file))
-        check_csv_columns(set(df.columns), expected_columns)
+        check_csv_columns(set(df.columns) - (optional_columns or set()), expected_columns)
         if sample_name_col_to_rename:
             df = df.rename(columns={sample_name_col_to_rename: SAMPLE_ID})
     else:
@@ -424,9 +431,11 @@ def _generate_results_csv(
     df_pangolin: pd.DataFrame,
     qc_unrelated_failing_samples: list[str],
     output_results_csv_file: Path,
+    df_read_stats: Optional[pd.DataFrame] = None,
 ) -> None:
     """
     Generate the pipeline results CSV file.
+    The read statistics columns are added only if df_read_stats is given.
     """
 
     status_col_data = [
@@ -440,6 +449,7 @@ def _generate_results_csv(
         df_status,
         df_contamination_removal,
         df_primer_autodetection,
+        *([] if df_read_stats is None else [df_read_stats]),
         df_ncov_qc,
         df_pangolin,
     ]
@@ -470,9 +480,11 @@ def get_expected_output_files_per_sample(
     output_path: str,
     sample_ids_result_files: SampleIdResultFiles,
     sequencing_technology: str,
+    contamination_removal_batch: bool = False,
 ) -> RESULTFILES_TYPE:
     """
-    Return a dictionary {sample_id, list_of_expected_output_paths}
+    Return a dictionary {sample_id, list_of_expected_output_paths}.
+    If contamination_removal_batch, the contamination removal csv file is written for the whole run, not per sample
     """
     # initialise the dictionary keys
     output_files: RESULTFILES_TYPE = {sample_id: [] for sample_id in sample_ids_result_files.all_samples}
@@ -568,14 +580,15 @@ def get_expected_output_files_per_sample(
                     sample_id=sample_id,
                 )
             )
-            output_files[sample_id].extend(
-                get_file_with_type(
-                    output_path=output_path,
-                    inner_dirs=["contamination_removal"],
-                    filetypes=[FileType("_contamination_removal.csv", "csv-cleaned-sequence-count")],
-                    sample_id=sample_id,
+            if not contamination_removal_batch:
+                output_files[sample_id].extend(
+                    get_file_with_type(
+                        output_path=output_path,
+                        inner_dirs=["contamination_removal"],
+                        filetypes=[FileType("_contamination_removal.csv", "csv-cleaned-sequence-count")],
+                        sample_id=sample_id,
+                    )
                 )
-            )
 
         for sample_id in sample_ids_result_files.primer_autodetection_completed_samples:
             output_files[sample_id].extend(
@@ -640,6 +653,7 @@ def _generate_resultfiles_json(
     sample_ids_result_files: SampleIdResultFiles,
     output_path: str,
     output_resultfiles_json_file: Path,
+    contamination_removal_batch: bool = False,
 ) -> None:
     """
     Generate a JSON file containing the list of expected result files per sample
@@ -648,6 +662,7 @@ def _generate_resultfiles_json(
         output_path=output_path,
         sample_ids_result_files=sample_ids_result_files,
         sequencing_technology=sequencing_technology,
+        contamination_removal_batch=contamination_removal_batch,
     )
 
     write_json(output_files_per_sample, output_resultfiles_json_file)
@@ -671,6 +686,11 @@ def _generate_resultfiles_json(
     type=click.Path(exists=True, file_okay=True, readable=True),
     help="primer autodetection pipeline resulting csv file",
 )
+@click.option(
+    "--read-stats-csv-file",
+    type=click.Path(exists=True, file_okay=True, readable=True),
+    help="read statistics csv file, generated by primer autodetection (optional)",
+)
 @click.option(
     "--ncov-qc-csv-file",
     type=click.Path(exists=True, file_okay=True, readable=True),
@@ -711,11 +731,19 @@ def _generate_resultfiles_json(
     required=True,
     help="the sequencer technology used for sequencing the samples",
 )
+@click.option(
+    "--contamination-removal-batch",
+    is_flag=True,
+    default=False,
+    help="the contamination removal csv file was written for the whole run (contamination_removal.py --batch), "
+    "there is no contamination removal csv file per sample",
+)
 def generate_pipeline_results_files(
     analysis_run_name: str,
     metadata_file: str,
     contamination_removal_csv_file: str,
     primer_autodetection_csv_file: str,
+    read_stats_csv_file: Optional[str],
     ncov_qc_csv_file: str,
     pangolin_csv_file: str,
     output_results_csv_file: Path,
@@ -723,6 +751,7 @@ def generate_pipeline_results_files(
     output_resultfiles_json_file: str,
     output_path: str,
     sequencing_technology: str,
+    contamination_removal_batch: bool,
 ) -> None:
     """
     Generate pipeline results files
@@ -738,6 +767,12 @@ def generate_pipeline_results_files(
         primer_autodetection_csv_file,
         EXPECTED_PRIMER_AUTODETECTION_HEADERS,
         PRIMER_AUTODETECTION_SAMPLE_ID_COL,
+        OPTIONAL_PRIMER_AUTODETECTION_HEADERS,
+    )
+    df_read_stats = (
+        load_data_from_csv(read_stats_csv_file, EXPECTED_READ_STATS_HEADERS, READ_STATS_SAMPLE_ID_COL)
+        if read_stats_csv_file
+        else None
     )
     df_ncov_qc = load_data_from_csv(ncov_qc_csv_file, EXPECTED_NCOV_HEADERS, NCOV_SAMPLE_ID_COL)
     df_pangolin = load_data_from_csv(pangolin_csv_file, EXPECTED_PANGOLIN_HEADERS, PANGOLIN_SAMPLE_ID_COL)
@@ -758,6 +793,7 @@ def generate_pipeline_results_files(
         df_pangolin,
         qc_unrelated_failing_samples,
         output_results_csv_file,
+        df_read_stats,
     )
 
     csv_to_json(output_results_csv_file, output_results_json_file, SAMPLE_ID)
@@ -786,7 +822,11 @@ def generate_pipeline_results_files(
     )
 
     _generate_resultfiles_json(
-        sequencing_technology, sample_ids_result_files, output_path, Path(output_resultfiles_json_file)
+        sequencing_technology,
+        sample_ids_result_files,
+        output_path,
+        Path(output_resultfiles_json_file),
+        contamination_removal_batch,
     )
 
 
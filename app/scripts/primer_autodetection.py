@@ -1,15 +1,52 @@
 from pathlib import Path
-from typing import Any
+from typing import Any, Iterable, Iterator, NamedTuple, Optional
+from collections import Counter, deque
+from contextlib import closing
+from functools import lru_cache, partial
+from itertools import islice
+from multiprocessing import Pool
+from statistics import NormalDist
+from time import perf_counter
 import csv
+import hashlib
+import json
+import math
 import pickle
-import gzip
-from dataclasses import dataclass, field
+from dataclasses import asdict, dataclass, field
+import numpy as np
 import pandas as pd
 import click
-from Bio import SeqIO
 import ahocorasick
 
 from app.scripts.concat_csv import concat
+from app.scripts.util.contamination_removal_gate import is_gated
+from app.scripts.util.data_loading import write_json
+from app.scripts.util.file_hash import file_fingerprint
+from app.scripts.util.fastq import (
+    is_gzipped,
+    is_stream,
+    iter_fastq_chunks,
+    iter_fastq_sequences,
+    iter_fastq_sequences_in_blocks,
+    iter_fastq_sequences_in_chunk,
+    iter_fastq_sequences_in_range,
+    sample_bgzf_blocks,
+    split_fastq,
+    SAMPLED_BLOCK_TYPE,
+    STDIN_PATH,
+)
+from app.scripts.util.logger import get_structlog_logger
+from app.scripts.util.packed_prefix_index import PackedPrefixIndex
+from app.scripts.util.read_stats import ReadStats
+from app.scripts.util.stage_timings import StageTimings
+from app.scripts.util.primer_index_bundle import is_primer_index_bundle, load_primer_index_bundle
+from app.scripts.util.shared_packed_index import load_shared_packed_index
+from app.scripts.util.primer_result_cache import (
+    DEFAULT_RESULT_CACHE_MAX_BYTES,
+    load_cached_result,
+    result_cache_key,
+    store_cached_result,
+)
 
 from app.scripts.primer_cols import (
     PRIMER_INDEX_COLS,
@@ -22,22 +59,72 @@ from app.scripts.primer_cols import (
     PRIMER_AUTODETECTION_NUMREADS_COL,
     PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL,
     PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL,
+    PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL,
     PRIMER_AUTODETECTION_COVERAGE_COL,
+    READ_STATS_COLS,
+    READ_STATS_SAMPLE_ID_COL,
+    READ_STATS_NUMREADS_COL,
+    READ_STATS_TOTAL_BASES_COL,
+    READ_STATS_MIN_LENGTH_COL,
+    READ_STATS_MEAN_LENGTH_COL,
+    READ_STATS_MAX_LENGTH_COL,
+    READ_STATS_GC_FRACTION_COL,
+    READ_STATS_N_RATE_COL,
+    READ_LENGTH_COL,
+    READ_LENGTH_NUMREADS_COL,
 )
 
+log_file = f"{Path(__file__).stem}.log"
+logger = get_structlog_logger(log_file=log_file)
+
 UNKNOWN = "unknown"
 
 COVERAGE_SUFFIX = ".coverage.csv"
 PRIMER_DETECTION_SUFFIX = "_primer_detection.csv"
 PRIMER_DATA_SUFFIX = "_primer_data.csv"
+SELECTED_PRIMER_SUFFIX = "_primer.txt"
+PRIMER_STATS_SUFFIX = "_primer_stats.json"
+PRIMER_TIMINGS_SUFFIX = "_primer_timings.json"
+READ_STATS_SUFFIX = "_read_stats.csv"
+READ_LENGTH_HISTOGRAM_SUFFIX = "_read_length_histogram.csv"
+
+# maximum number of distinct read prefixes whose match is cached
+PREFIX_CACHE_SIZE = 65536
+
+# number of reads scanned between two evaluations of the stopping rule
+STOPPING_RULE_CHECK_INTERVAL = 1000
+# number of read prefixes matched at once, without stopping rule
+SCAN_BATCH_SIZE = 100000
+# number of decompressed bytes (whole FASTQ records) sent to a worker process at once
+PARALLEL_CHUNK_SIZE = 4 * 1024 * 1024
+# maximum number of chunks in flight per worker process
+PARALLEL_CHUNKS_IN_FLIGHT = 2
+
+# a sample with primers is expected to have at least this fraction of reads starting with a primer
+MIN_PRIMER_HIT_RATE = 0.01
 
 PRIMER_AUTODETECTION_PRIMER_SCORE_COL = PRIMER_AUTODETECTION_NUMREADS_COL
 
+# columns of the primer coverage files and of the primer detection file
+PRIMER_COVERAGE_COLS = [
+    PRIMER_AUTODETECTION_PRIMER_COL,
+    TOTAL_NUM_PRIMER,
+    PRIMER_AUTODETECTION_NUMREADS_COL,
+    PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL,
+    PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL,
+]
+
+# engines matching the read prefixes against the primer sequences
+AUTOMATON_ENGINE = "automaton"
+PACKED_ENGINE = "packed"
+MATCHING_ENGINES = [AUTOMATON_ENGINE, PACKED_ENGINE]
+
 
 @dataclass
 class PrimerAutomaton:
     data: dict = field(metadata={"required": True})
-    automaton: ahocorasick.Automaton = field(metadata={"required": True})
+    # None if the primer index was loaded from a bundle: the bundle only holds the unified automaton
+    automaton: Optional[ahocorasick.Automaton] = field(metadata={"required": True})
 
 
 def load_pickle(input_path: Path) -> Any:
@@ -61,15 +148,9 @@ def build_primers_automaton(primer_index: Path) -> dict[str, PrimerAutomaton]:
         for row in reader:
             primer = row[PRIMER_NAME]
             primer_pickle_path = Path(row[PICKLE_PATH])
-            data = {
-                PRIMER_AUTODETECTION_PRIMER_COL: primer,
-                TOTAL_NUM_PRIMER: int(row[TOTAL_NUM_PRIMER]),
-                PRIMER_AUTODETECTION_NUMREADS_COL: 0,
-                PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL: 0,
-                PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL: 0,
-            }
+            data = new_primer_data(primer, int(row[TOTAL_NUM_PRIMER]))
 
-            # this can be optimised by generating the automaton at build time (one-off)
+            # see load_primer_index for loading the prebuilt automata of all schemes at once
             automaton = load_pickle(primer_pickle_path)
             primers_automaton[primer] = PrimerAutomaton(
                 data=data,
@@ -79,93 +160,1037 @@ def build_primers_automaton(primer_index: Path) -> dict[str, PrimerAutomaton]:
     return primers_automaton
 
 
-def count_primer_matches(sample_fastq: Path, primers_automaton: dict) -> dict:
+def new_primer_data(primer: str, total_num_primers: int) -> dict:
     """
-    Perform an exact search of the primer sequences (all schemes) in the sample_fastq
+    Return the metrics of a primer scheme before scanning a sample
+    """
+    return {
+        PRIMER_AUTODETECTION_PRIMER_COL: primer,
+        TOTAL_NUM_PRIMER: total_num_primers,
+        PRIMER_AUTODETECTION_NUMREADS_COL: 0,
+        PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL: 0,
+        PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL: 0,
+    }
+
+
+@dataclass
+class UnifiedPrimerAutomaton:
+    # key: primer sequence, value: the tuple of primer schemes containing that sequence.
+    # The fuzzy sequences that are not primer sequences are keys too, with an empty tuple of schemes
+    automaton: ahocorasick.Automaton = field(metadata={"required": True})
+    # only the read prefix up to this length can match a primer
+    max_primer_length: int = field(metadata={"required": True})
+    # key: sequence at Hamming distance 1 from primer sequences, value: the tuple of primer schemes containing them.
+    # Empty unless the primer index was built with the fuzzy sequences. The sequences equal to a primer sequence
+    # (of another scheme) are dropped: a read starting with them is an exact hit only
+    fuzzy_schemes_per_sequence: dict[str, tuple] = field(default_factory=dict)
+    # integer ids assigned when the index is built: the id of a primer sequence is its index in primer_sequences
+    # (sorted, fuzzy sequences included), the id of a scheme its index in scheme_names (sorted)
+    primer_sequences: list[str] = field(init=False)
+    scheme_names: list[str] = field(init=False)
+    primer_ids: dict[str, int] = field(init=False)
+    scheme_ids: dict[str, int] = field(init=False)
+    # (number of primer sequences, number of schemes) bool matrix: the schemes containing each primer sequence
+    primer_schemes: np.ndarray = field(init=False)
+    # same as primer_schemes, for the fuzzy sequences
+    fuzzy_primer_schemes: np.ndarray = field(init=False)
+    # the packed index of the primer sequences, if attached from a node-wide directory.
+    # Otherwise the packed engine builds its own
+    packed_index: Optional[PackedPrefixIndex] = field(default=None, repr=False)
+
+    def __post_init__(self) -> None:
+        self.fuzzy_schemes_per_sequence = {
+            sequence: schemes
+            for sequence, schemes in self.fuzzy_schemes_per_sequence.items()
+            if not self.automaton.get(sequence, ())
+        }
+        schemes_per_sequence = sorted(self.automaton.items())
+        self.primer_sequences = [sequence for sequence, _ in schemes_per_sequence]
+        self.scheme_names = sorted(
+            {primer for _, schemes in schemes_per_sequence for primer in schemes}
+            | {primer for schemes in self.fuzzy_schemes_per_sequence.values() for primer in schemes}
+        )
+        self.primer_ids = {sequence: primer_id for primer_id, sequence in enumerate(self.primer_sequences)}
+        self.scheme_ids = {primer: scheme_id for scheme_id, primer in enumerate(self.scheme_names)}
+        self.primer_schemes = np.zeros((len(self.primer_sequences), len(self.scheme_names)), dtype=bool)
+        self.fuzzy_primer_schemes = np.zeros_like(self.primer_schemes)
+        for primer_id, (sequence, schemes) in enumerate(schemes_per_sequence):
+            self.primer_schemes[primer_id, [self.scheme_ids[primer] for primer in schemes]] = True
+            self.fuzzy_primer_schemes[
+                primer_id, [self.scheme_ids[primer] for primer in self.fuzzy_schemes_per_sequence.get(sequence, ())]
+            ] = True
+
+    @property
+    def is_fuzzy(self) -> bool:
+        """
+        True if the primer index holds the Hamming distance 1 neighbours of the primer sequences
+        """
+        return bool(self.fuzzy_schemes_per_sequence)
+
+
+@dataclass
+class PrimerHits:
+    """
+    The primer hits of (a part of) a sample, indexed by the integer ids of the unified automaton.
+    Their size does not depend on the number of reads. The hits of several parts of a sample
+    (batches, workers, fastq files) are merged with a bitwise OR and array additions
+    """
+
+    # whether each primer sequence matched at least one read exactly
+    found_primers: np.ndarray = field(metadata={"required": True})
+    # number of reads with an exact match for each scheme
+    numreads: np.ndarray = field(metadata={"required": True})
+    # number of reads with matches only upon Ns for each scheme
+    ambiguous_numreads: np.ndarray = field(metadata={"required": True})
+    # number of reads with a one-mismatch match for each scheme, and no exact match for any scheme
+    fuzzy_numreads: np.ndarray = field(metadata={"required": True})
+    reads: int = 0
+
+    @classmethod
+    def empty(cls, unified_automaton: UnifiedPrimerAutomaton) -> "PrimerHits":
+        num_primers, num_schemes = unified_automaton.primer_schemes.shape
+        return cls(
+            found_primers=np.zeros(num_primers, dtype=bool),
+            numreads=np.zeros(num_schemes, dtype=np.int64),
+            ambiguous_numreads=np.zeros(num_schemes, dtype=np.int64),
+            fuzzy_numreads=np.zeros(num_schemes, dtype=np.int64),
+        )
+
+    def merge(self, other: "PrimerHits") -> "PrimerHits":
+        """
+        Add the hits of other to these hits
+        """
+        self.found_primers |= other.found_primers
+        self.numreads += other.numreads
+        self.ambiguous_numreads += other.ambiguous_numreads
+        self.fuzzy_numreads += other.fuzzy_numreads
+        self.reads += other.reads
+        return self
+
+
+class PrefixMatch(NamedTuple):
+    """
+    The primers matching a read prefix
+    """
+
+    # primer sequences (all schemes) matching exactly, fuzzy sequences included
+    found_primers: frozenset
+    # schemes with at least one exact match
+    found_schemes: tuple
+    # schemes with at least one match only upon Ns in the read prefix
+    ambiguous_schemes: tuple
+    # schemes with at least one one-mismatch match, if no scheme has an exact match
+    fuzzy_schemes: tuple = ()
+
+
+NO_MATCH = PrefixMatch(found_primers=frozenset(), found_schemes=(), ambiguous_schemes=())
+
+
+@dataclass
+class PrimerMatchStats:
+    """
+    Statistics about the primer matching of a sample
+    """
+
+    reads: int = 0
+    # True if the scan stopped before the end of the sample fastq
+    stopped_early: bool = False
+    prefix_cache_hits: int = 0
+    prefix_cache_misses: int = 0
+    # time spent loading the primer index
+    index_load_seconds: float = 0.0
+    # True if the metrics were reused from the result cache instead of scanning the sample fastq
+    result_cache_hit: bool = False
+    # number of BGZF blocks whose reads were sampled, 0 if the sample fastq was read sequentially
+    sampled_blocks: int = 0
+
+    @property
+    def prefix_cache_hit_rate(self) -> float:
+        lookups = self.prefix_cache_hits + self.prefix_cache_misses
+        return self.prefix_cache_hits / lookups if lookups else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "prefix_cache_hit_rate": self.prefix_cache_hit_rate}
+
+
+@dataclass
+class StoppingRule:
+    """
+    Rule for stopping the scan of the sample reads before the end of the file.
+    * max_reads: the maximum number of reads to scan
+    * confidence: stop as soon as the scheme with the highest number of reads
+      cannot be overturned by the runner-up at this confidence level, or as soon as
+      enough reads were scanned without any primer to conclude that the sample has no primers
+    """
+
+    max_reads: Optional[int] = None
+    confidence: Optional[float] = None
+    # the rule is evaluated every check_interval reads
+    check_interval: int = STOPPING_RULE_CHECK_INTERVAL
+
+    @property
+    def zero_hit_reads(self) -> int:
+        """
+        The number of reads without any primer match after which a sample is considered to have no primers.
+        If no read out of n matches, the hit rate is lower than -ln(1 - confidence) / n at the given confidence
+        """
+        return math.ceil(-math.log(1 - self.confidence) / MIN_PRIMER_HIT_RATE)
+
+    def lead_z_score(self, look: int) -> float:
+        """
+        The z score the lead must exceed at the given evaluation of the rule (1 for the first one).
+        The rule is evaluated repeatedly on the growing counts, so the error probability 1 - confidence is
+        spent over the evaluations: (1 - confidence) / (look * (look + 1)) at each one. These sum to
+        1 - confidence over any number of evaluations, so the probability of ever stopping on the wrong leader
+        stays below 1 - confidence however many reads are scanned (union bound)
+        """
+        return NormalDist().inv_cdf(1 - (1 - self.confidence) / (look * (look + 1)))
+
+    def is_decided(self, numreads: Iterable[int], reads: int) -> bool:
+        """
+        Return True if the primer scheme detection cannot change by scanning more reads.
+        The reads matching the leading scheme but not the runner-up (and viceversa) are modelled as
+        Bernoulli trials. The lead is significant if it exceeds z * sqrt(n), n being the number of trials,
+        and z the lead_z_score of this evaluation, the rule being evaluated every check_interval reads.
+        As the reads matching both schemes are not known here, the sum of the reads of the two schemes
+        is used as n, which is conservative
+        """
+        if self.confidence is None:
+            return False
+        leader, runner_up = (sorted(numreads, reverse=True) + [0, 0])[:2]
+        if leader == 0:
+            return reads >= self.zero_hit_reads
+        look = max(1, math.ceil(reads / self.check_interval))
+        return leader - runner_up > self.lead_z_score(look) * math.sqrt(leader + runner_up)
+
+
+def build_unified_automaton(primers_automaton: dict[str, PrimerAutomaton]) -> UnifiedPrimerAutomaton:
+    """
+    Merge the primer sequences of all schemes into one single automaton.
+    Each primer sequence is stored once and mapped to the schemes containing it, so that
+    a read prefix is resolved with one traversal, regardless of the number of schemes.
+    The fuzzy sequences of the scheme automata (whose value is the primer sequence they derive from,
+    see fetch_primers.create_automaton) are mapped to their schemes separately
+    """
+    schemes_per_sequence: dict[str, list[str]] = {}
+    fuzzy_schemes_per_sequence: dict[str, list[str]] = {}
+    for primer, primer_auto in primers_automaton.items():
+        for sequence, primer_sequence in primer_auto.automaton.items():
+            if sequence == primer_sequence:
+                schemes_per_sequence.setdefault(sequence, []).append(primer)
+            else:
+                fuzzy_schemes_per_sequence.setdefault(sequence, []).append(primer)
+
+    automaton = ahocorasick.Automaton()
+    for sequence in fuzzy_schemes_per_sequence:
+        automaton.add_word(sequence, ())
+    for sequence, schemes in schemes_per_sequence.items():
+        automaton.add_word(sequence, tuple(schemes))
+
+    return UnifiedPrimerAutomaton(
+        automaton=automaton,
+        max_primer_length=max((len(sequence) for sequence in automaton.keys()), default=0),
+        fuzzy_schemes_per_sequence={
+            sequence: tuple(schemes) for sequence, schemes in fuzzy_schemes_per_sequence.items()
+        },
+    )
+
+
+@dataclass
+class LoadedPrimerIndex:
+    primers_automaton: dict[str, PrimerAutomaton] = field(metadata={"required": True})
+    unified_automaton: UnifiedPrimerAutomaton = field(metadata={"required": True})
+    # the checksum of the primer index bundle, empty for a CSV primer index
+    checksum: str = field(default="")
+    load_seconds: float = field(default=0.0)
+
+
+def load_primer_index(primer_index: Path, shared_index_dir: Optional[Path] = None) -> LoadedPrimerIndex:
+    """
+    Load a primer index, either a primer index bundle or a CSV primer index with one pickled automaton per scheme.
+    The format is detected from the content.
+    If shared_index_dir is given, the packed index of the primer sequences is attached from this node-wide directory,
+    where the first process loading the primer index publishes it
+    """
+    start = perf_counter()
+    if is_primer_index_bundle(primer_index):
+        bundle = load_primer_index_bundle(primer_index)
+        loaded_index = LoadedPrimerIndex(
+            primers_automaton={
+                primer: PrimerAutomaton(data=new_primer_data(primer, num_primers), automaton=None)
+                for primer, num_primers in bundle.num_primers.items()
+            },
+            unified_automaton=UnifiedPrimerAutomaton(
+                automaton=bundle.automaton,
+                max_primer_length=bundle.max_primer_length,
+                fuzzy_schemes_per_sequence=bundle.fuzzy_schemes_per_sequence,
+            ),
+            checksum=bundle.checksum,
+        )
+    else:
+        primers_automaton = build_primers_automaton(primer_index)
+        loaded_index = LoadedPrimerIndex(
+            primers_automaton=primers_automaton,
+            unified_automaton=build_unified_automaton(primers_automaton),
+        )
+    if shared_index_dir is not None:
+        unified_automaton = loaded_index.unified_automaton
+        unified_automaton.packed_index = load_shared_packed_index(
+            shared_index_dir, primer_index_checksum(loaded_index), partial(build_packed_index, unified_automaton)
+        )
+    loaded_index.load_seconds = perf_counter() - start
+    logger.info(
+        "Primer index loaded",
+        primer_index=str(primer_index),
+        checksum=loaded_index.checksum,
+        load_seconds=loaded_index.load_seconds,
+    )
+    return loaded_index
+
+
+def primer_index_checksum(loaded_index: LoadedPrimerIndex) -> str:
+    """
+    Return the checksum of a primer index bundle or, for a CSV primer index, the SHA-256 of the loaded primers
+    """
+    if loaded_index.checksum:
+        return loaded_index.checksum
+    unified_automaton = loaded_index.unified_automaton
+    loaded_primers = [
+        sorted(unified_automaton.automaton.items()),
+        sorted(
+            (primer, primer_auto.data[TOTAL_NUM_PRIMER])
+            for primer, primer_auto in loaded_index.primers_automaton.items()
+        ),
+    ]
+    if unified_automaton.is_fuzzy:
+        loaded_primers.append(sorted(unified_automaton.fuzzy_schemes_per_sequence.items()))
+    content = json.dumps(loaded_primers)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def match_read_prefix(
+    automaton: ahocorasick.Automaton, read_prefix: str, fuzzy_schemes_per_sequence: Optional[dict] = None
+) -> PrefixMatch:
+    """
+    Search the primer sequences (all schemes) matching the read prefix.
+    The fuzzy sequences of the automaton (if any) are found by the same lookup: the schemes of the fuzzy sequences
+    found are reported only if the read prefix has no exact match for any scheme, so that a read of a scheme is not
+    also counted for the schemes with a primer one base away
+    """
+    # search for primers (all schemes) matching the prefix of sample_read
+    # (the wildcard argument is mandatory, but unused - no base will ever be '?'), e.g.
+    # keys: ['AGA', 'AAGA', 'ATGA', 'GTAT']
+    # sample_read: 'AAGATT'
+    # output: ['AAGA']
+    found_primers = frozenset(automaton.keys(read_prefix, "?", ahocorasick.MATCH_AT_MOST_PREFIX))
+    # search for primers matching the prefix of sample_read (wildcard 'N' is used).
+    # This enables the counting of primers upon uncertainty in sample reads. e.g.
+    # keys: ['AGA', 'AAGA', 'ATGA', 'GTAT']
+    # sample_read: 'ANGATT'
+    # output: ['AAGA', 'ATGA']
+    # The found primers (if any) are removed as those are exact matches.
+    # As the exact matches of a scheme are a subset of all the exact matches,
+    # this is equivalent to searching each scheme separately
+    ambiguous_primers = (
+        set(automaton.keys(read_prefix, "N", ahocorasick.MATCH_AT_MOST_PREFIX)) - found_primers
+        if "N" in read_prefix
+        else set()
+    )
+    if not (found_primers or ambiguous_primers):
+        return NO_MATCH
+
+    # each scheme is incremented at most once per read
+    found_schemes = {primer for seq in found_primers for primer in automaton.get(seq)}
+    ambiguous_schemes = {primer for seq in ambiguous_primers for primer in automaton.get(seq)}
+    fuzzy_schemes = set()
+    if fuzzy_schemes_per_sequence and not found_schemes:
+        fuzzy_schemes = {primer for seq in found_primers for primer in fuzzy_schemes_per_sequence.get(seq, ())}
+    return PrefixMatch(
+        found_primers=found_primers,
+        found_schemes=tuple(sorted(found_schemes)),
+        ambiguous_schemes=tuple(sorted(ambiguous_schemes)),
+        fuzzy_schemes=tuple(sorted(fuzzy_schemes)),
+    )
+
+
+def count_prefix_matches(unified_automaton: UnifiedPrimerAutomaton, prefix_matches: Counter) -> PrimerHits:
+    """
+    Convert the number of reads of each distinct prefix match into primer hits
+    """
+    hits = PrimerHits.empty(unified_automaton)
+    for prefix_match, count in prefix_matches.items():
+        hits.reads += count
+        if prefix_match is NO_MATCH:
+            continue
+        hits.found_primers[[unified_automaton.primer_ids[sequence] for sequence in prefix_match.found_primers]] = True
+        hits.numreads[[unified_automaton.scheme_ids[primer] for primer in prefix_match.found_schemes]] += count
+        hits.ambiguous_numreads[
+            [unified_automaton.scheme_ids[primer] for primer in prefix_match.ambiguous_schemes]
+        ] += count
+        hits.fuzzy_numreads[[unified_automaton.scheme_ids[primer] for primer in prefix_match.fuzzy_schemes]] += count
+    return hits
+
+
+class AutomatonPrefixMatcher:
+    """
+    Match read prefixes one by one in the unified automaton.
+    Amplicon reads are highly redundant at their 5' end, as most of them start with a primer.
+    The match of each distinct prefix is computed once and cached
+    """
+
+    def __init__(self, unified_automaton: UnifiedPrimerAutomaton, prefix_cache_size: int = PREFIX_CACHE_SIZE):
+        self.unified_automaton = unified_automaton
+        self.match_prefix = lru_cache(maxsize=prefix_cache_size)(
+            partial(
+                match_read_prefix,
+                unified_automaton.automaton,
+                fuzzy_schemes_per_sequence=unified_automaton.fuzzy_schemes_per_sequence,
+            )
+        )
+
+    def match_prefixes(self, read_prefixes: Iterable[str]) -> PrimerHits:
+        """
+        Return the primer hits of the read prefixes
+        """
+        return count_prefix_matches(self.unified_automaton, Counter(map(self.match_prefix, read_prefixes)))
+
+    def cache_stats(self) -> tuple[int, int]:
+        """
+        Return the cumulative number of prefix cache hits and misses
+        """
+        cache_info = self.match_prefix.cache_info()
+        return cache_info.hits, cache_info.misses
+
+
+def build_packed_index(unified_automaton: UnifiedPrimerAutomaton) -> PackedPrefixIndex:
+    """
+    Build the packed index of the primer sequences, with the primer ids of the unified automaton.
+    The fuzzy sequences have no scheme upon N wildcards: only the primer sequences are matched upon wildcards
+    """
+    return PackedPrefixIndex(
+        unified_automaton.primer_sequences, np.flatnonzero(unified_automaton.primer_schemes.any(axis=1))
+    )
+
+
+class PackedPrefixMatcher:
+    """
+    Match batches of read prefixes with vectorised binary searches of the 2-bit packed primer sequences.
+    The packed index uses the primer ids of the unified automaton.
+    Each batch is deduplicated first: the distinct prefixes of a batch count as cache misses,
+    the other prefixes as cache hits
+    """
+
+    def __init__(self, unified_automaton: UnifiedPrimerAutomaton):
+        self.unified_automaton = unified_automaton
+        self.index = unified_automaton.packed_index
+        if self.index is None:
+            self.index = build_packed_index(unified_automaton)
+        self.prefix_cache_hits = self.prefix_cache_misses = 0
+
+    def match_prefixes(self, read_prefixes: Iterable[str]) -> PrimerHits:
+        """
+        Return the primer hits of the read prefixes
+        """
+        read_prefixes = list(read_prefixes)
+        packed_matches = self.index.match(read_prefixes)
+        self.prefix_cache_hits += len(read_prefixes) - packed_matches.distinct_prefixes
+        self.prefix_cache_misses += packed_matches.distinct_prefixes
+
+        primer_schemes = self.unified_automaton.primer_schemes
+        fuzzy_primer_schemes = self.unified_automaton.fuzzy_primer_schemes
+        hits = PrimerHits.empty(self.unified_automaton)
+        hits.reads = len(read_prefixes)
+        for (exact_ids, wildcard_ids), count in packed_matches.outcomes.items():
+            hits.found_primers[list(exact_ids)] = True
+            # each scheme is incremented at most once per read
+            found_schemes = primer_schemes[list(exact_ids)].any(axis=0)
+            hits.numreads += count * found_schemes
+            hits.ambiguous_numreads += count * primer_schemes[list(wildcard_ids)].any(axis=0)
+            if not found_schemes.any():
+                hits.fuzzy_numreads += count * fuzzy_primer_schemes[list(exact_ids)].any(axis=0)
+        return hits
+
+    def cache_stats(self) -> tuple[int, int]:
+        """
+        Return the cumulative number of prefix cache hits and misses
+        """
+        return self.prefix_cache_hits, self.prefix_cache_misses
+
+
+PrefixMatcher = AutomatonPrefixMatcher | PackedPrefixMatcher
+
+
+def build_prefix_matcher(
+    unified_automaton: UnifiedPrimerAutomaton,
+    prefix_cache_size: int = PREFIX_CACHE_SIZE,
+    engine: str = AUTOMATON_ENGINE,
+) -> PrefixMatcher:
+    """
+    Build the read prefix matcher of the given engine
+    """
+    if engine == AUTOMATON_ENGINE:
+        return AutomatonPrefixMatcher(unified_automaton, prefix_cache_size)
+    if engine == PACKED_ENGINE:
+        return PackedPrefixMatcher(unified_automaton)
+    raise ValueError(f"Unknown matching engine {engine}, expected one of: {', '.join(MATCHING_ENGINES)}")
+
+
+def _scan_sample_reads(
+    read_prefixes: Iterator[str],
+    matcher: PrefixMatcher,
+    stopping_rule: StoppingRule = None,
+) -> tuple[PrimerHits, bool]:
+    """
+    Count the primer hits of the sample read prefixes, until the stopping rule (if any) is met.
+    The read prefixes are matched by chunks.
+    Return the hits and whether the scan stopped before the last read
+    """
+    hits = PrimerHits.empty(matcher.unified_automaton)
+    while True:
+        if stopping_rule is None:
+            chunk_hits = matcher.match_prefixes(islice(read_prefixes, SCAN_BATCH_SIZE))
+            if not chunk_hits.reads:
+                return hits, False
+            hits.merge(chunk_hits)
+            continue
+
+        chunk_size = stopping_rule.check_interval
+        if stopping_rule.max_reads is not None:
+            if hits.reads >= stopping_rule.max_reads:
+                # the scan stopped early if there are reads left
+                return hits, next(read_prefixes, None) is not None
+            chunk_size = min(chunk_size, stopping_rule.max_reads - hits.reads)
+        chunk_hits = matcher.match_prefixes(islice(read_prefixes, chunk_size))
+        hits.merge(chunk_hits)
+        if chunk_hits.reads < chunk_size:
+            # end of the file
+            return hits, False
+        if stopping_rule.is_decided(hits.numreads.tolist(), hits.reads):
+            return hits, True
+
+
+class ReadScan(NamedTuple):
+    """
+    The result of scanning the reads of a sample
+    """
+
+    hits: PrimerHits
+    # True if the scan stopped before the last read
+    stopped_early: bool
+    prefix_cache_hits: int
+    prefix_cache_misses: int
+    # statistics of all the reads, accumulated while scanning them (only if requested)
+    read_stats: Optional[ReadStats] = None
+
+
+def _iter_sample_reads(sample_fastq: Path, sampled_blocks: Optional[list[SAMPLED_BLOCK_TYPE]] = None) -> Iterator[str]:
+    """
+    Yield the sequences of the sample reads: all of them, or only the reads of the sampled BGZF blocks if given
+    """
+    if sampled_blocks is None:
+        return iter_fastq_sequences(sample_fastq)
+    return iter_fastq_sequences_in_blocks(sample_fastq, sampled_blocks)
+
+
+def _scan_sample_fastq(
+    sample_fastq: Path,
+    unified_automaton: UnifiedPrimerAutomaton,
+    prefix_cache_size: int,
+    stopping_rule: StoppingRule = None,
+    engine: str = AUTOMATON_ENGINE,
+    collect_read_stats: bool = False,
+    sampled_blocks: Optional[list[SAMPLED_BLOCK_TYPE]] = None,
+) -> ReadScan:
+    """
+    Scan the reads of the sample_fastq in the current process, only the reads of the sampled_blocks if given
+    """
+    max_primer_length = unified_automaton.max_primer_length
+    matcher = build_prefix_matcher(unified_automaton, prefix_cache_size, engine)
+    read_stats = ReadStats() if collect_read_stats else None
+
+    # look up the primer sequences reading the sample fastq once for all.
+    # For each sample read, it counts the number of primers found for each primer scheme.
+    # The search is optimised to search at the beginning of the read only.
+    with closing(_iter_sample_reads(sample_fastq, sampled_blocks)) as sample_reads:
+        observed_reads = sample_reads if read_stats is None else read_stats.observe(sample_reads)
+        hits, stopped_early = _scan_sample_reads(
+            (sample_read[:max_primer_length] for sample_read in observed_reads), matcher, stopping_rule
+        )
+        if read_stats is not None:
+            # the read statistics cover the whole sample fastq, even if the scan stopped early
+            deque(observed_reads, maxlen=0)
+
+    return ReadScan(hits, stopped_early, *matcher.cache_stats(), read_stats)
+
+
+# state of the worker processes scanning the reads in parallel
+_worker_matcher: Optional[PrefixMatcher] = None
+_worker_cache_info: tuple[int, int] = (0, 0)
+
+
+def _init_scan_worker(unified_automaton: UnifiedPrimerAutomaton, prefix_cache_size: int, engine: str) -> None:
     """
-    # Structure for storing the unique primer sequences
-    unique_hits: dict[str, set] = {p: set() for p in primers_automaton}
-
-    # look up the primer sequences in the automaton
-    # reading the sample fastq once for all
-    with gzip.open(sample_fastq, "rt") as fastq_file:
-        # for each sample read, it counts the number of primers found for each primer scheme.
-        # This search is performed using an ahocorasick structure and optimised to search
-        # at the beginning of the read only
-        for sample_sequence in SeqIO.parse(fastq_file, "fastq"):
-            sample_read = str(sample_sequence.seq)
-
-            for primer in primers_automaton:
-                primer_auto = primers_automaton[primer]
-                # search for primers matching the prefix of sample_read
-                # (the wildcard argument is mandatory, but unused - no base will ever be '?'), e.g.
-                # keys: ['AGA', 'AAGA', 'ATGA', 'GTAT']
-                # sample_read: 'AAGATT'
-                # output: ['AAGA']
-                found_primer = set(primer_auto.automaton.keys(sample_read, "?", ahocorasick.MATCH_AT_MOST_PREFIX))
-                # search for primers matching the prefix of sample_read (wildcard 'N' is used).
-                # This enables the counting of primers upon uncertainty in sample reads. e.g.
-                # keys: ['AGA', 'AAGA', 'ATGA', 'GTAT']
-                # sample_read: 'ANGATT'
-                # output: ['AAGA', 'ATGA']
-                # Depending on the number of Ns in sample_read, this can return:
-                # - "sample_read does not contain N in primer sequence"
-                #     => found_primer = {} or {primer}, ambiguous_primers = {}
-                # - "sample_read contains Ns in primer sequence"
-                #     => found_primer = {}, ambiguous_primers = {*}
-                # The found primer (if exists) is removed as that's an exact match
-                ambiguous_primers = (
-                    set(primer_auto.automaton.keys(sample_read, "N", ahocorasick.MATCH_AT_MOST_PREFIX)) - found_primer
-                )
-
-                # increment the read count as necessary
-                if found_primer:
-                    primer_auto.data[PRIMER_AUTODETECTION_NUMREADS_COL] += 1
-                    unique_hits[primer].update(found_primer)
-
-                if ambiguous_primers:
-                    primer_auto.data[PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL] += 1
-
-    # Add the unique number of primers found in the sample reads
-    for primer in unique_hits:
-        primers_automaton[primer].data[PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL] = len(unique_hits[primer])
+    Initialise a worker process. The automaton is sent once per worker
+    """
+    global _worker_matcher, _worker_cache_info  # pylint: disable=global-statement
+    _worker_matcher = build_prefix_matcher(unified_automaton, prefix_cache_size, engine)
+    _worker_cache_info = (0, 0)
+
+
+def _worker_read_scan(hits: PrimerHits, read_stats: Optional[ReadStats] = None) -> ReadScan:
+    """
+    Return the scan result of a worker task, including the cache statistics of that task only
+    """
+    global _worker_cache_info  # pylint: disable=global-statement
+    cache_hits, cache_misses = _worker_matcher.cache_stats()
+    previous_hits, previous_misses = _worker_cache_info
+    _worker_cache_info = (cache_hits, cache_misses)
+    return ReadScan(hits, False, cache_hits - previous_hits, cache_misses - previous_misses, read_stats)
+
+
+def _match_worker_reads(sample_reads: Iterator[str], max_primer_length: int, collect_read_stats: bool) -> ReadScan:
+    """
+    Match the reads of a worker task
+    """
+    read_stats = ReadStats() if collect_read_stats else None
+    if read_stats is not None:
+        sample_reads = read_stats.observe(sample_reads)
+    hits, _ = _scan_sample_reads((sample_read[:max_primer_length] for sample_read in sample_reads), _worker_matcher)
+    return _worker_read_scan(hits, read_stats)
+
+
+def _match_fastq_range(
+    sample_fastq: Path, start: int, end: int, max_primer_length: int, collect_read_stats: bool = False
+) -> ReadScan:
+    """
+    Worker task: match the reads within a byte range of an uncompressed fastq
+    """
+    return _match_worker_reads(
+        iter_fastq_sequences_in_range(sample_fastq, start, end), max_primer_length, collect_read_stats
+    )
+
+
+def _match_fastq_chunk(chunk: bytes, max_primer_length: int, collect_read_stats: bool = False) -> ReadScan:
+    """
+    Worker task: parse and match the reads of a chunk of decompressed FASTQ records
+    """
+    return _match_worker_reads(iter_fastq_sequences_in_chunk(chunk), max_primer_length, collect_read_stats)
+
+
+def _merge_read_scans(merged_scan: ReadScan, read_scans: Iterable[ReadScan]) -> ReadScan:
+    """
+    Merge the scan results of several batches of reads into merged_scan, whose hits and read statistics
+    are updated in place
+    """
+    hits, stopped_early, prefix_cache_hits, prefix_cache_misses, read_stats = merged_scan
+    for read_scan in read_scans:
+        hits.merge(read_scan.hits)
+        prefix_cache_hits += read_scan.prefix_cache_hits
+        prefix_cache_misses += read_scan.prefix_cache_misses
+        if read_stats is not None and read_scan.read_stats is not None:
+            read_stats.merge(read_scan.read_stats)
+    return ReadScan(hits, stopped_early, prefix_cache_hits, prefix_cache_misses, read_stats)
+
+
+def _scan_sample_fastq_parallel(
+    sample_fastq: Path,
+    unified_automaton: UnifiedPrimerAutomaton,
+    prefix_cache_size: int,
+    workers: int,
+    engine: str = AUTOMATON_ENGINE,
+    collect_read_stats: bool = False,
+) -> ReadScan:
+    """
+    Scan all the reads of the sample_fastq in a pool of processes:
+    * uncompressed fastq file: each worker reads and matches a record-aligned byte range of the file
+    * gzipped fastq or stream (stdin, named pipe): this process only decompresses the fastq, and dispatches chunks
+      of whole records to the workers, which parse and match them. The number of chunks in flight is bounded
+    The read statistics (if requested) are accumulated by the workers
+    """
+    max_primer_length = unified_automaton.max_primer_length
+    merged_scan = ReadScan(
+        PrimerHits.empty(unified_automaton), False, 0, 0, ReadStats() if collect_read_stats else None
+    )
+    with Pool(workers, initializer=_init_scan_worker, initargs=(unified_automaton, prefix_cache_size, engine)) as pool:
+        if not is_stream(sample_fastq) and not is_gzipped(sample_fastq):
+            byte_ranges = split_fastq(sample_fastq, workers)
+            return _merge_read_scans(
+                merged_scan,
+                pool.starmap(
+                    _match_fastq_range,
+                    [(sample_fastq, start, end, max_primer_length, collect_read_stats) for start, end in byte_ranges],
+                ),
+            )
+
+        pending: deque = deque()
+        with closing(iter_fastq_chunks(sample_fastq, PARALLEL_CHUNK_SIZE)) as chunks:
+            for chunk in chunks:
+                pending.append(pool.apply_async(_match_fastq_chunk, (chunk, max_primer_length, collect_read_stats)))
+                if len(pending) >= PARALLEL_CHUNKS_IN_FLIGHT * workers:
+                    merged_scan = _merge_read_scans(merged_scan, [pending.popleft().get()])
+        return _merge_read_scans(merged_scan, [result.get() for result in pending])
+
+
+def count_primer_matches(
+    sample_fastq: Path,
+    primers_automaton: dict,
+    unified_automaton: UnifiedPrimerAutomaton = None,
+    match_stats: PrimerMatchStats = None,
+    prefix_cache_size: int = PREFIX_CACHE_SIZE,
+    stopping_rule: StoppingRule = None,
+    workers: int = 1,
+    engine: str = AUTOMATON_ENGINE,
+    read_stats: ReadStats = None,
+    sample_blocks: Optional[int] = None,
+) -> dict:
+    """
+    Perform an exact search of the primer sequences (all schemes) in the sample_fastq.
+    If the primer index holds the fuzzy sequences, the reads with one mismatch in a primer are counted in a
+    separate column.
+    If a stopping rule is given, the scan may stop before the end of the sample_fastq.
+    If sample_blocks is given and the sample_fastq is a BGZF file, only the reads of this number of evenly spaced
+    blocks are scanned. Any other sample_fastq is read sequentially.
+    If workers > 1, the reads are scanned in a pool of processes, unless there is a stopping rule or sampled blocks.
+    A gzipped sample_fastq or a stream is decompressed by this process, the workers parse and match the reads.
+    The results are identical whatever the number of workers and the matching engine.
+    If read_stats is given, the statistics of all the reads are added to it in the same pass: all the reads are
+    read then, sample_blocks is ignored
+    """
+    if unified_automaton is None:
+        unified_automaton = build_unified_automaton(primers_automaton)
+
+    collect_read_stats = read_stats is not None
+    sampled_blocks = None
+    if sample_blocks and not collect_read_stats:
+        sampled_blocks = sample_bgzf_blocks(sample_fastq, sample_blocks)
+        if sampled_blocks is None:
+            logger.info(
+                "Sample fastq read sequentially: not BGZF or not more blocks than sampled",
+                sample_fastq=str(sample_fastq),
+                sample_blocks=sample_blocks,
+            )
+    if workers > 1 and (stopping_rule is not None or sampled_blocks is not None):
+        logger.info(
+            "Sample fastq scanned sequentially: sampled or with a stopping rule",
+            sample_fastq=str(sample_fastq),
+            workers=workers,
+        )
+        workers = 1
+    if workers > 1:
+        read_scan = _scan_sample_fastq_parallel(
+            sample_fastq, unified_automaton, prefix_cache_size, workers, engine, collect_read_stats
+        )
+    else:
+        read_scan = _scan_sample_fastq(
+            sample_fastq,
+            unified_automaton,
+            prefix_cache_size,
+            stopping_rule,
+            engine,
+            collect_read_stats,
+            sampled_blocks,
+        )
+    hits = read_scan.hits
+
+    # Structure for storing the unique primer sequences, kept for the callers of this function.
+    # It is derived from the hits once, at the end of the scan
+    unique_hits: dict[str, set] = {}
+    for primer, primer_auto in primers_automaton.items():
+        if unified_automaton.is_fuzzy:
+            primer_auto.data.setdefault(PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL, 0)
+        scheme_id = unified_automaton.scheme_ids.get(primer)
+        if scheme_id is None:
+            # scheme without primer sequences
+            unique_hits[primer] = set()
+            continue
+        scheme_found_primers = np.flatnonzero(hits.found_primers & unified_automaton.primer_schemes[:, scheme_id])
+        unique_hits[primer] = {unified_automaton.primer_sequences[primer_id] for primer_id in scheme_found_primers}
+
+        # Add the read counts and the unique number of primers found in the sample reads
+        primer_auto.data[PRIMER_AUTODETECTION_NUMREADS_COL] += int(hits.numreads[scheme_id])
+        primer_auto.data[PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL] += int(hits.ambiguous_numreads[scheme_id])
+        primer_auto.data[PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL] = len(scheme_found_primers)
+        if unified_automaton.is_fuzzy:
+            primer_auto.data[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL] += int(hits.fuzzy_numreads[scheme_id])
+
+    if match_stats is not None:
+        match_stats.reads += hits.reads
+        match_stats.stopped_early = read_scan.stopped_early
+        match_stats.prefix_cache_hits += read_scan.prefix_cache_hits
+        match_stats.prefix_cache_misses += read_scan.prefix_cache_misses
+        match_stats.sampled_blocks = len(sampled_blocks) if sampled_blocks is not None else 0
+
+    if read_stats is not None:
+        read_stats.merge(read_scan.read_stats)
 
     return unique_hits
 
 
-def compute_primer_data(sample_fastq: Path, primers_automaton: dict) -> dict:
+def compute_primer_data(
+    sample_fastq: Path,
+    primers_automaton: dict,
+    match_stats: PrimerMatchStats = None,
+    stopping_rule: StoppingRule = None,
+    workers: int = 1,
+) -> dict:
     """
     Perform an exact search of the primer sequences (all schemes) in the sample_fastq
     """
-    count_primer_matches(sample_fastq, primers_automaton)
+    count_primer_matches(
+        sample_fastq, primers_automaton, match_stats=match_stats, stopping_rule=stopping_rule, workers=workers
+    )
 
     return primers_automaton
 
 
-def generate_metrics(primer_index: Path, sample_fastq: Path, output_path: Path) -> None:
+def copy_primers_automaton(primers_automaton: dict[str, PrimerAutomaton]) -> dict[str, PrimerAutomaton]:
     """
-    Generate metrics for all primers.
-    Metrics are saved to separate CSV files
-    """
-    primer_coverage_csv_fieldnames = [
-        PRIMER_AUTODETECTION_PRIMER_COL,
-        TOTAL_NUM_PRIMER,
-        PRIMER_AUTODETECTION_NUMREADS_COL,
-        PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL,
-        PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL,
-    ]
+    Copy the primers automaton dictionary so that the counts of a sample do not alter the loaded index.
+    The automata are shared, not copied
+    """
+    return {
+        primer: PrimerAutomaton(data=dict(primer_auto.data), automaton=primer_auto.automaton)
+        for primer, primer_auto in primers_automaton.items()
+    }
 
-    primers_automaton = build_primers_automaton(primer_index)
 
-    primers_automaton = compute_primer_data(sample_fastq, primers_automaton)
+def primer_coverage_cols(primers_automaton: dict[str, PrimerAutomaton]) -> list[str]:
+    """
+    Return the columns of the primer metrics: the fuzzy hits column is added only if the primer index
+    holds the fuzzy sequences
+    """
+    if any(PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL in primer_auto.data for primer_auto in primers_automaton.values()):
+        return PRIMER_COVERAGE_COLS + [PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL]
+    return PRIMER_COVERAGE_COLS
+
 
+def write_primer_coverage(output_path: Path, primers_automaton: dict[str, PrimerAutomaton]) -> None:
+    """
+    Save the metrics of each primer to separate CSV files
+    """
+    coverage_cols = primer_coverage_cols(primers_automaton)
     for primer in primers_automaton:
         with open(output_path / f"{primer}{COVERAGE_SUFFIX}", "w", newline="") as primer_coverage_csv:
-            writer = csv.DictWriter(primer_coverage_csv, fieldnames=primer_coverage_csv_fieldnames)
+            writer = csv.DictWriter(primer_coverage_csv, fieldnames=coverage_cols)
             writer.writeheader()
             writer.writerow(primers_automaton[primer].data)
 
 
+def generate_sample_metrics(
+    primers_automaton: dict[str, PrimerAutomaton],
+    sample_fastq: Path,
+    output_path: Path,
+    unified_automaton: UnifiedPrimerAutomaton = None,
+    stopping_rule: StoppingRule = None,
+    workers: int = 1,
+    engine: str = AUTOMATON_ENGINE,
+    write_coverage: bool = False,
+    read_stats: ReadStats = None,
+    stage_timings: StageTimings = None,
+    sample_blocks: Optional[int] = None,
+) -> tuple[dict[str, PrimerAutomaton], PrimerMatchStats]:
+    """
+    Generate metrics for all primers of an already loaded primer index.
+    The loaded index is not modified, so that it can be reused for other samples.
+    If write_coverage (debug), metrics are also saved to separate CSV files.
+    If read_stats is given, the statistics of the sample reads are added to it.
+    The cost of the primer matching is added to stage_timings (logged only if not given).
+    Return the primer metrics of the sample and the primer matching statistics
+    """
+    if stage_timings is None:
+        stage_timings = StageTimings(logger=logger)
+    primers_automaton = copy_primers_automaton(primers_automaton)
+
+    match_stats = PrimerMatchStats()
+    with stage_timings.measure("count_primer_matches") as timing:
+        count_primer_matches(
+            sample_fastq,
+            primers_automaton,
+            unified_automaton=unified_automaton,
+            match_stats=match_stats,
+            stopping_rule=stopping_rule,
+            workers=workers,
+            engine=engine,
+            read_stats=read_stats,
+            sample_blocks=sample_blocks,
+        )
+        timing.reads = match_stats.reads
+    logger.info("Primer matching completed", engine=engine, sample_fastq=str(sample_fastq), **match_stats.to_dict())
+
+    if write_coverage:
+        write_primer_coverage(output_path, primers_automaton)
+
+    return primers_automaton, match_stats
+
+
+def generate_metrics(
+    primer_index: Path,
+    sample_fastq: Path,
+    output_path: Path,
+    stopping_rule: StoppingRule = None,
+    workers: int = 1,
+    shared_index_dir: Optional[Path] = None,
+    engine: str = AUTOMATON_ENGINE,
+    write_coverage: bool = False,
+    read_stats: ReadStats = None,
+    stage_timings: StageTimings = None,
+    sample_blocks: Optional[int] = None,
+) -> tuple[dict[str, PrimerAutomaton], PrimerMatchStats]:
+    """
+    Generate metrics for all primers.
+    If write_coverage (debug), metrics are also saved to separate CSV files.
+    If read_stats is given, the statistics of the sample reads are added to it.
+    The cost of the index loading, of the primer matching and of the whole function is added to stage_timings
+    (logged only if not given).
+    Return the primer metrics of the sample and the primer matching statistics
+    """
+    if stage_timings is None:
+        stage_timings = StageTimings(logger=logger)
+    with stage_timings.measure("generate_metrics") as timing:
+        with stage_timings.measure("load_primer_index"):
+            loaded_index = load_primer_index(primer_index, shared_index_dir)
+        primers_automaton, match_stats = generate_sample_metrics(
+            loaded_index.primers_automaton,
+            sample_fastq,
+            output_path,
+            unified_automaton=loaded_index.unified_automaton,
+            stopping_rule=stopping_rule,
+            workers=workers,
+            engine=engine,
+            write_coverage=write_coverage,
+            read_stats=read_stats,
+            stage_timings=stage_timings,
+            sample_blocks=sample_blocks,
+        )
+        match_stats.index_load_seconds = loaded_index.load_seconds
+        timing.reads = match_stats.reads
+    return primers_automaton, match_stats
+
+
+def load_cached_sample_metrics(
+    primers_automaton: dict[str, PrimerAutomaton], cache_dir: Path, cache_key: str, read_stats: ReadStats = None
+) -> Optional[tuple[dict[str, PrimerAutomaton], PrimerMatchStats]]:
+    """
+    Return the primer metrics and the primer matching statistics cached with this key, None if not cached.
+    If read_stats is given, the cached read statistics are added to it: results cached without read statistics
+    are not used then
+    """
+    cached_result = load_cached_result(cache_dir, cache_key)
+    if cached_result is None or set(cached_result["primer_data"]) != set(primers_automaton):
+        return None
+    if read_stats is not None:
+        if "read_stats" not in cached_result:
+            return None
+        read_stats.merge(ReadStats.from_dict(cached_result["read_stats"]))
+    primers_automaton = copy_primers_automaton(primers_automaton)
+    for primer, primer_auto in primers_automaton.items():
+        primer_auto.data.update(cached_result["primer_data"][primer])
+    match_stats = PrimerMatchStats(
+        reads=cached_result["reads"], stopped_early=cached_result["stopped_early"], result_cache_hit=True
+    )
+    return primers_automaton, match_stats
+
+
+def store_cached_sample_metrics(
+    primers_automaton: dict[str, PrimerAutomaton],
+    match_stats: PrimerMatchStats,
+    cache_dir: Path,
+    cache_key: str,
+    cache_max_bytes: int,
+    read_stats: ReadStats = None,
+) -> None:
+    """
+    Cache the primer metrics, the read counts and the read statistics (if any) of a sample
+    """
+    cached_result = {
+        "primer_data": {primer: primer_auto.data for primer, primer_auto in primers_automaton.items()},
+        "reads": match_stats.reads,
+        "stopped_early": match_stats.stopped_early,
+    }
+    if read_stats is not None:
+        cached_result["read_stats"] = read_stats.to_dict()
+    store_cached_result(cache_dir, cache_key, cached_result, cache_max_bytes)
+
+
+def generate_cached_metrics(
+    primer_index: Path,
+    sample_fastq: Path,
+    output_path: Path,
+    cache_dir: Path,
+    cache_max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES,
+    stopping_rule: StoppingRule = None,
+    workers: int = 1,
+    shared_index_dir: Optional[Path] = None,
+    engine: str = AUTOMATON_ENGINE,
+    write_coverage: bool = False,
+    read_stats: ReadStats = None,
+    stage_timings: StageTimings = None,
+    sample_blocks: Optional[int] = None,
+) -> tuple[dict[str, PrimerAutomaton], PrimerMatchStats]:
+    """
+    Same as generate_metrics, reusing the metrics of a previous run from cache_dir if the content of the
+    sample fastq, the primer index, the stopping rule and the number of sampled blocks are the same.
+    The metrics do not depend on the number of workers and on the matching engine.
+    A sample fastq read from a stream cannot be fingerprinted before being scanned, so it is not cached
+    """
+    if is_stream(sample_fastq):
+        logger.info("Primer autodetection results of streams are not cached", sample_fastq=str(sample_fastq))
+        return generate_metrics(
+            primer_index,
+            sample_fastq,
+            output_path,
+            stopping_rule,
+            workers,
+            shared_index_dir,
+            engine,
+            write_coverage,
+            read_stats,
+            stage_timings,
+            sample_blocks,
+        )
+
+    if stage_timings is None:
+        stage_timings = StageTimings(logger=logger)
+    with stage_timings.measure("generate_metrics") as timing:
+        with stage_timings.measure("load_primer_index"):
+            loaded_index = load_primer_index(primer_index, shared_index_dir)
+        with stage_timings.measure("fingerprint_sample_fastq"):
+            sample_fingerprint = file_fingerprint(sample_fastq)
+        cache_key = result_cache_key(
+            sample_fastq=sample_fingerprint,
+            primer_index=primer_index_checksum(loaded_index),
+            stopping_rule=asdict(stopping_rule) if stopping_rule is not None else None,
+            # only if given, so that the keys of the results cached without sampling are unchanged
+            **({"sample_blocks": sample_blocks} if sample_blocks else {}),
+        )
+        cached_metrics = load_cached_sample_metrics(loaded_index.primers_automaton, cache_dir, cache_key, read_stats)
+        if cached_metrics is not None:
+            primers_automaton, match_stats = cached_metrics
+            logger.info("Primer autodetection results reused", sample_fastq=str(sample_fastq), cache_key=cache_key)
+            if write_coverage:
+                write_primer_coverage(output_path, primers_automaton)
+        else:
+            primers_automaton, match_stats = generate_sample_metrics(
+                loaded_index.primers_automaton,
+                sample_fastq,
+                output_path,
+                unified_automaton=loaded_index.unified_automaton,
+                stopping_rule=stopping_rule,
+                workers=workers,
+                engine=engine,
+                write_coverage=write_coverage,
+                read_stats=read_stats,
+                stage_timings=stage_timings,
+                sample_blocks=sample_blocks,
+            )
+            store_cached_sample_metrics(
+                primers_automaton, match_stats, cache_dir, cache_key, cache_max_bytes, read_stats
+            )
+        match_stats.index_load_seconds = loaded_index.load_seconds
+        timing.reads = match_stats.reads
+    return primers_automaton, match_stats
+
+
 def select_primer(output_path: Path, sample_id: str, primer_input: str) -> tuple[pd.DataFrame, str]:
     """
     Concatenate the input coverage files and select the record with the highest score.
@@ -182,22 +1207,48 @@ def select_primer(output_path: Path, sample_id: str, primer_input: str) -> tuple
         input_glob_pattern=f"*{COVERAGE_SUFFIX}",
         input_sep=",",
     )
+    return score_primers(primer_detection_df, primer_input)
+
+
+def select_sample_primer(
+    output_path: Path, sample_id: str, primer_input: str, primers_automaton: dict[str, PrimerAutomaton]
+) -> tuple[pd.DataFrame, str]:
+    """
+    Same as select_primer, using the in-memory primer metrics instead of the coverage files.
+    Return the selected primer data and the name of the selected primer.
+    """
+    # same records as the coverage files, sorted so that the latest version is at the top
+    primer_detection_df = pd.DataFrame(
+        [primer_auto.data for primer_auto in primers_automaton.values()],
+        columns=primer_coverage_cols(primers_automaton),
+    )
+    primer_detection_df.sort_values(by=PRIMER_AUTODETECTION_PRIMER_COL, ascending=False, inplace=True)
+    primer_detection_df.to_csv(output_path / f"{sample_id}{PRIMER_DETECTION_SUFFIX}", index=False)
+    return score_primers(primer_detection_df, primer_input)
+
 
+def score_primers(primer_detection_df: pd.DataFrame, primer_input: str) -> tuple[pd.DataFrame, str]:
+    """
+    Select the record with the highest score out of the primer records sorted by primer name (descending).
+    The reads with one mismatch in a primer (if counted) are reported only, they are not scored.
+    Return the selected primer data and the name of the selected primer.
+    """
     # calculate coverage as a percentage of primer sequences hit for a certain primer scheme
     primer_detection_df[PRIMER_AUTODETECTION_COVERAGE_COL] = (
         primer_detection_df[PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL] / primer_detection_df[TOTAL_NUM_PRIMER]
     )
     primer_detection_df.drop(columns=[TOTAL_NUM_PRIMER], inplace=True)
 
+    primer_scores = primer_detection_df[PRIMER_AUTODETECTION_PRIMER_SCORE_COL]
+
     # extract the primer with the highest score
     # use deep copy to suppress the warning: settingWithCopyWarning
-    detected_primer_df_slice = primer_detection_df.loc[
-        primer_detection_df[PRIMER_AUTODETECTION_PRIMER_SCORE_COL].idxmax()
-    ].copy(deep=True)
+    detected_primer_index = primer_scores.idxmax()
+    detected_primer_df_slice = primer_detection_df.loc[detected_primer_index].copy(deep=True)
 
     detected_primer = detected_primer_df_slice[PRIMER_AUTODETECTION_PRIMER_COL]
 
-    if detected_primer_df_slice[PRIMER_AUTODETECTION_PRIMER_SCORE_COL] <= 0:
+    if primer_scores[detected_primer_index] <= 0:
         # no primer can be used as no match was found.
         # overwrite the record
         detected_primer_df_slice[:] = 0
@@ -244,15 +1295,68 @@ def write_selected_primer(output_path: Path, sample_id: str, selected_primer: st
     """
     Store the primer scheme name/version
     """
-    with open(output_path / f"{sample_id}_primer.txt", "w") as of:
+    with open(output_path / f"{sample_id}{SELECTED_PRIMER_SUFFIX}", "w") as of:
         of.write(selected_primer)
 
 
-def generate_primer_autodetection_output_files(output_path: Path, sample_id: str, primer_input: str) -> None:
+def write_primer_stats(output_path: Path, sample_id: str, match_stats: PrimerMatchStats) -> None:
     """
-    Generate the primer autodetection output files
+    Store the primer matching statistics
+    """
+    write_json(match_stats.to_dict(), output_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")
+
+
+def write_primer_timings(output_path: Path, sample_id: str, stage_timings: StageTimings) -> None:
+    """
+    Store the cost of the primer autodetection stages
     """
-    detected_primer_df_slice, selected_primer = select_primer(output_path, sample_id, primer_input)
+    write_json(stage_timings.to_dict(), output_path / f"{sample_id}{PRIMER_TIMINGS_SUFFIX}")
+
+
+def write_read_stats(output_path: Path, sample_id: str, read_stats: ReadStats) -> None:
+    """
+    Store the read statistics and the read length histogram
+    """
+    with open(output_path / f"{sample_id}{READ_STATS_SUFFIX}", "w", newline="") as read_stats_csv:
+        writer = csv.DictWriter(read_stats_csv, fieldnames=READ_STATS_COLS)
+        writer.writeheader()
+        writer.writerow(
+            {
+                READ_STATS_SAMPLE_ID_COL: sample_id,
+                READ_STATS_NUMREADS_COL: read_stats.numreads,
+                READ_STATS_TOTAL_BASES_COL: read_stats.total_bases,
+                READ_STATS_MIN_LENGTH_COL: read_stats.min_length,
+                READ_STATS_MEAN_LENGTH_COL: read_stats.mean_length,
+                READ_STATS_MAX_LENGTH_COL: read_stats.max_length,
+                READ_STATS_GC_FRACTION_COL: read_stats.gc_fraction,
+                READ_STATS_N_RATE_COL: read_stats.n_rate,
+            }
+        )
+    with open(output_path / f"{sample_id}{READ_LENGTH_HISTOGRAM_SUFFIX}", "w", newline="") as histogram_csv:
+        writer = csv.writer(histogram_csv)
+        writer.writerow([READ_LENGTH_COL, READ_LENGTH_NUMREADS_COL])
+        writer.writerows(
+            (int(length), int(read_stats.length_histogram[length]))
+            for length in np.flatnonzero(read_stats.length_histogram)
+        )
+
+
+def generate_primer_autodetection_output_files(
+    output_path: Path,
+    sample_id: str,
+    primer_input: str,
+    primers_automaton: Optional[dict[str, PrimerAutomaton]] = None,
+) -> None:
+    """
+    Generate the primer autodetection output files,
+    from the in-memory primer metrics if given, otherwise from the coverage files in output_path
+    """
+    if primers_automaton is None:
+        detected_primer_df_slice, selected_primer = select_primer(output_path, sample_id, primer_input)
+    else:
+        detected_primer_df_slice, selected_primer = select_sample_primer(
+            output_path, sample_id, primer_input, primers_automaton
+        )
     write_primer_data(output_path, detected_primer_df_slice, sample_id, primer_input)
     write_selected_primer(output_path, sample_id, selected_primer)
 
@@ -262,13 +1366,14 @@ def generate_primer_autodetection_output_files(output_path: Path, sample_id: str
     "--primer-index",
     type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
     required=True,
-    help="path to the primer index file",
+    help="path to the primer index file: either a primer index bundle or a CSV primer index",
 )
 @click.option(
     "--sample-fastq",
-    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True, allow_dash=True),
     required=True,
-    help="path to the primer index file",
+    help=f"path to the sample FASTQ file (plain or gzipped). It can be a named pipe, or {STDIN_PATH} to read the "
+    "standard input, e.g. to detect the primers while the FASTQ is being written",
 )
 @click.option(
     "--output-path",
@@ -288,19 +1393,154 @@ def generate_primer_autodetection_output_files(output_path: Path, sample_id: str
     required=True,
     help="The primer name / version (e.g. ARTIC_V4) passed to the pipeline",
 )
+@click.option(
+    "--max-reads",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The maximum number of reads to scan. By default, all the reads are scanned",
+)
+@click.option(
+    "--confidence",
+    type=click.FloatRange(min=0.5, max=1, min_open=True, max_open=True),
+    default=None,
+    help="Stop scanning reads as soon as the detected primer cannot change at this confidence level (e.g. 0.99)",
+)
+@click.option(
+    "--workers",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of processes scanning the reads, without --max-reads, --confidence nor --sample-blocks. "
+    "A gzipped sample fastq is decompressed by one process and parsed by the others",
+)
+@click.option(
+    "--engine",
+    type=click.Choice(MATCHING_ENGINES),
+    default=AUTOMATON_ENGINE,
+    help="The engine matching the read prefixes: an ahocorasick automaton (one read at a time) "
+    "or vectorised searches of 2-bit packed primer sequences (batches of reads). The results are identical",
+)
+@click.option(
+    "--shared-index-dir",
+    type=click.Path(file_okay=False, dir_okay=True),
+    default=None,
+    help="node-wide directory (e.g. /dev/shm) where the packed index of the primer sequences is published once "
+    "and memory-mapped by the concurrent primer autodetection processes, with --engine packed. "
+    "The local temporary directory is used if it cannot be written",
+)
+@click.option(
+    "--cache-dir",
+    type=click.Path(file_okay=False, dir_okay=True, writable=True),
+    default=None,
+    help="directory of the results of previous runs, reused if the content of the sample FASTQ, the primer index "
+    "and the stopping rule are the same. By default, no results are cached",
+)
+@click.option(
+    "--cache-max-size",
+    type=click.IntRange(min=1),
+    default=DEFAULT_RESULT_CACHE_MAX_BYTES // (1024 * 1024),
+    show_default=True,
+    help="The maximum size of the cache directory, in MiB. The least recently used results are evicted first",
+)
+@click.option(
+    "--no-cache",
+    is_flag=True,
+    default=False,
+    help="Neither reuse nor store results, even if --cache-dir is given",
+)
+@click.option(
+    "--read-stats",
+    is_flag=True,
+    default=False,
+    help=f"also compute the statistics of the sample reads (number of reads and bases, read lengths, GC fraction, "
+    f"N rate) while scanning them, and store them to <sample>{READ_STATS_SUFFIX} and "
+    f"<sample>{READ_LENGTH_HISTOGRAM_SUFFIX}. All the reads are read, even if the scan stops early",
+)
+@click.option(
+    "--sample-blocks",
+    type=click.IntRange(min=1),
+    default=None,
+    help="scan only the reads of this number of evenly spaced blocks of a BGZF sample fastq, for a sample "
+    "representative of the whole file at a fraction of the I/O. Any other sample fastq is read sequentially, "
+    "as well as with --read-stats",
+)
+@click.option(
+    "--timings",
+    is_flag=True,
+    default=False,
+    help=f"also store the wall time, CPU time, reads, bytes read and peak RSS of each stage to "
+    f"<sample>{PRIMER_TIMINGS_SUFFIX}. The stages are logged in any case",
+)
+@click.option(
+    "--write-coverage-files",
+    is_flag=True,
+    default=False,
+    help=f"debug: also write the metrics of each primer scheme to <primer>{COVERAGE_SUFFIX}",
+)
+@click.option(
+    "--contamination-removal-gate",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    default=None,
+    help="the gate file of the sample written by contamination_removal.py: if the sample is gated (e.g. no reads "
+    "kept), no output file is generated",
+)
 def primer_autodetection(
     primer_index: str,
     sample_fastq: str,
     output_path: str,
     sample_id: str,
     primer_input: str,
+    max_reads: Optional[int],
+    confidence: Optional[float],
+    workers: int,
+    engine: str,
+    shared_index_dir: Optional[str],
+    cache_dir: Optional[str],
+    cache_max_size: int,
+    no_cache: bool,
+    read_stats: bool,
+    sample_blocks: Optional[int],
+    timings: bool,
+    write_coverage_files: bool,
+    contamination_removal_gate: Optional[str],
 ) -> None:
     """
     Generate the primer autodetection output files
     """
+    if shared_index_dir and engine != PACKED_ENGINE:
+        raise click.UsageError(f"--shared-index-dir requires --engine {PACKED_ENGINE}")
+    if contamination_removal_gate and is_gated(Path(contamination_removal_gate)):
+        logger.info("Sample skipped by the contamination removal gate", sample_id=sample_id)
+        return
     output_path_obj = Path(output_path)
-    generate_metrics(Path(primer_index), Path(sample_fastq), output_path_obj)
-    generate_primer_autodetection_output_files(output_path_obj, sample_id, primer_input)
+    stopping_rule = StoppingRule(max_reads=max_reads, confidence=confidence) if max_reads or confidence else None
+    sample_read_stats = ReadStats() if read_stats else None
+    stage_timings = StageTimings(logger=logger)
+    metrics_args = dict(
+        primer_index=Path(primer_index),
+        sample_fastq=Path(sample_fastq),
+        output_path=output_path_obj,
+        stopping_rule=stopping_rule,
+        workers=workers,
+        shared_index_dir=Path(shared_index_dir) if shared_index_dir else None,
+        engine=engine,
+        write_coverage=write_coverage_files,
+        read_stats=sample_read_stats,
+        stage_timings=stage_timings,
+        sample_blocks=sample_blocks,
+    )
+    if cache_dir and not no_cache:
+        primers_automaton, match_stats = generate_cached_metrics(
+            cache_dir=Path(cache_dir), cache_max_bytes=cache_max_size * 1024 * 1024, **metrics_args
+        )
+    else:
+        primers_automaton, match_stats = generate_metrics(**metrics_args)
+    with stage_timings.measure("generate_primer_autodetection_output_files"):
+        generate_primer_autodetection_output_files(output_path_obj, sample_id, primer_input, primers_automaton)
+    write_primer_stats(output_path_obj, sample_id, match_stats)
+    if sample_read_stats is not None:
+        write_read_stats(output_path_obj, sample_id, sample_read_stats)
+    if timings:
+        write_primer_timings(output_path_obj, sample_id, stage_timings)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,219 @@
+from pathlib import Path
+from typing import Optional
+from contextlib import closing
+from dataclasses import dataclass, field
+from multiprocessing import Pool
+from functools import partial
+import csv
+import os
+import tempfile
+import click
+
+from app.scripts.primer_autodetection import (
+    generate_sample_metrics,
+    generate_primer_autodetection_output_files,
+    load_primer_index,
+    write_primer_stats,
+    PrimerAutomaton,
+    PrimerMatchStats,
+    StoppingRule,
+    UnifiedPrimerAutomaton,
+    PRIMER_DATA_SUFFIX,
+    PRIMER_DETECTION_SUFFIX,
+    PRIMER_STATS_SUFFIX,
+    SELECTED_PRIMER_SUFFIX,
+)
+from app.scripts.primer_cols import (
+    PRIMER_AUTODETECTION_MANIFEST_COLS,
+    PRIMER_AUTODETECTION_MANIFEST_FASTQ_COL,
+    PRIMER_AUTODETECTION_PRIMER_INPUT_COL,
+    PRIMER_AUTODETECTION_SAMPLE_ID_COL,
+)
+from app.scripts.util.logger import get_structlog_logger
+
+log_file = f"{Path(__file__).stem}.log"
+logger = get_structlog_logger(log_file=log_file)
+
+# the output files generated for each sample
+SAMPLE_OUTPUT_SUFFIXES = [PRIMER_DATA_SUFFIX, PRIMER_DETECTION_SUFFIX, SELECTED_PRIMER_SUFFIX, PRIMER_STATS_SUFFIX]
+
+
+@dataclass
+class ManifestSample:
+    sample_id: str = field(metadata={"required": True})
+    sample_fastq: Path = field(metadata={"required": True})
+    primer_input: str = field(metadata={"required": True})
+
+
+def load_manifest(manifest: Path) -> list[ManifestSample]:
+    """
+    Load the samples of a batch manifest.
+    Relative FASTQ paths are relative to the manifest directory
+    """
+    with open(manifest, "r", newline="") as manifest_csv:
+        reader = csv.DictReader(manifest_csv)
+        missing_cols = set(PRIMER_AUTODETECTION_MANIFEST_COLS) - set(reader.fieldnames or [])
+        if missing_cols:
+            raise ValueError(f"Manifest {manifest} is missing the columns: {', '.join(sorted(missing_cols))}")
+        rows = list(reader)
+        empty_rows = [
+            row_number
+            for row_number, row in enumerate(rows, start=2)
+            if not all(row[col] for col in PRIMER_AUTODETECTION_MANIFEST_COLS)
+        ]
+        if empty_rows:
+            raise ValueError(f"Manifest {manifest} has empty values in rows: {', '.join(map(str, empty_rows))}")
+        samples = [
+            ManifestSample(
+                sample_id=row[PRIMER_AUTODETECTION_SAMPLE_ID_COL],
+                sample_fastq=Path(manifest).parent / row[PRIMER_AUTODETECTION_MANIFEST_FASTQ_COL],
+                primer_input=row[PRIMER_AUTODETECTION_PRIMER_INPUT_COL],
+            )
+            for row in rows
+        ]
+
+    sample_ids = [sample.sample_id for sample in samples]
+    duplicated_sample_ids = {sample_id for sample_id in sample_ids if sample_ids.count(sample_id) > 1}
+    if duplicated_sample_ids:
+        raise ValueError(f"Manifest {manifest} has duplicated sample ids: {', '.join(sorted(duplicated_sample_ids))}")
+
+    return samples
+
+
+def detect_sample_primer(
+    sample: ManifestSample,
+    primers_automaton: dict[str, PrimerAutomaton],
+    unified_automaton: UnifiedPrimerAutomaton,
+    output_path: Path,
+    stopping_rule: StoppingRule = None,
+) -> PrimerMatchStats:
+    """
+    Generate the primer autodetection output files of a sample using an already loaded primer index.
+    The output files are generated in a temporary directory and moved to output_path once complete
+    """
+    with tempfile.TemporaryDirectory(dir=output_path, prefix=f"{sample.sample_id}.") as work_dir:
+        work_path = Path(work_dir)
+        sample_primers_automaton, match_stats = generate_sample_metrics(
+            primers_automaton, sample.sample_fastq, work_path, unified_automaton, stopping_rule
+        )
+        generate_primer_autodetection_output_files(
+            work_path, sample.sample_id, sample.primer_input, sample_primers_automaton
+        )
+        write_primer_stats(work_path, sample.sample_id, match_stats)
+        for suffix in SAMPLE_OUTPUT_SUFFIXES:
+            output_file = f"{sample.sample_id}{suffix}"
+            os.replace(work_path / output_file, output_path / output_file)
+
+    logger.info("Primer autodetection completed", sample_id=sample.sample_id)
+    return match_stats
+
+
+# the primer index loaded once by each worker process
+_worker_primers_automaton: dict[str, PrimerAutomaton] = {}
+_worker_unified_automaton: Optional[UnifiedPrimerAutomaton] = None
+
+
+def _init_batch_worker(
+    primers_automaton: dict[str, PrimerAutomaton], unified_automaton: UnifiedPrimerAutomaton
+) -> None:
+    global _worker_primers_automaton, _worker_unified_automaton  # pylint: disable=global-statement
+    _worker_primers_automaton = primers_automaton
+    _worker_unified_automaton = unified_automaton
+
+
+def _detect_sample_primer_in_worker(
+    sample: ManifestSample, output_path: Path, stopping_rule: Optional[StoppingRule]
+) -> PrimerMatchStats:
+    return detect_sample_primer(
+        sample, _worker_primers_automaton, _worker_unified_automaton, output_path, stopping_rule
+    )
+
+
+def detect_batch_primers(
+    primer_index: Path,
+    samples: list[ManifestSample],
+    output_path: Path,
+    stopping_rule: StoppingRule = None,
+    jobs: int = 1,
+) -> None:
+    """
+    Generate the primer autodetection output files of all the samples, loading the primer index once
+    """
+    loaded_index = load_primer_index(primer_index)
+    primers_automaton = loaded_index.primers_automaton
+    unified_automaton = loaded_index.unified_automaton
+    logger.info("Primer autodetection batch started", samples=len(samples), jobs=jobs)
+
+    if jobs == 1:
+        for sample in samples:
+            detect_sample_primer(sample, primers_automaton, unified_automaton, output_path, stopping_rule)
+        return
+
+    detect = partial(_detect_sample_primer_in_worker, output_path=output_path, stopping_rule=stopping_rule)
+    with closing(
+        Pool(min(jobs, len(samples)), initializer=_init_batch_worker, initargs=(primers_automaton, unified_automaton))
+    ) as pool:
+        # consume the results to propagate the errors of the workers
+        for _ in pool.imap_unordered(detect, samples):
+            pass
+
+
+@click.command()
+@click.option(
+    "--primer-index",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    required=True,
+    help="path to the primer index file: either a primer index bundle or a CSV primer index",
+)
+@click.option(
+    "--manifest",
+    type=click.Path(exists=True, file_okay=True, dir_okay=False, readable=True),
+    required=True,
+    help=f"CSV file with the samples to process, with columns: {', '.join(PRIMER_AUTODETECTION_MANIFEST_COLS)}",
+)
+@click.option(
+    "--output-path",
+    type=click.Path(exists=True, file_okay=False, dir_okay=True, writable=True),
+    default=".",
+    help="output directory to store the files to generate",
+)
+@click.option(
+    "--max-reads",
+    type=click.IntRange(min=1),
+    default=None,
+    help="The maximum number of reads to scan per sample. By default, all the reads are scanned",
+)
+@click.option(
+    "--confidence",
+    type=click.FloatRange(min=0.5, max=1, min_open=True, max_open=True),
+    default=None,
+    help="Stop scanning reads as soon as the detected primer cannot change at this confidence level (e.g. 0.99)",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=1,
+    help="The number of samples processed in parallel",
+)
+def primer_autodetection_batch(
+    primer_index: str,
+    manifest: str,
+    output_path: str,
+    max_reads: Optional[int],
+    confidence: Optional[float],
+    jobs: int,
+) -> None:
+    """
+    Generate the primer autodetection output files for all the samples in the manifest
+    """
+    samples = load_manifest(Path(manifest))
+    if not samples:
+        logger.warning("No sample found in the manifest", manifest=manifest)
+        return
+    stopping_rule = StoppingRule(max_reads=max_reads, confidence=confidence) if max_reads or confidence else None
+    detect_batch_primers(Path(primer_index), samples, Path(output_path), stopping_rule, jobs)
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    primer_autodetection_batch()
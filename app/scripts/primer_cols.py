@@ -18,6 +18,8 @@ PRIMER_AUTODETECTION_NUMREADS_COL = "primer_numreads"
 PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL = "primer_unique_numreads"
 PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL = "primer_ambiguous_numreads"
 PRIMER_AUTODETECTION_COVERAGE_COL = "primer_coverage"
+# only if the primer index holds the primer sequences with one mismatch
+PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL = "primer_fuzzy_numreads"
 EXPECTED_PRIMER_AUTODETECTION_HEADERS = {
     PRIMER_AUTODETECTION_SAMPLE_ID_COL,
     PRIMER_AUTODETECTION_PRIMER_INPUT_COL,
@@ -27,3 +29,38 @@ EXPECTED_PRIMER_AUTODETECTION_HEADERS = {
     PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL,
     PRIMER_AUTODETECTION_COVERAGE_COL,
 }
+OPTIONAL_PRIMER_AUTODETECTION_HEADERS = {
+    PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL,
+}
+
+# read statistics columns, accumulated by the primer autodetection while scanning the reads
+READ_STATS_SAMPLE_ID_COL = "sample_id"
+READ_STATS_NUMREADS_COL = "read_stats_numreads"
+READ_STATS_TOTAL_BASES_COL = "read_stats_total_bases"
+READ_STATS_MIN_LENGTH_COL = "read_stats_min_length"
+READ_STATS_MEAN_LENGTH_COL = "read_stats_mean_length"
+READ_STATS_MAX_LENGTH_COL = "read_stats_max_length"
+READ_STATS_GC_FRACTION_COL = "read_stats_gc_fraction"
+READ_STATS_N_RATE_COL = "read_stats_n_rate"
+READ_STATS_COLS = [
+    READ_STATS_SAMPLE_ID_COL,
+    READ_STATS_NUMREADS_COL,
+    READ_STATS_TOTAL_BASES_COL,
+    READ_STATS_MIN_LENGTH_COL,
+    READ_STATS_MEAN_LENGTH_COL,
+    READ_STATS_MAX_LENGTH_COL,
+    READ_STATS_GC_FRACTION_COL,
+    READ_STATS_N_RATE_COL,
+]
+EXPECTED_READ_STATS_HEADERS = set(READ_STATS_COLS)
+# read length histogram columns
+READ_LENGTH_COL = "read_length"
+READ_LENGTH_NUMREADS_COL = "numreads"
+
+# primer autodetection batch manifest columns
+PRIMER_AUTODETECTION_MANIFEST_FASTQ_COL = "fastq"
+PRIMER_AUTODETECTION_MANIFEST_COLS = [
+    PRIMER_AUTODETECTION_SAMPLE_ID_COL,
+    PRIMER_AUTODETECTION_MANIFEST_FASTQ_COL,
+    PRIMER_AUTODETECTION_PRIMER_INPUT_COL,
+]
@@ -0,0 +1,113 @@
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+import struct
+import zlib
+
+# BGZF (blocked gzip, see the SAM/BAM specification): a series of gzip members of at most 64 KB each, whose header
+# stores the compressed size of the member, so that any block can be decompressed on its own.
+# A BGZF file is a valid gzip file: any gzip reader decompresses it sequentially
+# gzip magic, deflate compression, FEXTRA flag
+BGZF_HEADER_PREFIX = b"\x1f\x8b\x08\x04"
+# the fixed part of the gzip header, up to the XLEN field included
+GZIP_FIXED_HEADER_SIZE = 12
+# CRC32 and ISIZE
+GZIP_FOOTER_SIZE = 8
+BGZF_SUBFIELD_ID = b"BC"
+BGZF_MAX_BLOCK_SIZE = 0x10000
+# the block index written next to a BGZF file, in the format of bgzip and samtools:
+# the number of entries then the (compressed offset, uncompressed offset) of each block but the first,
+# all unsigned 64 bit little endian integers
+BGZF_INDEX_SUFFIX = ".gzi"
+
+# (compressed offset, uncompressed offset) of a block
+BGZF_BLOCK_OFFSETS_TYPE = tuple[int, int]
+
+
+def bgzf_index_path(bgzf_path: Path) -> Path:
+    return Path(f"{bgzf_path}{BGZF_INDEX_SUFFIX}")
+
+
+def _read_block_size(bgzf_file: BinaryIO) -> Optional[int]:
+    """
+    Read the header of the BGZF block at the current position of bgzf_file
+
+    :return: the total size of the block, None at the end of the file or if the block is not a BGZF block
+    """
+    header = bgzf_file.read(GZIP_FIXED_HEADER_SIZE)
+    if len(header) < GZIP_FIXED_HEADER_SIZE or not header.startswith(BGZF_HEADER_PREFIX):
+        return None
+    (extra_length,) = struct.unpack("<H", header[10:12])
+    extra = bgzf_file.read(extra_length)
+    while len(extra) >= 4:
+        subfield_id, subfield_length = extra[:2], struct.unpack("<H", extra[2:4])[0]
+        if subfield_id == BGZF_SUBFIELD_ID and subfield_length == 2:
+            return struct.unpack("<H", extra[4:6])[0] + 1
+        extra = extra[4 + subfield_length :]
+    return None
+
+
+def is_bgzf(file_path: Path) -> bool:
+    """
+    Return True if the file starts with a BGZF block
+    """
+    with open(file_path, "rb") as bgzf_file:
+        return _read_block_size(bgzf_file) is not None
+
+
+def scan_bgzf_blocks(bgzf_path: Path) -> list[BGZF_BLOCK_OFFSETS_TYPE]:
+    """
+    Return the (compressed offset, uncompressed offset) of each block, reading only the block headers and sizes
+
+    :param bgzf_path: the BGZF file
+    :return: the offsets of the non-empty blocks, as stored in the block index
+    """
+    block_offsets = []
+    compressed_offset = uncompressed_offset = 0
+    with open(bgzf_path, "rb") as bgzf_file:
+        while (block_size := _read_block_size(bgzf_file)) is not None:
+            bgzf_file.seek(compressed_offset + block_size - 4)
+            (uncompressed_size,) = struct.unpack("<I", bgzf_file.read(4))
+            if uncompressed_size:
+                block_offsets.append((compressed_offset, uncompressed_offset))
+            compressed_offset += block_size
+            uncompressed_offset += uncompressed_size
+    return block_offsets
+
+
+def load_bgzf_index(bgzf_path: Path) -> list[BGZF_BLOCK_OFFSETS_TYPE]:
+    """
+    Return the (compressed offset, uncompressed offset) of each block of a BGZF file, from its block index
+    if present, otherwise from the block headers
+
+    :param bgzf_path: the BGZF file
+    :return: the offsets of the blocks, starting with the first block (0, 0)
+    """
+    index_path = bgzf_index_path(bgzf_path)
+    if not index_path.is_file():
+        return scan_bgzf_blocks(bgzf_path)
+    with open(index_path, "rb") as index_file:
+        (num_entries,) = struct.unpack("<Q", index_file.read(8))
+        entries = struct.unpack(f"<{2 * num_entries}Q", index_file.read(16 * num_entries))
+    return [(0, 0)] + list(zip(entries[::2], entries[1::2]))
+
+
+def iter_bgzf_blocks(bgzf_file: BinaryIO) -> Iterator[bytes]:
+    """
+    Decompress the consecutive BGZF blocks from the current position of bgzf_file, one block at a time
+
+    :param bgzf_file: the BGZF file object opened in binary mode, positioned at the start of a block
+    :return: an iterator over the uncompressed data of each block
+    """
+    block_start = bgzf_file.tell()
+    while (block_size := _read_block_size(bgzf_file)) is not None:
+        # the header was read up to the extra field included: read the compressed data and the footer
+        block_end = block_start + block_size
+        block = bgzf_file.read(block_end - bgzf_file.tell())
+        if len(block) < GZIP_FOOTER_SIZE:
+            raise ValueError("Truncated BGZF block")
+        block_start = block_end
+        data = zlib.decompress(block[:-GZIP_FOOTER_SIZE], -zlib.MAX_WBITS)
+        crc, uncompressed_size = struct.unpack("<II", block[-GZIP_FOOTER_SIZE:])
+        if zlib.crc32(data) != crc or len(data) != uncompressed_size:
+            raise ValueError("Corrupted BGZF block")
+        yield data
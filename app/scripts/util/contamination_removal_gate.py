@@ -0,0 +1,30 @@
+from pathlib import Path
+
+# the gate of a sample: whether its downstream processes (fastqc, primer autodetection, ncov) run.
+# The gate file of a sample is named <sample_id><CONTAMINATION_REMOVAL_GATE_SUFFIX> and holds one of the gate values
+CONTAMINATION_REMOVAL_GATE_SUFFIX = "_contamination_removal_gate.txt"
+GATE_PASSED = "passed"
+GATE_NO_READS = "no_reads"
+
+
+def get_gate(kept_reads: int) -> str:
+    """
+    Return the gate of a sample: the samples without reads kept are not processed further
+    """
+    return GATE_PASSED if kept_reads > 0 else GATE_NO_READS
+
+
+def write_gate_file(gate_path: Path, kept_reads: int) -> None:
+    """
+    Write the gate of a sample to a file, read by the workflow and by the downstream stages
+    """
+    with open(gate_path, "w") as gate_file:
+        gate_file.write(f"{get_gate(kept_reads)}\n")
+
+
+def is_gated(gate_path: Path) -> bool:
+    """
+    Return True if the gate file does not let the sample through (e.g. no reads kept)
+    """
+    with open(gate_path) as gate_file:
+        return gate_file.read().strip() != GATE_PASSED
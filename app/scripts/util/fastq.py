@@ -0,0 +1,378 @@
+from contextlib import contextmanager
+from itertools import accumulate, dropwhile, islice
+from pathlib import Path
+from typing import BinaryIO, Iterator, Optional
+import gzip
+import io
+import shutil
+import signal
+import subprocess
+import sys
+
+from app.scripts.util.bgzf import is_bgzf, iter_bgzf_blocks, load_bgzf_index
+
+try:
+    from isal import igzip
+except ImportError:
+    igzip = None
+
+try:
+    from zlib_ng import gzip_ng
+except ImportError:
+    gzip_ng = None
+
+GZIP_MAGIC = b"\x1f\x8b"
+# FASTQ path reading the standard input
+STDIN_PATH = "-"
+# large buffers amortise the cost of the system calls and of the decompression
+READ_BUFFER_SIZE = 4 * 1024 * 1024
+
+FASTQ_LINES_PER_RECORD = 4
+FASTQ_HEADER_PREFIX = b"@"
+FASTQ_SEPARATOR_PREFIX = b"+"
+
+FASTQ_RECORD_TYPE = tuple[str, str, str]
+# (compressed offset and uncompressed offset of the block decompressed first, first uncompressed offset of the reads,
+# uncompressed offset past the reads) of a sampled BGZF block. The block decompressed first is the block preceding
+# the sampled block (but the first block), so that a read starting at the very beginning of the sampled block is found
+SAMPLED_BLOCK_TYPE = tuple[int, int, int, int]
+
+# gzip decompression backends, in order of preference
+ISAL_BACKEND = "isal"
+ZLIB_NG_BACKEND = "zlib-ng"
+PIGZ_BACKEND = "pigz"
+GZIP_BACKEND = "gzip"
+DECOMPRESSION_BACKENDS = (ISAL_BACKEND, ZLIB_NG_BACKEND, PIGZ_BACKEND, GZIP_BACKEND)
+PIGZ_EXECUTABLE = "pigz"
+
+
+def is_gzipped(fastq_path: Path) -> bool:
+    """
+    Return True if the file is gzip compressed
+    """
+    with open(fastq_path, "rb") as fastq_file:
+        return fastq_file.read(len(GZIP_MAGIC)) == GZIP_MAGIC
+
+
+def is_stream(fastq_path: Path) -> bool:
+    """
+    Return True if the FASTQ is read from the standard input or from a named pipe (or any non-regular file),
+    which can be read only once, sequentially
+    """
+    return str(fastq_path) == STDIN_PATH or not Path(fastq_path).is_file()
+
+
+def available_decompression_backends() -> list[str]:
+    """
+    Return the gzip decompression backends installed, in order of preference.
+    The stdlib gzip backend is always available
+    """
+    installed = {
+        ISAL_BACKEND: igzip is not None,
+        ZLIB_NG_BACKEND: gzip_ng is not None,
+        PIGZ_BACKEND: shutil.which(PIGZ_EXECUTABLE) is not None,
+        GZIP_BACKEND: True,
+    }
+    return [backend for backend in DECOMPRESSION_BACKENDS if installed[backend]]
+
+
+@contextmanager
+def _open_pigz(fastq_path: Path) -> Iterator[BinaryIO]:
+    """
+    Decompress a gzipped file in a pigz subprocess, so that decompression runs concurrently with parsing
+
+    :param fastq_path: the path of the gzipped file
+    :return: a binary file object reading the decompressed stream
+    """
+    process = subprocess.Popen(
+        [PIGZ_EXECUTABLE, "-dc", str(fastq_path)], stdout=subprocess.PIPE, bufsize=READ_BUFFER_SIZE
+    )
+    try:
+        yield process.stdout
+    finally:
+        # closing the pipe early (e.g. when the reading stops early) terminates pigz with SIGPIPE
+        process.stdout.close()
+        returncode = process.wait()
+    if returncode not in (0, -signal.SIGPIPE):
+        raise OSError(f"{PIGZ_EXECUTABLE} failed to decompress {fastq_path} with exit code {returncode}")
+
+
+@contextmanager
+def _open_gzip(raw_handle: BinaryIO, fastq_path: Path, backend: str) -> Iterator[BinaryIO]:
+    """
+    Decompress a gzipped file with the given backend
+
+    :param raw_handle: the gzipped file object opened in binary mode
+    :param fastq_path: the path of the gzipped file
+    :param backend: one of DECOMPRESSION_BACKENDS
+    :return: a binary file object reading the decompressed stream
+    """
+    if backend == PIGZ_BACKEND:
+        with _open_pigz(fastq_path) as pigz_handle:
+            yield pigz_handle
+        return
+    gzip_modules = {ISAL_BACKEND: igzip, ZLIB_NG_BACKEND: gzip_ng, GZIP_BACKEND: gzip}
+    with gzip_modules[backend].GzipFile(fileobj=raw_handle, mode="rb") as gzip_handle:
+        yield gzip_handle
+
+
+@contextmanager
+def open_fastq(fastq_path: Path, decompression_backend: Optional[str] = None) -> Iterator[BinaryIO]:
+    """
+    Open a plain or gzipped FASTQ file in binary mode.
+    The compression is detected from the content, not from the file extension.
+    The FASTQ can be a named pipe, or the standard input if fastq_path is "-"
+
+    :param fastq_path: the path of the FASTQ file
+    :param decompression_backend: the gzip decompression backend, one of DECOMPRESSION_BACKENDS.
+        Default is the fastest backend installed. pigz cannot decompress a stream (it reopens the file)
+    :return: a buffered binary file object returning decompressed lines
+    """
+    backends = available_decompression_backends()
+    if is_stream(fastq_path):
+        backends = [backend for backend in backends if backend != PIGZ_BACKEND]
+    if decompression_backend is None:
+        decompression_backend = backends[0]
+    elif decompression_backend not in backends:
+        raise ValueError(f"Decompression backend {decompression_backend} is not available for {fastq_path}")
+
+    reads_stdin = str(fastq_path) == STDIN_PATH
+    # the standard input is not closed with the handle
+    with open(
+        sys.stdin.fileno() if reads_stdin else fastq_path, "rb", buffering=READ_BUFFER_SIZE, closefd=not reads_stdin
+    ) as raw_handle:
+        if raw_handle.peek(len(GZIP_MAGIC))[: len(GZIP_MAGIC)] == GZIP_MAGIC:
+            with _open_gzip(raw_handle, fastq_path, decompression_backend) as gzip_handle:
+                yield io.BufferedReader(gzip_handle, buffer_size=READ_BUFFER_SIZE)
+        else:
+            yield raw_handle
+
+
+def iter_fastq_sequences(fastq_path: Path, decompression_backend: Optional[str] = None) -> Iterator[str]:
+    """
+    Yield the sequence of each read in a FASTQ file.
+    Only the sequence lines are decoded: headers and qualities are skipped as raw bytes.
+    Records are expected on 4 lines (header, sequence, separator, quality), as written by
+    read-it-and-keep and by the sequencers
+
+    :param fastq_path: the path of the plain or gzipped FASTQ file
+    :param decompression_backend: the gzip decompression backend, default is the fastest backend installed
+    :return: an iterator over the read sequences
+    """
+    with open_fastq(fastq_path, decompression_backend) as fastq_file:
+        for sequence in islice(fastq_file, 1, None, FASTQ_LINES_PER_RECORD):
+            yield sequence.rstrip().decode("ascii")
+
+
+def iter_fastq_records(fastq_path: Path) -> Iterator[FASTQ_RECORD_TYPE]:
+    """
+    Yield the (id, sequence, quality) of each read in a FASTQ file
+
+    :param fastq_path: the path of the plain or gzipped FASTQ file
+    :return: an iterator over the read records
+    """
+    with open_fastq(fastq_path) as fastq_file:
+        for header in fastq_file:
+            sequence = fastq_file.readline()
+            separator = fastq_file.readline()
+            quality = fastq_file.readline()
+            if not (header.startswith(FASTQ_HEADER_PREFIX) and separator.startswith(FASTQ_SEPARATOR_PREFIX)):
+                raise ValueError(f"Invalid FASTQ record in {fastq_path}: {header!r}")
+            yield (
+                (header[1:].split(maxsplit=1) or [b""])[0].decode("ascii"),
+                sequence.rstrip().decode("ascii"),
+                quality.rstrip().decode("ascii"),
+            )
+
+
+def find_record_start(fastq_file: BinaryIO, offset: int) -> int:
+    """
+    Return the offset of the first FASTQ record starting at or after offset in an uncompressed FASTQ file.
+    A quality line can start with '@' too, so a record start is a line starting with '@'
+    followed by a sequence line and by a line starting with '+'
+
+    :param fastq_file: the uncompressed FASTQ file object opened in binary mode
+    :param offset: the offset to start searching from
+    :return: the offset of the record start, or the file size if no record follows offset
+    """
+    fastq_file.seek(offset)
+    if offset > 0:
+        # skip the (possibly partial) line containing offset - 1
+        fastq_file.seek(offset - 1)
+        offset += len(fastq_file.readline()) - 1
+    lines = [fastq_file.readline() for _ in range(FASTQ_LINES_PER_RECORD - 1)]
+    while lines[0]:
+        if lines[0].startswith(FASTQ_HEADER_PREFIX) and lines[2].startswith(FASTQ_SEPARATOR_PREFIX):
+            return offset
+        offset += len(lines.pop(0))
+        lines.append(fastq_file.readline())
+    return offset
+
+
+def split_fastq(fastq_path: Path, num_chunks: int) -> list[tuple[int, int]]:
+    """
+    Split an uncompressed FASTQ file into byte ranges of similar size, aligned to the FASTQ records
+
+    :param fastq_path: the path of the uncompressed FASTQ file
+    :param num_chunks: the number of byte ranges to generate
+    :return: the list of non-empty (start, end) byte ranges covering the whole file
+    """
+    file_size = Path(fastq_path).stat().st_size
+    with open(fastq_path, "rb") as fastq_file:
+        boundaries = sorted(
+            {0, file_size} | {find_record_start(fastq_file, file_size * i // num_chunks) for i in range(1, num_chunks)}
+        )
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def iter_fastq_sequences_in_range(fastq_path: Path, start: int, end: int) -> Iterator[str]:
+    """
+    Yield the sequence of each read in a byte range of an uncompressed FASTQ file.
+    The byte range must be aligned to the FASTQ records (see split_fastq)
+
+    :param fastq_path: the path of the uncompressed FASTQ file
+    :param start: the offset of the first record
+    :param end: the offset past the last record
+    :return: an iterator over the read sequences
+    """
+    with open(fastq_path, "rb", buffering=READ_BUFFER_SIZE) as fastq_file:
+        fastq_file.seek(start)
+        remaining = end - start
+        # index of the next sequence line within the next block of lines
+        sequence_line = 1
+        while remaining > 0:
+            lines = fastq_file.readlines(min(READ_BUFFER_SIZE, remaining))
+            if not lines:
+                break
+            block_size = sum(map(len, lines))
+            if block_size > remaining:
+                # the block goes beyond the end of the range: keep the lines within the range only
+                line_ends = accumulate(map(len, lines))
+                lines = lines[: sum(1 for line_end in line_ends if line_end <= remaining)]
+            remaining -= block_size
+            for sequence in islice(lines, sequence_line, None, FASTQ_LINES_PER_RECORD):
+                yield sequence.rstrip().decode("ascii")
+            sequence_line = (sequence_line - len(lines)) % FASTQ_LINES_PER_RECORD
+
+
+def iter_fastq_chunks(
+    fastq_path: Path, chunk_size: int = READ_BUFFER_SIZE, decompression_backend: Optional[str] = None
+) -> Iterator[bytes]:
+    """
+    Yield the decompressed content of a FASTQ file in chunks of about chunk_size bytes, aligned to the FASTQ records,
+    so that each chunk can be parsed on its own (see iter_fastq_sequences_in_chunk), e.g. by another process.
+    Records are expected on 4 lines, as in iter_fastq_sequences
+
+    :param fastq_path: the path of the plain or gzipped FASTQ file, or a stream
+    :param chunk_size: the number of bytes read at once
+    :param decompression_backend: the gzip decompression backend, default is the fastest backend installed
+    :return: an iterator over the chunks of whole records
+    """
+    with open_fastq(fastq_path, decompression_backend) as fastq_file:
+        pending = b""
+        while data := fastq_file.read(chunk_size):
+            chunk = pending + data
+            # the chunk ends after the last complete record: the lines after it are kept for the next chunk.
+            # It is found from the end, past the newlines of the lines kept (and the partial last line)
+            end = len(chunk)
+            for _ in range(chunk.count(b"\n") % FASTQ_LINES_PER_RECORD + 1):
+                end = chunk.rfind(b"\n", 0, end)
+            end += 1
+            pending = chunk[end:]
+            if end:
+                yield chunk[:end]
+        if pending:
+            yield pending
+
+
+def iter_fastq_sequences_in_chunk(chunk: bytes) -> Iterator[str]:
+    """
+    Yield the sequence of each read in a chunk of whole FASTQ records (see iter_fastq_chunks)
+
+    :param chunk: the uncompressed FASTQ records
+    :return: an iterator over the read sequences
+    """
+    for sequence in islice(chunk.split(b"\n"), 1, None, FASTQ_LINES_PER_RECORD):
+        yield sequence.rstrip().decode("ascii")
+
+
+def sample_bgzf_blocks(fastq_path: Path, num_blocks: int) -> Optional[list[SAMPLED_BLOCK_TYPE]]:
+    """
+    Choose num_blocks evenly spaced blocks of a BGZF FASTQ file, whose reads are a sample of the whole file
+    (the first reads of a FASTQ come from specific channels, tiles or times).
+    The block offsets are loaded from the block index (<fastq>.gzi) if present, otherwise from the block headers
+
+    :param fastq_path: the path of the FASTQ file
+    :param num_blocks: the number of blocks to sample
+    :return: the blocks to read, sorted by offset. None if the FASTQ cannot be sampled (not BGZF, stream) or
+        has no more than num_blocks blocks: it must be read sequentially then
+    """
+    if is_stream(fastq_path) or not is_bgzf(fastq_path):
+        return None
+    block_offsets = load_bgzf_index(fastq_path)
+    if len(block_offsets) <= num_blocks:
+        return None
+    sampled_blocks = []
+    for block_idx in sorted({len(block_offsets) * i // num_blocks for i in range(num_blocks)}):
+        compressed_offset, uncompressed_offset = block_offsets[max(block_idx - 1, 0)]
+        start = block_offsets[block_idx][1]
+        end = block_offsets[block_idx + 1][1] if block_idx + 1 < len(block_offsets) else sys.maxsize
+        sampled_blocks.append((compressed_offset, uncompressed_offset, start, end))
+    return sampled_blocks
+
+
+def _iter_bgzf_lines(fastq_file: BinaryIO, compressed_offset: int, uncompressed_offset: int) -> Iterator[tuple]:
+    """
+    Yield the (uncompressed offset, line) of the lines from a BGZF block on, decompressing one block at a time.
+    The first line is partial unless the block starts a line
+    """
+    fastq_file.seek(compressed_offset)
+    partial_line = b""
+    for data in iter_bgzf_blocks(fastq_file):
+        lines = (partial_line + data).split(b"\n")
+        partial_line = lines.pop()
+        for line in lines:
+            yield uncompressed_offset, line
+            uncompressed_offset += len(line) + 1
+    if partial_line:
+        yield uncompressed_offset, partial_line
+
+
+def iter_fastq_sequences_in_blocks(fastq_path: Path, sampled_blocks: list[SAMPLED_BLOCK_TYPE]) -> Iterator[str]:
+    """
+    Yield the sequence of each read starting within the sampled blocks of a BGZF FASTQ file (see sample_bgzf_blocks).
+    Only the sampled blocks are decompressed, with the block preceding each of them (a record start is recognised
+    from the preceding line end, which may be the last byte of the preceding block) and the following blocks as far
+    as the last read of a sampled block extends
+
+    :param fastq_path: the path of the BGZF FASTQ file
+    :param sampled_blocks: the blocks to read
+    :return: an iterator over the read sequences
+    """
+    with open(fastq_path, "rb") as fastq_file:
+        for compressed_offset, uncompressed_offset, start, end in sampled_blocks:
+            lines = _iter_bgzf_lines(fastq_file, compressed_offset, uncompressed_offset)
+            if uncompressed_offset > 0:
+                # skip the (possibly partial) line
+                next(lines, None)
+            # the record search starts at the line following the last line end before start
+            lines = dropwhile(lambda offset_line: offset_line[0] + len(offset_line[1]) < start, lines)
+            # find the first record start, see find_record_start
+            window = list(islice(lines, FASTQ_LINES_PER_RECORD - 1))
+            while len(window) == FASTQ_LINES_PER_RECORD - 1 and not (
+                window[0][1].startswith(FASTQ_HEADER_PREFIX) and window[2][1].startswith(FASTQ_SEPARATOR_PREFIX)
+            ):
+                window.pop(0)
+                window.extend(islice(lines, 1))
+            if len(window) < FASTQ_LINES_PER_RECORD - 1:
+                continue
+            record_offset, _ = window[0]
+            sequence = window[1][1]
+            while record_offset < end:
+                if record_offset >= start:
+                    yield sequence.rstrip().decode("ascii")
+                # quality line, then the next record
+                record_lines = list(islice(lines, FASTQ_LINES_PER_RECORD))
+                if len(record_lines) < FASTQ_LINES_PER_RECORD - 1:
+                    break
+                (record_offset, _), (_, sequence) = record_lines[1:3]
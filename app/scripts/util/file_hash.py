@@ -0,0 +1,20 @@
+from pathlib import Path
+import hashlib
+
+FINGERPRINT_BLOCK_SIZE = 4 * 1024 * 1024
+
+
+def file_fingerprint(file_path: Path) -> str:
+    """
+    Return the hex SHA-256 of the content of a file, read in large blocks.
+    It identifies the content whatever the path and the modification time of the file
+    (e.g. a FASTQ staged again by a new run)
+
+    :param file_path: the path of the file
+    :return: the fingerprint of the file content
+    """
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as input_file:
+        while block := input_file.read(FINGERPRINT_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
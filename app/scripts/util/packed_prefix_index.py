@@ -0,0 +1,229 @@
+from collections import Counter
+from typing import Iterable, NamedTuple, Optional
+import math
+import numpy as np
+
+# 2-bit codes of the bases. N and any other character are tracked with separate codes,
+# whose 2 low bits are not used for matching
+BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3}
+N_CODE = 4
+INVALID_CODE = 5
+BASES_PER_WORD = 32
+# base codes (3 bits each) per 64-bit word, to deduplicate read prefixes
+CODES_PER_DEDUP_WORD = 21
+# maximum number of (read prefix, sequence) pairs compared at once upon N wildcards
+WILDCARD_CHUNK_SIZE = 1 << 20
+# lookup table from unicode code point (up to 255) to base code. Padding (code point 0) is invalid
+_CODE_LOOKUP = np.full(256, INVALID_CODE, dtype=np.uint8)
+for _base, _code in BASE_CODES.items():
+    _CODE_LOOKUP[ord(_base)] = _code
+_CODE_LOOKUP[ord("N")] = N_CODE
+
+
+class PackedMatches(NamedTuple):
+    """
+    The matches of a batch of read prefixes
+    """
+
+    # key: (ids of the sequences matching exactly, ids of the sequences matching only upon N wildcards),
+    # value: the number of read prefixes with these matches
+    outcomes: Counter
+    # the number of distinct read prefixes in the batch
+    distinct_prefixes: int
+
+
+def _encode(prefixes: np.ndarray, length: int) -> np.ndarray:
+    """
+    Encode an array of unicode strings into a (number of strings, length) matrix of base codes.
+    Strings shorter than length are padded with INVALID_CODE
+    """
+    code_points = prefixes.astype(f"U{length}").view(np.uint32).reshape(len(prefixes), length)
+    return _CODE_LOOKUP[np.minimum(code_points, 255)]
+
+
+def _pack(codes: np.ndarray, lengths: Iterable[int]) -> dict[int, np.ndarray]:
+    """
+    Pack the first bases of each row of a base code matrix into 2-bit packed words, for each of the given lengths.
+    The packed prefixes of length l are a (number of rows, ceil(l / 32)) matrix of uint64 words
+    """
+    lengths = set(lengths)
+    packed: dict[int, np.ndarray] = {}
+    full_words: list[np.ndarray] = []
+    word = np.zeros(len(codes), dtype=np.uint64)
+    for position in range(max(lengths, default=0)):
+        word = (word << np.uint64(2)) | (codes[:, position] & 3).astype(np.uint64)
+        if (position + 1) % BASES_PER_WORD == 0:
+            full_words.append(word)
+            word = np.zeros(len(codes), dtype=np.uint64)
+        if position + 1 in lengths:
+            words = full_words + ([word] if (position + 1) % BASES_PER_WORD else [])
+            packed[position + 1] = np.stack(words, axis=1)
+    return packed
+
+
+def _sortable(words: np.ndarray) -> np.ndarray:
+    """
+    Return keys ordered as the packed words: the words themselves if one per row,
+    otherwise their big-endian bytes (compared lexicographically)
+    """
+    if words.shape[1] == 1:
+        return words[:, 0]
+    return words.astype(">u8").view(f"S{8 * words.shape[1]}").ravel()
+
+
+def _group_rows(matrix: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Sort the rows of an integer matrix and return the sort order and the start of each group of equal rows
+    """
+    order = np.lexsort(matrix.T[::-1])
+    sorted_matrix = matrix[order]
+    starts = np.flatnonzero(np.concatenate([[True], np.any(sorted_matrix[1:] != sorted_matrix[:-1], axis=1)]))
+    return order, starts
+
+
+def _distinct_prefixes(codes: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return the distinct rows of a base code matrix and their counts.
+    The codes (3 bits each) are packed into 64-bit words, which are faster to sort than the strings
+    """
+    words = []
+    for start in range(0, codes.shape[1], CODES_PER_DEDUP_WORD):
+        word = np.zeros(len(codes), dtype=np.uint64)
+        for position in range(start, min(start + CODES_PER_DEDUP_WORD, codes.shape[1])):
+            word = (word << np.uint64(3)) | codes[:, position].astype(np.uint64)
+        words.append(word)
+    order, starts = _group_rows(np.stack(words, axis=1))
+    return codes[order[starts]], np.diff(np.append(starts, len(codes)))
+
+
+class PackedPrefixIndex:
+    """
+    Index of DNA sequences (A, C, G, T only), searched at the beginning of read prefixes.
+    Sequences are 2-bit packed and sorted for each sequence length, so that a batch of read prefixes
+    is matched with one vectorised binary search per sequence length.
+    Ns in read prefixes are tracked with a separate mask: a read prefix with Ns only matches upon wildcards.
+    If wildcard_ids is given, only these sequences are matched upon wildcards (e.g. the primer sequences,
+    not their fuzzy neighbours)
+    """
+
+    def __init__(self, sequences: Iterable[str], wildcard_ids: Optional[Iterable[int]] = None):
+        sequences = list(sequences)
+        invalid_sequences = [sequence for sequence in sequences if set(sequence) - set(BASE_CODES)]
+        if invalid_sequences:
+            raise ValueError(f"Cannot pack sequences with bases other than A, C, G, T: {invalid_sequences[:5]}")
+        self.num_sequences = len(sequences)
+        self.max_length = max(map(len, sequences), default=0)
+        self.lengths = sorted({len(sequence) for sequence in sequences})
+
+        sequence_array = np.array(sequences, dtype=f"U{max(self.max_length, 1)}")
+        sequence_lengths = np.array([len(sequence) for sequence in sequences], dtype=np.int64)
+        packed = _pack(_encode(sequence_array, max(self.max_length, 1)), self.lengths)
+        is_wildcard = np.ones(len(sequences), dtype=bool)
+        if wildcard_ids is not None:
+            is_wildcard[:] = False
+            is_wildcard[list(wildcard_ids)] = True
+        # key: sequence length, value: (sorted keys, sequence ids sorted as the keys)
+        self._keys: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        # key: sequence length, value: (ids, packed words) of the sequences matched upon wildcards
+        self._wildcard_words: dict[int, tuple[np.ndarray, np.ndarray]] = {}
+        for length in self.lengths:
+            ids = np.flatnonzero(sequence_lengths == length)
+            keys = _sortable(packed[length][ids])
+            order = np.argsort(keys, kind="stable")
+            self._keys[length] = (keys[order], ids[order])
+            ids = ids[is_wildcard[ids]]
+            self._wildcard_words[length] = (ids, packed[length][ids])
+
+    def arrays(self) -> dict[str, np.ndarray]:
+        """
+        Return the read-only content of the index as named arrays, from which from_arrays rebuilds the index
+        """
+        arrays = {"num_sequences": np.array(self.num_sequences), "lengths": np.array(self.lengths, dtype=np.int64)}
+        for length in self.lengths:
+            arrays[f"keys_{length}"], arrays[f"ids_{length}"] = self._keys[length]
+            arrays[f"wildcard_ids_{length}"], arrays[f"wildcard_words_{length}"] = self._wildcard_words[length]
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]) -> "PackedPrefixIndex":
+        """
+        Rebuild an index from the arrays returned by arrays(), without copying them (e.g. memory-mapped arrays)
+        """
+        index = cls.__new__(cls)
+        index.num_sequences = int(arrays["num_sequences"])
+        index.lengths = [int(length) for length in arrays["lengths"]]
+        index.max_length = max(index.lengths, default=0)
+        index._keys = {length: (arrays[f"keys_{length}"], arrays[f"ids_{length}"]) for length in index.lengths}
+        index._wildcard_words = {
+            length: (arrays[f"wildcard_ids_{length}"], arrays[f"wildcard_words_{length}"]) for length in index.lengths
+        }
+        return index
+
+    def match(self, read_prefixes: list[str]) -> PackedMatches:
+        """
+        Search the indexed sequences matching the beginning of each read prefix.
+        Equivalent to looking up each read prefix in an ahocorasick automaton of the sequences with
+        MATCH_AT_MOST_PREFIX, without and with N as wildcard
+
+        :param read_prefixes: the read prefixes. Characters after the max sequence length are ignored
+        :return: the read prefix counts for each distinct match
+        """
+        if not read_prefixes or not self.num_sequences:
+            return PackedMatches(Counter({((), ()): len(read_prefixes)}) if read_prefixes else Counter(), 0)
+
+        # amplicon reads are highly redundant at their 5' end: match the distinct prefixes only
+        codes, counts = _distinct_prefixes(
+            _encode(np.array(read_prefixes, dtype=f"U{self.max_length}"), self.max_length)
+        )
+        # for each prefix length, whether the bases so far are A, C, G, T only / A, C, G, T, N only / include Ns
+        exact = np.logical_and.accumulate(codes < N_CODE, axis=1)
+        valid = np.logical_and.accumulate(codes <= N_CODE, axis=1)
+        has_n = np.logical_or.accumulate(codes == N_CODE, axis=1)
+        packed = _pack(codes, self.lengths)
+        n_masks = _pack(np.where(codes == N_CODE, 0, 3).astype(np.uint8), self.lengths)
+
+        exact_ids = np.full((len(codes), len(self.lengths)), -1, dtype=np.int64)
+        wildcard_rows: list[np.ndarray] = []
+        wildcard_ids: list[np.ndarray] = []
+        for column, length in enumerate(self.lengths):
+            keys, ids = self._keys[length]
+            rows = np.flatnonzero(exact[:, length - 1])
+            prefix_keys = _sortable(packed[length][rows])
+            positions = np.minimum(np.searchsorted(keys, prefix_keys), len(keys) - 1)
+            found = keys[positions] == prefix_keys
+            exact_ids[rows[found], column] = ids[positions[found]]
+
+            # prefixes with Ns are rare: compare them against the wildcard sequences of this length, masking the Ns
+            ids, words = self._wildcard_words[length]
+            rows = np.flatnonzero(valid[:, length - 1] & has_n[:, length - 1])
+            for chunk in np.array_split(rows, math.ceil(len(rows) * len(ids) / WILDCARD_CHUNK_SIZE) or 1):
+                matching = np.all(
+                    (words[np.newaxis] & n_masks[length][chunk, np.newaxis]) == packed[length][chunk, np.newaxis],
+                    axis=2,
+                )
+                matching_rows, matching_keys = np.nonzero(matching)
+                wildcard_rows.append(chunk[matching_rows])
+                wildcard_ids.append(ids[matching_keys])
+
+        outcomes: Counter = Counter()
+        # prefixes with wildcard matches: group their (sorted) wildcard matches by prefix
+        matching_rows = np.concatenate(wildcard_rows) if wildcard_rows else np.empty(0, dtype=np.int64)
+        matching_ids = np.concatenate(wildcard_ids) if wildcard_ids else np.empty(0, dtype=np.int64)
+        order = np.lexsort((matching_ids, matching_rows))
+        matching_rows, matching_ids = matching_rows[order], matching_ids[order]
+        rows, starts = np.unique(matching_rows, return_index=True)
+        for row, row_ids in zip(rows.tolist(), np.split(matching_ids, starts[1:]) if len(rows) else []):
+            row_exact_ids = exact_ids[row]
+            outcomes[(tuple(row_exact_ids[row_exact_ids >= 0].tolist()), tuple(row_ids.tolist()))] += int(counts[row])
+
+        # other prefixes: group them by exact matches
+        other_rows = np.ones(len(codes), dtype=bool)
+        other_rows[rows] = False
+        rows = np.flatnonzero(other_rows)
+        if len(rows):
+            order, starts = _group_rows(exact_ids[rows])
+            group_counts = np.add.reduceat(counts[rows][order], starts)
+            for ids, count in zip(exact_ids[rows][order[starts]], group_counts.tolist()):
+                outcomes[(tuple(ids[ids >= 0].tolist()), ())] += count
+
+        return PackedMatches(outcomes, len(codes))
@@ -0,0 +1,143 @@
+from dataclasses import dataclass, field
+from pathlib import Path
+from time import perf_counter
+from typing import Optional
+import hashlib
+import pickle
+import struct
+import ahocorasick
+
+# binary layout: header (magic, format version, SHA-256 of the payload, payload size), then the pickled payload
+BUNDLE_MAGIC = b"PSGAPIDX"
+BUNDLE_VERSION = 1
+BUNDLE_HEADER = struct.Struct(f">{len(BUNDLE_MAGIC)}sH32sQ")
+BUNDLE_SUFFIX = ".bundle"
+
+NUM_PRIMERS_KEY = "num_primers"
+SCHEMES_PER_SEQUENCE_KEY = "schemes_per_sequence"
+AUTOMATON_KEY = "automaton"
+MAX_PRIMER_LENGTH_KEY = "max_primer_length"
+FUZZY_SCHEMES_PER_SEQUENCE_KEY = "fuzzy_schemes_per_sequence"
+
+
+@dataclass
+class PrimerIndexBundle:
+    # key: primer scheme name, value: the number of primer sequences of the scheme
+    num_primers: dict[str, int] = field(metadata={"required": True})
+    # key: deduplicated primer sequence, value: the tuple of primer schemes containing that sequence
+    schemes_per_sequence: dict[str, tuple] = field(metadata={"required": True})
+    # prebuilt automaton with the same keys and values as schemes_per_sequence,
+    # plus the fuzzy sequences (if any) that are not primer sequences, with an empty tuple of schemes
+    automaton: ahocorasick.Automaton = field(metadata={"required": True})
+    max_primer_length: int = field(metadata={"required": True})
+    # key: sequence at Hamming distance 1 from primer sequences, value: the tuple of primer schemes containing them.
+    # Empty unless the bundle was built with the fuzzy sequences
+    fuzzy_schemes_per_sequence: dict[str, tuple] = field(default_factory=dict)
+    # hex SHA-256 of the payload, identifying the bundle content
+    checksum: str = field(default="")
+    # time spent reading, verifying and deserialising the bundle
+    load_seconds: float = field(default=0.0)
+
+
+def is_primer_index_bundle(index_path: Path) -> bool:
+    """
+    Return True if the file is a primer index bundle
+    """
+    with open(index_path, "rb") as index_file:
+        return index_file.read(len(BUNDLE_MAGIC)) == BUNDLE_MAGIC
+
+
+def _group_schemes_per_sequence(scheme_sequences: dict[str, list[str]]) -> dict[str, tuple]:
+    """
+    Return the deduplicated sequences of all schemes, with the sorted tuple of the schemes containing each sequence
+    """
+    schemes_per_sequence: dict[str, list[str]] = {}
+    for scheme in sorted(scheme_sequences):
+        for sequence in scheme_sequences[scheme]:
+            schemes = schemes_per_sequence.setdefault(sequence, [])
+            if scheme not in schemes:
+                schemes.append(scheme)
+    return {sequence: tuple(schemes) for sequence, schemes in schemes_per_sequence.items()}
+
+
+def write_primer_index_bundle(
+    bundle_path: Path,
+    num_primers: dict[str, int],
+    scheme_sequences: dict[str, list[str]],
+    fuzzy_scheme_sequences: Optional[dict[str, list[str]]] = None,
+) -> str:
+    """
+    Write a primer index bundle holding the deduplicated primer sequences of all schemes,
+    the scheme membership of each sequence and a prebuilt automaton.
+    The fuzzy sequences (e.g. the Hamming distance 1 neighbours of the primer sequences), if any,
+    are added to the automaton too, and their scheme membership is stored separately.
+    The bundle is written to a temporary file first, so that readers never see a partial bundle
+
+    :param bundle_path: the path of the bundle to write
+    :param num_primers: the number of primer sequences of each scheme
+    :param scheme_sequences: the primer sequences of each scheme
+    :param fuzzy_scheme_sequences: the fuzzy sequences of each scheme
+    :return: the checksum of the bundle
+    """
+    schemes_per_sequence = _group_schemes_per_sequence(scheme_sequences)
+    fuzzy_schemes_per_sequence = _group_schemes_per_sequence(fuzzy_scheme_sequences or {})
+
+    automaton = ahocorasick.Automaton()
+    for sequence in fuzzy_schemes_per_sequence:
+        automaton.add_word(sequence, ())
+    for sequence, schemes in schemes_per_sequence.items():
+        automaton.add_word(sequence, schemes)
+
+    content = {
+        NUM_PRIMERS_KEY: {scheme: num_primers[scheme] for scheme in sorted(num_primers)},
+        SCHEMES_PER_SEQUENCE_KEY: schemes_per_sequence,
+        AUTOMATON_KEY: automaton,
+        MAX_PRIMER_LENGTH_KEY: max((len(sequence) for sequence in automaton.keys()), default=0),
+    }
+    if fuzzy_schemes_per_sequence:
+        # only stored if present, so that the bundles without fuzzy sequences are unchanged
+        content[FUZZY_SCHEMES_PER_SEQUENCE_KEY] = fuzzy_schemes_per_sequence
+    payload = pickle.dumps(content, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.sha256(payload).digest()
+
+    tmp_bundle_path = bundle_path.with_name(f".{bundle_path.name}.tmp")
+    with open(tmp_bundle_path, "wb") as bundle_file:
+        bundle_file.write(BUNDLE_HEADER.pack(BUNDLE_MAGIC, BUNDLE_VERSION, digest, len(payload)))
+        bundle_file.write(payload)
+    tmp_bundle_path.replace(bundle_path)
+    return digest.hex()
+
+
+def load_primer_index_bundle(bundle_path: Path) -> PrimerIndexBundle:
+    """
+    Load a primer index bundle with a single read, verifying its version and checksum
+
+    :param bundle_path: the path of the bundle
+    :return: the primer index bundle
+    """
+    start = perf_counter()
+    content = memoryview(Path(bundle_path).read_bytes())
+    if len(content) < BUNDLE_HEADER.size:
+        raise ValueError(f"Primer index bundle {bundle_path} is truncated")
+    magic, version, digest, payload_size = BUNDLE_HEADER.unpack_from(content)
+    if magic != BUNDLE_MAGIC:
+        raise ValueError(f"{bundle_path} is not a primer index bundle")
+    if version != BUNDLE_VERSION:
+        raise ValueError(f"Primer index bundle {bundle_path} has version {version}, expected version {BUNDLE_VERSION}")
+    payload = content[BUNDLE_HEADER.size :]
+    if len(payload) != payload_size:
+        raise ValueError(f"Primer index bundle {bundle_path} is truncated")
+    if hashlib.sha256(payload).digest() != digest:
+        raise ValueError(f"Primer index bundle {bundle_path} is corrupted: checksum mismatch")
+
+    data = pickle.loads(payload)
+    bundle = PrimerIndexBundle(
+        num_primers=data[NUM_PRIMERS_KEY],
+        schemes_per_sequence=data[SCHEMES_PER_SEQUENCE_KEY],
+        automaton=data[AUTOMATON_KEY],
+        max_primer_length=data[MAX_PRIMER_LENGTH_KEY],
+        fuzzy_schemes_per_sequence=data.get(FUZZY_SCHEMES_PER_SEQUENCE_KEY, {}),
+        checksum=digest.hex(),
+    )
+    bundle.load_seconds = perf_counter() - start
+    return bundle
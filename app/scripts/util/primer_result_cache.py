@@ -0,0 +1,102 @@
+from pathlib import Path
+from typing import Optional
+import hashlib
+import json
+import os
+import tempfile
+
+from app.scripts.util.data_loading import load_json, write_json
+
+# bump when the content of the cached results changes, so that older entries are not reused
+RESULT_CACHE_VERSION = 1
+RESULT_CACHE_SUFFIX = ".json"
+# the least recently used results are evicted once the cache exceeds this size, in bytes
+DEFAULT_RESULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+
+def result_cache_key(**key_parts) -> str:
+    """
+    Return the cache key of a result, from everything the result depends on
+
+    :param key_parts: JSON serialisable values, e.g. the input fingerprint and the index checksum
+    :return: the hex SHA-256 of the key parts and of the cache version
+    """
+    content = json.dumps({"version": RESULT_CACHE_VERSION, **key_parts}, sort_keys=True)
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def load_cached_result(cache_dir: Path, key: str) -> Optional[dict]:
+    """
+    Return the result cached with this key, None if missing or unreadable.
+    The modification time of a cache hit is updated, to evict the least recently used results first
+
+    :param cache_dir: the cache directory
+    :param key: the cache key
+    :return: the cached result
+    """
+    result_path = Path(cache_dir) / f"{key}{RESULT_CACHE_SUFFIX}"
+    try:
+        result = load_json(result_path)
+        os.utime(result_path)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError):
+        # corrupted entry: remove it, so that it is stored again
+        result_path.unlink(missing_ok=True)
+        return None
+    return result
+
+
+def store_cached_result(
+    cache_dir: Path, key: str, result: dict, max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES
+) -> None:
+    """
+    Store a result in the cache, then evict the least recently used results beyond max_bytes.
+    The result is written to a temporary file first, so that concurrent processes never read a partial result
+
+    :param cache_dir: the cache directory, created if missing
+    :param key: the cache key
+    :param result: the JSON serialisable result
+    :param max_bytes: the maximum size of the cache
+    """
+    cache_path = Path(cache_dir)
+    cache_path.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path, prefix=f".{key}.")
+    os.close(fd)
+    try:
+        write_json(result, Path(tmp_path))
+        # readable by the other users sharing the cache
+        os.chmod(tmp_path, 0o644)
+        os.replace(tmp_path, cache_path / f"{key}{RESULT_CACHE_SUFFIX}")
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+    evict_cached_results(cache_path, max_bytes)
+
+
+def evict_cached_results(cache_dir: Path, max_bytes: int = DEFAULT_RESULT_CACHE_MAX_BYTES) -> list[Path]:
+    """
+    Remove the least recently used results until the cache size is at most max_bytes
+
+    :param cache_dir: the cache directory
+    :param max_bytes: the maximum size of the cache
+    :return: the paths of the removed results
+    """
+    entries = []
+    for result_path in Path(cache_dir).glob(f"*{RESULT_CACHE_SUFFIX}"):
+        try:
+            stat = result_path.stat()
+        except FileNotFoundError:
+            # removed by a concurrent eviction
+            continue
+        entries.append((stat.st_mtime_ns, stat.st_size, result_path))
+
+    removed = []
+    cache_size = sum(size for _, size, _ in entries)
+    for _, size, result_path in sorted(entries):
+        if cache_size <= max_bytes:
+            break
+        result_path.unlink(missing_ok=True)
+        removed.append(result_path)
+        cache_size -= size
+    return removed
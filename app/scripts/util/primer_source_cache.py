@@ -0,0 +1,97 @@
+from pathlib import Path
+from typing import Optional
+import hashlib
+import os
+import tarfile
+import tempfile
+
+SOURCE_CACHE_SUFFIX = ".tar.gz"
+# the git metadata is not needed to prepare the primers
+EXCLUDED_DIRS = {".git"}
+
+
+def source_cache_path(cache_dir: Path, primer_repo: str, repo_commit: str, source_schemes: str) -> Path:
+    """
+    Return the path of the cached primer schemes of a repository at a commit.
+    The file name starts with the repository name and the commit, so that a cache directory can be inspected
+    (e.g. when seeding it for offline builds)
+
+    :param cache_dir: the cache directory
+    :param primer_repo: the repository URL storing the primers
+    :param repo_commit: the repository commit
+    :param source_schemes: the subpath to the primer schemes within the repository
+    :return: the path of the tarball of the primer schemes
+    """
+    repo_name = primer_repo.rstrip("/").rsplit("/", 1)[-1].removesuffix(".git")
+    key = hashlib.sha256("\n".join([primer_repo, repo_commit, source_schemes]).encode()).hexdigest()
+    return Path(cache_dir) / f"{repo_name}-{repo_commit}-{key[:16]}{SOURCE_CACHE_SUFFIX}"
+
+
+def _exclude_dirs(tarinfo: tarfile.TarInfo) -> Optional[tarfile.TarInfo]:
+    if EXCLUDED_DIRS.intersection(Path(tarinfo.name).parts):
+        return None
+    return tarinfo
+
+
+def store_source_tarball(cache_path: Path, repo_path: Path, source_schemes: str) -> None:
+    """
+    Store the primer schemes subtree of a cloned repository as a tarball, with the paths relative to the
+    repository root. The tarball is written to a temporary file first, so that concurrent builds never read
+    a partial tarball
+
+    :param cache_path: the path of the tarball, its directory is created if missing
+    :param repo_path: the path of the cloned repository
+    :param source_schemes: the subpath to the primer schemes within the repository
+    """
+    cache_path = Path(cache_path)
+    cache_path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=cache_path.parent, suffix=SOURCE_CACHE_SUFFIX)
+    try:
+        with os.fdopen(fd, "wb") as tmp_file, tarfile.open(fileobj=tmp_file, mode="w:gz") as tar:
+            tar.add(Path(repo_path) / source_schemes, arcname=source_schemes, filter=_exclude_dirs)
+        os.replace(tmp_path, cache_path)
+    except BaseException:
+        Path(tmp_path).unlink(missing_ok=True)
+        raise
+
+
+def _is_within(path: str, directory: Path) -> bool:
+    return Path(os.path.realpath(directory / path)).is_relative_to(os.path.realpath(directory))
+
+
+def check_tarball_members(tar: tarfile.TarFile, repo_path: Path) -> None:
+    """
+    Check that extracting a tarball only writes regular files and directories within repo_path.
+    Raise a ValueError for absolute paths, paths or links outside repo_path and special files (e.g. devices).
+    The same checks as the "data" extraction filter, for the Python versions without extraction filters
+    """
+    repo_path = Path(repo_path)
+    for member in tar.getmembers():
+        if not _is_within(member.name, repo_path):
+            raise ValueError(f"Tarball member {member.name} is outside the extraction directory")
+        if member.issym():
+            link_target = os.path.join(os.path.dirname(member.name), member.linkname)
+        elif member.islnk():
+            link_target = member.linkname
+        elif member.isfile() or member.isdir():
+            continue
+        else:
+            raise ValueError(f"Tarball member {member.name} is a special file")
+        if os.path.isabs(member.linkname) or not _is_within(link_target, repo_path):
+            raise ValueError(f"Tarball member {member.name} links outside the extraction directory")
+
+
+def extract_source_tarball(cache_path: Path, repo_path: Path) -> None:
+    """
+    Extract a tarball stored by store_source_tarball, restoring the primer schemes subtree of the repository.
+    Absolute paths, links outside repo_path and special files are rejected
+
+    :param cache_path: the path of the tarball
+    :param repo_path: the directory standing for the repository root
+    """
+    with tarfile.open(cache_path, mode="r:gz") as tar:
+        if hasattr(tarfile, "data_filter"):
+            tar.extractall(repo_path, filter="data")
+        else:
+            check_tarball_members(tar, repo_path)
+            tar.extractall(repo_path)
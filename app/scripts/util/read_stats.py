@@ -0,0 +1,126 @@
+from dataclasses import dataclass, field
+from typing import Iterable, Iterator
+import numpy as np
+
+# number of reads accumulated at once
+READ_STATS_BATCH_SIZE = 10000
+
+_GC_CODES = [ord(base) for base in "GCgc"]
+_N_CODES = [ord(base) for base in "Nn"]
+
+
+@dataclass
+class ReadStats:
+    """
+    Statistics of the reads of a sample, accumulated in batches with NumPy.
+    The statistics of several parts of a sample (workers, byte ranges) are merged with additions
+    """
+
+    numreads: int = 0
+    total_bases: int = 0
+    gc_bases: int = 0
+    n_bases: int = 0
+    # the number of reads of each length (the index)
+    length_histogram: np.ndarray = field(default_factory=lambda: np.zeros(1, dtype=np.int64))
+
+    def _add_length_histogram(self, length_histogram: np.ndarray) -> None:
+        if len(length_histogram) > len(self.length_histogram):
+            length_histogram = length_histogram.copy()
+            length_histogram[: len(self.length_histogram)] += self.length_histogram
+            self.length_histogram = length_histogram
+        else:
+            self.length_histogram[: len(length_histogram)] += length_histogram
+
+    def update(self, sequences: list[str]) -> None:
+        """
+        Add a batch of read sequences (ASCII) to the statistics
+        """
+        if not sequences:
+            return
+        lengths = np.fromiter(map(len, sequences), dtype=np.int64, count=len(sequences))
+        self._add_length_histogram(np.bincount(lengths))
+        base_counts = np.bincount(np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8), minlength=256)
+        self.numreads += len(sequences)
+        self.total_bases += int(lengths.sum())
+        self.gc_bases += int(base_counts[_GC_CODES].sum())
+        self.n_bases += int(base_counts[_N_CODES].sum())
+
+    def observe(self, sequences: Iterable[str]) -> Iterator[str]:
+        """
+        Yield the read sequences unchanged, adding them to the statistics by batches.
+        The statistics are complete once the returned iterator is exhausted
+        """
+        batch: list[str] = []
+        for sequence in sequences:
+            batch.append(sequence)
+            if len(batch) == READ_STATS_BATCH_SIZE:
+                self.update(batch)
+                batch = []
+            yield sequence
+        self.update(batch)
+
+    def merge(self, other: "ReadStats") -> "ReadStats":
+        """
+        Add the statistics of other to these statistics
+        """
+        self.numreads += other.numreads
+        self.total_bases += other.total_bases
+        self.gc_bases += other.gc_bases
+        self.n_bases += other.n_bases
+        self._add_length_histogram(other.length_histogram)
+        return self
+
+    @property
+    def min_length(self) -> int:
+        return int(np.flatnonzero(self.length_histogram)[0]) if self.numreads else 0
+
+    @property
+    def max_length(self) -> int:
+        return int(np.flatnonzero(self.length_histogram)[-1]) if self.numreads else 0
+
+    @property
+    def mean_length(self) -> float:
+        return self.total_bases / self.numreads if self.numreads else 0.0
+
+    @property
+    def gc_fraction(self) -> float:
+        """
+        The fraction of G and C out of the bases other than N
+        """
+        called_bases = self.total_bases - self.n_bases
+        return self.gc_bases / called_bases if called_bases else 0.0
+
+    @property
+    def n_rate(self) -> float:
+        return self.n_bases / self.total_bases if self.total_bases else 0.0
+
+    def to_dict(self) -> dict:
+        """
+        Return the statistics, with the length histogram as a dictionary {read length: number of reads}
+        """
+        return {
+            "numreads": self.numreads,
+            "total_bases": self.total_bases,
+            "gc_bases": self.gc_bases,
+            "n_bases": self.n_bases,
+            "length_histogram": {
+                int(length): int(self.length_histogram[length]) for length in np.flatnonzero(self.length_histogram)
+            },
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "ReadStats":
+        """
+        Inverse of to_dict. The keys of the length histogram may be strings (e.g. loaded from JSON)
+        """
+        read_stats = cls(
+            numreads=data["numreads"],
+            total_bases=data["total_bases"],
+            gc_bases=data["gc_bases"],
+            n_bases=data["n_bases"],
+        )
+        lengths = [int(length) for length in data["length_histogram"]]
+        length_histogram = np.zeros(max(lengths, default=0) + 1, dtype=np.int64)
+        length_histogram[lengths] = list(data["length_histogram"].values())
+        read_stats.length_histogram = length_histogram
+        return read_stats
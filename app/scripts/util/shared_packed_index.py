@@ -0,0 +1,131 @@
+from pathlib import Path
+from time import time
+from typing import Callable
+import os
+import shutil
+import tempfile
+import numpy as np
+
+from app.scripts.util.logger import get_structlog_logger
+from app.scripts.util.packed_prefix_index import PackedPrefixIndex
+
+logger = get_structlog_logger()
+
+# bump when the arrays of the packed index change, so that older entries are not attached
+SHARED_INDEX_VERSION = 1
+SHARED_INDEX_PREFIX = "psga_packed_index_"
+SHARED_INDEX_SUFFIX = ".npy"
+# the entries not attached since this age, in seconds, are removed
+SHARED_INDEX_MAX_AGE_SECONDS = 24 * 3600
+
+
+def shared_index_path(shared_index_dir: Path, checksum: str) -> Path:
+    """
+    Return the directory of the arrays of a packed index, keyed by the checksum of its primer index
+    """
+    return Path(shared_index_dir) / f"{SHARED_INDEX_PREFIX}v{SHARED_INDEX_VERSION}_{checksum}"
+
+
+def attach_packed_index(index_path: Path) -> PackedPrefixIndex:
+    """
+    Attach the arrays of a published packed index read-only: they are memory-mapped, so that the processes
+    attaching the same index share its pages. Raises FileNotFoundError if the index is missing (or removed meanwhile)
+    """
+    arrays = {
+        array_path.name[: -len(SHARED_INDEX_SUFFIX)]: np.load(array_path, mmap_mode="r")
+        for array_path in Path(index_path).glob(f"*{SHARED_INDEX_SUFFIX}")
+    }
+    try:
+        index = PackedPrefixIndex.from_arrays(arrays)
+    except KeyError as error:
+        raise FileNotFoundError(f"No packed index in {index_path}") from error
+    try:
+        # last use, for the removal of the stale indexes
+        os.utime(index_path)
+    except PermissionError:
+        # published by another user: only the indexes of the current user are kept alive
+        pass
+    return index
+
+
+def publish_packed_index(index: PackedPrefixIndex, index_path: Path) -> None:
+    """
+    Publish the arrays of a packed index. They are written to a temporary directory first, then renamed,
+    so that the other processes never attach a partial index. If another process published the index meanwhile,
+    its copy is kept
+    """
+    index_path = Path(index_path)
+    tmp_path = Path(tempfile.mkdtemp(dir=index_path.parent, prefix=f".{index_path.name}."))
+    try:
+        for name, array in index.arrays().items():
+            np.save(tmp_path / f"{name}{SHARED_INDEX_SUFFIX}", array)
+        # readable by the other users of the node
+        os.chmod(tmp_path, 0o755)
+        os.rename(tmp_path, index_path)
+    except OSError:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        if not index_path.is_dir():
+            raise
+
+
+def remove_stale_packed_indexes(
+    shared_index_dir: Path, max_age_seconds: float = SHARED_INDEX_MAX_AGE_SECONDS
+) -> list[Path]:
+    """
+    Remove the packed indexes (and the leftover temporary directories) not used since max_age_seconds.
+    An index is renamed before its removal, so that it is never attached partially.
+    The processes which attached it keep their mapped arrays
+
+    :param shared_index_dir: the node-wide directory of the packed indexes
+    :param max_age_seconds: the age of the last use beyond which an index is removed
+    :return: the removed indexes
+    """
+    removed = []
+    oldest_use = time() - max_age_seconds
+    for index_path in Path(shared_index_dir).glob(f"*{SHARED_INDEX_PREFIX}*"):
+        try:
+            if index_path.stat().st_mtime >= oldest_use:
+                continue
+            stale_path = Path(tempfile.mkdtemp(dir=shared_index_dir, prefix=f".stale.{index_path.name}."))
+            os.rename(index_path, stale_path / index_path.name)
+        except OSError:
+            # used, or removed by another process, meanwhile
+            continue
+        shutil.rmtree(stale_path, ignore_errors=True)
+        removed.append(index_path)
+    return removed
+
+
+def load_shared_packed_index(
+    shared_index_dir: Path, checksum: str, build_index: Callable[[], PackedPrefixIndex]
+) -> PackedPrefixIndex:
+    """
+    Attach the packed index of a primer index from a node-wide directory, publishing it first if missing.
+    If the node-wide directory cannot be used (e.g. full), the local temporary directory is used instead,
+    and if neither can, the packed index is kept in memory
+
+    :param shared_index_dir: the node-wide directory (e.g. /dev/shm)
+    :param checksum: the checksum of the primer index
+    :param build_index: builds the packed index of the primer index
+    :return: the packed index
+    """
+    index = None
+    for index_dir in dict.fromkeys([Path(shared_index_dir), Path(tempfile.gettempdir())]):
+        index_path = shared_index_path(index_dir, checksum)
+        try:
+            return attach_packed_index(index_path)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as error:
+            logger.warning("Cannot attach the shared packed index", index_path=str(index_path), error=str(error))
+            continue
+        if index is None:
+            index = build_index()
+        try:
+            remove_stale_packed_indexes(index_dir)
+            publish_packed_index(index, index_path)
+            logger.info("Packed index published", index_path=str(index_path))
+            return attach_packed_index(index_path)
+        except OSError as error:
+            logger.warning("Cannot publish the shared packed index", index_path=str(index_path), error=str(error))
+    return index if index is not None else build_index()
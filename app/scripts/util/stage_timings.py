@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from time import perf_counter
+from typing import Any, Iterator, Optional
+import os
+import resource
+import psutil
+
+
+def cpu_seconds() -> float:
+    """
+    Return the CPU time (user and system) of this process and of its terminated child processes (e.g. the workers
+    of a process pool, once joined)
+    """
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+
+def bytes_read() -> int:
+    """
+    Return the number of bytes read by this process with read system calls (cached or not), 0 if the platform
+    does not report them
+    """
+    try:
+        return psutil.Process().io_counters().read_chars
+    except (AttributeError, psutil.Error):
+        return 0
+
+
+def peak_rss_mb() -> float:
+    """
+    Return the peak resident set size of this process and of its largest terminated child process, in MB
+    """
+    max_rss_kb = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    )
+    return max_rss_kb / 1024
+
+
+@dataclass
+class StageTiming:
+    """
+    The cost of a processing stage
+    """
+
+    stage: str = field(metadata={"required": True})
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0
+    # the reads processed by the stage, set by the caller
+    reads: int = 0
+    # the bytes read by this process during the stage (not by its child processes)
+    bytes_read: int = 0
+    # the peak RSS reached so far: the peak of the process lifetime, not of the stage only
+    peak_rss_mb: float = 0.0
+
+    @property
+    def reads_per_second(self) -> float:
+        return self.reads / self.wall_seconds if self.wall_seconds else 0.0
+
+    def to_dict(self) -> dict:
+        return {**asdict(self), "reads_per_second": self.reads_per_second}
+
+
+@dataclass
+class StageTimings:
+    """
+    The cost of the stages of a process, in order of completion. A stage may contain other stages.
+    If a structlog logger is given, each completed stage is logged with its measures as fields
+    """
+
+    logger: Optional[Any] = field(default=None, repr=False, compare=False)
+    stages: list[StageTiming] = field(default_factory=list)
+
+    @contextmanager
+    def measure(self, stage: str) -> Iterator[StageTiming]:
+        """
+        Measure the stage run within the context. The stage is recorded only if it completes without error
+
+        :param stage: the name of the stage
+        :return: the timing of the stage, whose reads can be set within the context
+        """
+        timing = StageTiming(stage=stage)
+        start_wall, start_cpu, start_bytes = perf_counter(), cpu_seconds(), bytes_read()
+        yield timing
+        timing.wall_seconds = perf_counter() - start_wall
+        timing.cpu_seconds = cpu_seconds() - start_cpu
+        timing.bytes_read = bytes_read() - start_bytes
+        timing.peak_rss_mb = peak_rss_mb()
+        self.stages.append(timing)
+        if self.logger is not None:
+            self.logger.info("Stage completed", **timing.to_dict())
+
+    def to_dict(self) -> dict:
+        return {"stages": [timing.to_dict() for timing in self.stages]}
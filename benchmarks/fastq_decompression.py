@@ -0,0 +1,60 @@
+"""
+Compare the throughput of the gzip decompression backends available to the FASTQ reader.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/fastq_decompression.py [FASTQ ...]
+
+Without arguments, the gzipped FASTQ files in local_test are used.
+"""
+
+from pathlib import Path
+from time import perf_counter
+import click
+
+from app.scripts.util.fastq import available_decompression_backends, is_gzipped, iter_fastq_sequences
+
+LOCAL_TEST_PATH = Path(__file__).resolve().parent.parent / "local_test"
+
+
+def time_backend(fastq_paths: list[Path], decompression_backend: str, repeat: int) -> tuple[float, int, int]:
+    """
+    Read the sequences of all the FASTQ files with a decompression backend, keeping the best of repeat runs
+
+    :return: the best elapsed time in seconds, the number of reads and the number of sequenced bases
+    """
+    best_elapsed = float("inf")
+    for _ in range(repeat):
+        reads = bases = 0
+        start = perf_counter()
+        for fastq_path in fastq_paths:
+            for sequence in iter_fastq_sequences(fastq_path, decompression_backend):
+                reads += 1
+                bases += len(sequence)
+        best_elapsed = min(best_elapsed, perf_counter() - start)
+    return best_elapsed, reads, bases
+
+
+@click.command()
+@click.argument("fastq_paths", nargs=-1, type=click.Path(exists=True, dir_okay=False, path_type=Path))
+@click.option("--repeat", type=click.IntRange(min=1), default=3, help="number of runs per backend")
+def main(fastq_paths: tuple[Path, ...], repeat: int) -> None:
+    """
+    Print the reads/s and the compressed MB/s of each available decompression backend
+    """
+    fastq_paths = list(fastq_paths) or sorted(p for p in LOCAL_TEST_PATH.glob("*/*.fastq.gz") if is_gzipped(p))
+    if not fastq_paths:
+        raise click.UsageError(f"No gzipped FASTQ file found in {LOCAL_TEST_PATH}")
+    compressed_mb = sum(p.stat().st_size for p in fastq_paths) / 1024**2
+
+    click.echo(f"{len(fastq_paths)} files, {compressed_mb:.1f} MB compressed, best of {repeat} runs")
+    click.echo(f"{'backend':<10}{'seconds':>10}{'reads/s':>14}{'MB/s':>10}")
+    for decompression_backend in available_decompression_backends():
+        elapsed, reads, _ = time_backend(fastq_paths, decompression_backend, repeat)
+        click.echo(
+            f"{decompression_backend:<10}{elapsed:>10.3f}{reads / elapsed:>14,.0f}{compressed_mb / elapsed:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    main()
@@ -0,0 +1,340 @@
+"""
+Measure the throughput and the peak memory of the primer autodetection stages on synthetic amplicon reads.
+
+The reads are generated from the reference and the BED files of the primer schemes in data/sars_cov_2/primer_schemes:
+each read starts at the beginning of an amplicon (forward strand) or at its end (reverse strand, reverse complemented),
+then sequencing errors and Ns are added at random. Each stage runs in a fresh process, so that its peak RSS is
+measured separately: build_primers_automaton, count_primer_matches and select_primer.
+
+Usage (from the repository root):
+    PYTHONPATH=. python benchmarks/primer_autodetection.py [--reads 200000] [--scheme-mix ARTIC_V4-1=0.7,...]
+    PYTHONPATH=. python benchmarks/primer_autodetection.py --save-baseline
+    # after an engine change, compare with the stored baseline (same read options, any engine and workers)
+    PYTHONPATH=. python benchmarks/primer_autodetection.py
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Callable, Optional
+import csv
+import gzip
+import multiprocessing
+import re
+import click
+import numpy as np
+from Bio import SeqIO
+from Bio.Seq import reverse_complement
+
+from app.scripts.util.data_loading import load_json, write_json
+from app.scripts.primer_autodetection import (
+    AUTOMATON_ENGINE,
+    MATCHING_ENGINES,
+    UNKNOWN,
+    build_primers_automaton,
+    count_primer_matches,
+    select_primer,
+    write_primer_coverage,
+)
+from app.scripts.primer_cols import FASTA_PATH, PICKLE_PATH, PRIMER_INDEX_COLS, PRIMER_NAME
+from app.scripts.util.stage_timings import peak_rss_mb
+
+DATA_PATH = Path(__file__).resolve().parent.parent / "data" / "sars_cov_2"
+PRIMER_INDEX_PATH = DATA_PATH / "primer_schemes" / "SARS-CoV-2_primer_index.csv"
+DEFAULT_BASELINE_PATH = Path(__file__).resolve().parent / "primer_autodetection_baseline.json"
+SCHEME_BED = "SARS-CoV-2.scheme.bed"
+REFERENCE_FASTA = "SARS-CoV-2.reference.fasta"
+
+SAMPLE_ID = "benchmark"
+BASES = b"ACGT"
+# number of reads generated at once
+READ_BATCH_SIZE = 50000
+# e.g. nCoV-2019_1_LEFT, nCoV-2019_1_LEFT_alt1, SARS-CoV-2_1_RIGHT
+AMPLICON_NAME_PATTERN = re.compile(r"^(?P<amplicon>.+)_(?P<side>LEFT|RIGHT)")
+
+STAGES = ["build_primers_automaton", "count_primer_matches", "select_primer"]
+
+
+def parse_scheme_mix(scheme_mix: str) -> dict[str, float]:
+    """
+    Parse a scheme mix, e.g. ARTIC_V4-1=0.7,Midnight-ONT_V3=0.3 (a scheme without weight has weight 1)
+
+    :return: the fraction of the reads of each scheme
+    """
+    weights = {}
+    for item in scheme_mix.split(","):
+        scheme, _, weight = item.strip().partition("=")
+        weights[scheme] = float(weight) if weight else 1.0
+    total_weight = sum(weights.values())
+    if not weights or total_weight <= 0 or any(weight < 0 for weight in weights.values()):
+        raise ValueError(f"Invalid scheme mix: {scheme_mix}")
+    return {scheme: weight / total_weight for scheme, weight in weights.items()}
+
+
+def write_primer_index(primer_index_path: Path) -> list[str]:
+    """
+    Write the primer index of the repository schemes, with the paths of the FASTA and pickle files under DATA_PATH
+
+    :return: the names of the primer schemes
+    """
+    primers = []
+    with open(PRIMER_INDEX_PATH, newline="") as index_in, open(primer_index_path, "w", newline="") as index_out:
+        writer = csv.DictWriter(index_out, fieldnames=PRIMER_INDEX_COLS)
+        writer.writeheader()
+        for row in csv.DictReader(index_in):
+            row[FASTA_PATH] = f"{DATA_PATH}{row[FASTA_PATH]}"
+            row[PICKLE_PATH] = f"{DATA_PATH}{row[PICKLE_PATH]}"
+            writer.writerow(row)
+            primers.append(row[PRIMER_NAME])
+    return primers
+
+
+def load_amplicons(scheme_path: Path) -> list[str]:
+    """
+    Return the amplicon sequences of a scheme: from the start of its leftmost left primer to the end of its
+    rightmost right primer
+    """
+    ref_sequence = str(next(SeqIO.parse(scheme_path / REFERENCE_FASTA, "fasta")).seq)
+    amplicon_bounds: dict[str, list[int]] = {}
+    with open(scheme_path / SCHEME_BED, newline="") as bedfile:
+        for row in csv.reader(bedfile, delimiter="\t"):
+            name_match = AMPLICON_NAME_PATTERN.match(row[3])
+            if not name_match:
+                continue
+            bounds = amplicon_bounds.setdefault(name_match["amplicon"], [len(ref_sequence), 0])
+            if name_match["side"] == "LEFT":
+                bounds[0] = min(bounds[0], int(row[1]))
+            else:
+                bounds[1] = max(bounds[1], int(row[2]))
+    return [ref_sequence[start:end] for start, end in amplicon_bounds.values() if start < end]
+
+
+def generate_amplicon_reads(
+    fastq_path: Path,
+    scheme_paths: dict[str, Path],
+    scheme_mix: dict[str, float],
+    num_reads: int,
+    read_length: int,
+    error_rate: float,
+    n_rate: float,
+    reverse_fraction: float = 0.5,
+    seed: int = 0,
+) -> None:
+    """
+    Write a gzipped FASTQ of synthetic amplicon reads
+
+    :param fastq_path: the output FASTQ
+    :param scheme_paths: the directory of the BED and reference files of each scheme
+    :param scheme_mix: the fraction of the reads of each scheme
+    :param num_reads: the number of reads
+    :param read_length: the read length, shorter for the amplicons shorter than this
+    :param error_rate: the probability that a base is substituted by a different base
+    :param n_rate: the probability that a base is an N
+    :param reverse_fraction: the fraction of the reads of the reverse strand
+    :param seed: the seed of the random generator
+    """
+    rng = np.random.default_rng(seed)
+    schemes = list(scheme_mix)
+    amplicons = {scheme: load_amplicons(scheme_paths[scheme]) for scheme in schemes}
+    base_index = np.zeros(256, dtype=np.uint8)
+    base_index[list(BASES)] = np.arange(len(BASES))
+    bases = np.frombuffer(BASES, dtype=np.uint8)
+
+    with gzip.open(fastq_path, "wb", compresslevel=1) as fastq:
+        for batch_start in range(0, num_reads, READ_BATCH_SIZE):
+            batch_size = min(READ_BATCH_SIZE, num_reads - batch_start)
+            read_schemes = rng.choice(len(schemes), size=batch_size, p=list(scheme_mix.values()))
+            reverse = rng.random(batch_size) < reverse_fraction
+            sequences = []
+            for scheme_id, is_reverse in zip(read_schemes, reverse):
+                scheme_amplicons = amplicons[schemes[scheme_id]]
+                amplicon = scheme_amplicons[rng.integers(len(scheme_amplicons))]
+                if is_reverse:
+                    amplicon = reverse_complement(amplicon)
+                sequences.append(amplicon[:read_length])
+
+            read_bases = np.frombuffer("".join(sequences).encode("ascii"), dtype=np.uint8).copy()
+            errors = rng.random(len(read_bases)) < error_rate
+            # a different base: shift the base index by 1 to 3
+            read_bases[errors] = bases[
+                (base_index[read_bases[errors]] + rng.integers(1, len(BASES), size=errors.sum())) % len(BASES)
+            ]
+            read_bases[rng.random(len(read_bases)) < n_rate] = ord("N")
+
+            records = []
+            offset = 0
+            for read_idx, sequence in enumerate(sequences, start=batch_start):
+                end = offset + len(sequence)
+                records.append(
+                    b"@read_%d\n%s\n+\n%s\n" % (read_idx, read_bases[offset:end].tobytes(), b"I" * len(sequence))
+                )
+                offset = end
+            fastq.write(b"".join(records))
+
+
+def run_build_primers_automaton(primer_index: Path, **_) -> tuple[float, float]:
+    start = perf_counter()
+    build_primers_automaton(primer_index)
+    return perf_counter() - start, peak_rss_mb()
+
+
+def run_count_primer_matches(
+    primer_index: Path, sample_fastq: Path, output_path: Path, workers: int, engine: str, **_
+) -> tuple[float, float]:
+    primers_automaton = build_primers_automaton(primer_index)
+    start = perf_counter()
+    count_primer_matches(sample_fastq, primers_automaton, workers=workers, engine=engine)
+    elapsed = perf_counter() - start
+    # the input of select_primer
+    write_primer_coverage(output_path, primers_automaton)
+    return elapsed, peak_rss_mb()
+
+
+def run_select_primer(output_path: Path, **_) -> tuple[float, float]:
+    start = perf_counter()
+    select_primer(output_path, SAMPLE_ID, UNKNOWN)
+    return perf_counter() - start, peak_rss_mb()
+
+
+STAGE_RUNNERS: dict[str, Callable[..., tuple[float, float]]] = {
+    "build_primers_automaton": run_build_primers_automaton,
+    "count_primer_matches": run_count_primer_matches,
+    "select_primer": run_select_primer,
+}
+
+
+def run_stage(stage: str, repeat: int, **stage_args) -> tuple[float, float]:
+    """
+    Run a stage repeat times, each time in a new process
+
+    :return: the best elapsed time in seconds and the largest peak RSS in MB
+    """
+    best_elapsed = float("inf")
+    max_peak_rss = 0.0
+    for _ in range(repeat):
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("fork")) as executor:
+            elapsed, peak_rss = executor.submit(STAGE_RUNNERS[stage], **stage_args).result()
+        best_elapsed = min(best_elapsed, elapsed)
+        max_peak_rss = max(max_peak_rss, peak_rss)
+    return best_elapsed, max_peak_rss
+
+
+def format_change(value: float, baseline_value: Optional[float]) -> str:
+    if not baseline_value:
+        return ""
+    return f"{(value / baseline_value - 1) * 100:+.1f}%"
+
+
+@click.command()
+@click.option("--reads", "num_reads", type=click.IntRange(min=1), default=200000, help="number of reads")
+@click.option("--read-length", type=click.IntRange(min=1), default=150, help="read length")
+@click.option("--error-rate", type=click.FloatRange(0, 1), default=0.001, help="base substitution rate")
+@click.option("--n-rate", type=click.FloatRange(0, 1), default=0.0005, help="rate of N bases")
+@click.option("--reverse-fraction", type=click.FloatRange(0, 1), default=0.5, help="fraction of reverse strand reads")
+@click.option(
+    "--scheme-mix",
+    default="ARTIC_V4-1",
+    show_default=True,
+    help="the primer schemes of the reads and their weights, e.g. ARTIC_V4-1=0.7,Midnight-ONT_V3=0.3",
+)
+@click.option("--seed", type=int, default=0, help="seed of the read generator")
+@click.option("--workers", type=click.IntRange(min=1), default=1, help="count_primer_matches processes")
+@click.option("--engine", type=click.Choice(MATCHING_ENGINES), default=AUTOMATON_ENGINE, help="matching engine")
+@click.option("--repeat", type=click.IntRange(min=1), default=3, help="number of runs per stage")
+@click.option(
+    "--baseline",
+    "baseline_path",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=DEFAULT_BASELINE_PATH,
+    show_default=True,
+    help="the stored results to compare with",
+)
+@click.option("--save-baseline", is_flag=True, default=False, help="store the results to --baseline")
+def main(
+    num_reads: int,
+    read_length: int,
+    error_rate: float,
+    n_rate: float,
+    reverse_fraction: float,
+    scheme_mix: str,
+    seed: int,
+    workers: int,
+    engine: str,
+    repeat: int,
+    baseline_path: Path,
+    save_baseline: bool,
+) -> None:
+    """
+    Print the seconds, the reads/s and the peak RSS of each primer autodetection stage.
+    The reads/s of a stage is the number of sample reads divided by its seconds, even for the stages which do not
+    read the sample, so that the stages compare with each other. The peak RSS includes the interpreter and the
+    imported modules (about 60 MB)
+    """
+    mix = parse_scheme_mix(scheme_mix)
+    # the results are compared with the baseline only for the same synthetic reads
+    reads_config = dict(
+        reads=num_reads,
+        read_length=read_length,
+        error_rate=error_rate,
+        n_rate=n_rate,
+        reverse_fraction=reverse_fraction,
+        scheme_mix=mix,
+        seed=seed,
+    )
+
+    with TemporaryDirectory() as tmp_dir:
+        tmp_path = Path(tmp_dir)
+        primer_index = tmp_path / PRIMER_INDEX_PATH.name
+        primers = write_primer_index(primer_index)
+        unknown_schemes = set(mix) - set(primers)
+        if unknown_schemes:
+            raise click.BadParameter(f"unknown schemes {sorted(unknown_schemes)}", param_hint="--scheme-mix")
+        with open(primer_index, newline="") as index_csv:
+            scheme_paths = {row[PRIMER_NAME]: Path(row[FASTA_PATH]).parent for row in csv.DictReader(index_csv)}
+
+        sample_fastq = tmp_path / f"{SAMPLE_ID}.fastq.gz"
+        start = perf_counter()
+        generate_amplicon_reads(
+            sample_fastq, scheme_paths, mix, num_reads, read_length, error_rate, n_rate, reverse_fraction, seed
+        )
+        click.echo(f"{num_reads:,} reads generated in {perf_counter() - start:.1f}s, best of {repeat} runs")
+
+        output_path = tmp_path / "output"
+        output_path.mkdir()
+        stage_args = dict(
+            primer_index=primer_index,
+            sample_fastq=sample_fastq,
+            output_path=output_path,
+            workers=workers,
+            engine=engine,
+        )
+        results = {}
+        for stage in STAGES:
+            elapsed, peak_rss = run_stage(stage, repeat, **stage_args)
+            results[stage] = dict(seconds=elapsed, reads_per_second=num_reads / elapsed, peak_rss_mb=peak_rss)
+
+    baseline = load_json(baseline_path) if baseline_path.is_file() and not save_baseline else None
+    if baseline is not None and baseline["reads"] != reads_config:
+        click.echo(f"The baseline {baseline_path} was measured on other reads, not comparing: {baseline['reads']}")
+        baseline = None
+    elif baseline is not None:
+        click.echo(f"Compared with {baseline_path} (engine {baseline['engine']}, {baseline['workers']} workers)")
+
+    click.echo(f"{'stage':<26}{'seconds':>10}{'reads/s':>14}{'peak RSS MB':>13}{'vs reads/s':>12}{'vs RSS':>10}")
+    for stage, result in results.items():
+        baseline_result = baseline["stages"].get(stage, {}) if baseline else {}
+        click.echo(
+            f"{stage:<26}{result['seconds']:>10.3f}{result['reads_per_second']:>14,.0f}{result['peak_rss_mb']:>13.1f}"
+            f"{format_change(result['reads_per_second'], baseline_result.get('reads_per_second')):>12}"
+            f"{format_change(result['peak_rss_mb'], baseline_result.get('peak_rss_mb')):>10}"
+        )
+
+    if save_baseline:
+        write_json({"reads": reads_config, "engine": engine, "workers": workers, "stages": results}, baseline_path)
+        click.echo(f"Baseline stored to {baseline_path}")
+
+
+if __name__ == "__main__":
+    # pylint: disable=no-value-for-parameter
+    main()
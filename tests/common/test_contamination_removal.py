@@ -1,5 +1,6 @@
 from pathlib import Path
 import csv
+import shutil
 import pytest
 from click.testing import CliRunner
 
@@ -7,11 +8,19 @@ from app.scripts.contamination_removal import (
     get_read_counts,
     write_rik_output_csv,
     process_rik,
+    process_rik_batch,
     contamination_removal,
+    CONTAMINATION_REMOVAL_HEADERS,
     CONTAMINATION_REMOVAL_SAMPLE_ID_COL,
     CONTAMINATION_REMOVAL_CONTAMINATED_READS_COL,
     CONTAMINATION_REMOVAL_PRESERVED_READS_COL,
 )
+from app.scripts.util.contamination_removal_gate import (
+    is_gated,
+    CONTAMINATION_REMOVAL_GATE_SUFFIX,
+    GATE_NO_READS,
+    GATE_PASSED,
+)
 
 
 def assert_rik_output_csv(output_path: Path, expected_rik_output_csv: dict[str, str]):
@@ -168,3 +177,162 @@ def test_contamination_removal(
     )
     assert rv.exit_code == 0
     assert_rik_output_csv(output_path, expected_rik_output_csv)
+
+
+@pytest.mark.parametrize("manifest", [False, True])
+@pytest.mark.parametrize("threads", [1, 3])
+def test_process_rik_batch(tmp_path: Path, contamination_removal_data_path: Path, manifest: bool, threads: int):
+    counting_path = tmp_path / "counting"
+    counting_path.mkdir()
+    input_files = {"c": "rik_output_one_read.txt", "a": "rik_output_two_reads.txt", "b": "rik_output_one_read.txt"}
+    for sample_id, input_file in input_files.items():
+        shutil.copy(contamination_removal_data_path / input_file, counting_path / f"{sample_id}.txt")
+    input_path = counting_path
+    if manifest:
+        input_path = tmp_path / "manifest.txt"
+        input_path.write_text("".join(f"counting/{sample_id}.txt\n" for sample_id in input_files))
+
+    output_path = tmp_path / "contamination_removal.csv"
+    gate_dir = tmp_path / "gates"
+    gate_dir.mkdir()
+    assert process_rik_batch(input_path, output_path, threads, gate_dir) == len(input_files)
+
+    # the same rows and gates as processing each sample, sorted by sample id
+    expected_rows = []
+    for sample_id in sorted(input_files):
+        sample_output_path = tmp_path / f"{sample_id}_contamination_removal.csv"
+        sample_gate_path = tmp_path / f"{sample_id}{CONTAMINATION_REMOVAL_GATE_SUFFIX}"
+        process_rik(counting_path / f"{sample_id}.txt", sample_output_path, sample_id, sample_gate_path)
+        with open(sample_output_path, newline="") as csvfile:
+            expected_rows.extend(csv.DictReader(csvfile))
+        assert (gate_dir / sample_gate_path.name).read_text() == sample_gate_path.read_text()
+    with open(output_path, newline="") as csvfile:
+        reader = csv.DictReader(csvfile)
+        assert reader.fieldnames == CONTAMINATION_REMOVAL_HEADERS
+        assert list(reader) == expected_rows
+    assert len(list(gate_dir.iterdir())) == len(input_files)
+
+
+def test_process_rik_batch_errors(tmp_path: Path, contamination_removal_data_path: Path):
+    output_path = tmp_path / "contamination_removal.csv"
+    with pytest.raises(FileNotFoundError, match="No read-it-and-keep output file"):
+        process_rik_batch(tmp_path, output_path)
+
+    # the validation of each sample is kept, reporting the sample
+    shutil.copy(contamination_removal_data_path / "rik_output_one_read.txt", tmp_path / "a.txt")
+    shutil.copy(contamination_removal_data_path / "rik_output_two_reads_exception.txt", tmp_path / "b.txt")
+    with pytest.raises(ValueError, match="Sample b .*cannot be negative"):
+        process_rik_batch(tmp_path, output_path, threads=2)
+
+
+def test_contamination_removal_batch(tmp_path: Path, contamination_removal_data_path: Path):
+    shutil.copy(contamination_removal_data_path / "rik_output_two_reads.txt", tmp_path / "b.txt")
+    output_path = tmp_path / "contamination_removal.csv"
+
+    rv = CliRunner().invoke(
+        contamination_removal, ["--input-path", tmp_path / "b.txt", "--output-csv-path", output_path]
+    )
+    assert rv.exit_code != 0
+    assert "--sample-id is required" in rv.output
+
+    rv = CliRunner().invoke(
+        contamination_removal, ["--input-path", tmp_path / "b.txt", "--gate-dir", tmp_path, "--sample-id", "b"]
+    )
+    assert rv.exit_code != 0
+    assert "--gate-dir requires --batch" in rv.output
+
+    gate_dir = tmp_path / "gates"
+    gate_dir.mkdir()
+    rv = CliRunner().invoke(
+        contamination_removal,
+        [
+            "--input-path",
+            tmp_path,
+            "--output-csv-path",
+            output_path,
+            "--batch",
+            "--threads",
+            "2",
+            "--gate-dir",
+            gate_dir,
+        ],
+    )
+    assert rv.exit_code == 0
+    assert (gate_dir / f"b{CONTAMINATION_REMOVAL_GATE_SUFFIX}").read_text() == f"{GATE_PASSED}\n"
+    assert_rik_output_csv(
+        output_path,
+        {
+            CONTAMINATION_REMOVAL_SAMPLE_ID_COL: "b",
+            CONTAMINATION_REMOVAL_CONTAMINATED_READS_COL: "696",
+            CONTAMINATION_REMOVAL_PRESERVED_READS_COL: "278302",
+        },
+    )
+
+
+@pytest.mark.parametrize(
+    "rik_output,expected_gate",
+    [
+        ("Input reads file 1\t75703\nKept reads 1\t75703\n", GATE_PASSED),
+        ("Input reads file 1\t100\nInput reads file 2\t100\nKept reads 1\t0\nKept reads 2\t0\n", GATE_NO_READS),
+    ],
+    ids=["reads kept", "no reads kept"],
+)
+def test_contamination_removal_gate(tmp_path: Path, rik_output: str, expected_gate: str):
+    input_path = tmp_path / "a.txt"
+    input_path.write_text(f"Processed 100 reads (or read pairs)\n{rik_output}")
+    output_path = tmp_path / "a_contamination_removal.csv"
+    gate_path = tmp_path / "a_contamination_removal_gate.txt"
+
+    rv = CliRunner().invoke(
+        contamination_removal,
+        [
+            "--input-path",
+            input_path,
+            "--output-csv-path",
+            output_path,
+            "--sample-id",
+            "a",
+            "--gate-path",
+            gate_path,
+        ],
+    )
+    assert rv.exit_code == 0
+    assert gate_path.read_text() == f"{expected_gate}\n"
+    assert is_gated(gate_path) == (expected_gate == GATE_NO_READS)
+
+    rv = CliRunner().invoke(
+        contamination_removal,
+        ["--input-path", tmp_path, "--output-csv-path", output_path, "--batch", "--gate-path", gate_path],
+    )
+    assert rv.exit_code != 0
+    assert "--gate-path is not supported with --batch" in rv.output
+
+
+@pytest.mark.parametrize(
+    "input_file,expected_gate",
+    [
+        ("rik_output_one_read.txt", GATE_PASSED),
+        ("rik_output_two_reads_exception.txt", None),
+    ],
+)
+def test_contamination_removal_gate_only(
+    tmp_path: Path, contamination_removal_data_path: Path, input_file: str, expected_gate: str
+):
+    # the gate of a sample, without its csv file (written by the batch)
+    gate_path = tmp_path / "a_contamination_removal_gate.txt"
+    rv = CliRunner().invoke(
+        contamination_removal, ["--input-path", contamination_removal_data_path / input_file, "--gate-path", gate_path]
+    )
+
+    if expected_gate is None:
+        # the read counts are validated as for the csv file
+        assert isinstance(rv.exception, ValueError)
+        assert not gate_path.exists()
+    else:
+        assert rv.exit_code == 0
+        assert gate_path.read_text() == f"{expected_gate}\n"
+    assert list(tmp_path.iterdir()) == ([gate_path] if expected_gate else [])
+
+    rv = CliRunner().invoke(contamination_removal, ["--input-path", contamination_removal_data_path / input_file])
+    assert rv.exit_code != 0
+    assert "--output-csv-path or --gate-path is required" in rv.output
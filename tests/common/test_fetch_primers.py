@@ -1,11 +1,22 @@
 from pathlib import Path
+import csv
 import shutil
 import pytest
 from Bio import SeqIO
+from git import Repo
+from Bio.Seq import reverse_complement
 
 from app.scripts.fetch_primers import (
+    create_automaton,
     extract_primer_sequences,
+    hamming_neighbours,
+    load_reference_sequence,
     generate_primer_index_file,
+    generate_primer_index_bundle,
+    build_primer_schemes,
+    prepare_primers,
+    BUILD_MANIFEST_SUFFIX,
+    PRIMER_SEQUENCES,
     ORGANISE_PRIMERS,
     SARS_COV_2,
     EPI2ME_LABS,
@@ -15,8 +26,15 @@ from app.scripts.fetch_primers import (
     PICKLE,
     REFERENCE,
     SCHEME,
+    NAME,
+    BED_COLS,
+    START,
+    END,
 )
+from app.scripts import fetch_primers
 from app.scripts.primer_autodetection import load_pickle
+from app.scripts.util.data_loading import load_json
+from app.scripts.util.primer_index_bundle import load_primer_index_bundle
 from tests.utils_tests import assert_files_are_equal
 
 PATH = "path"
@@ -140,6 +158,79 @@ def test_extract_primer_sequences(
     assert_files_are_equal(scheme_fasta_path, expected_scheme_fasta_path)
 
 
+@pytest.mark.parametrize(
+    "primer,primer_subdir",
+    [
+        ("ARTIC_V4", "ARTIC/V4"),
+        ("Midnight-ONT_V2", "Midnight-ONT/V2"),
+    ],
+    ids=[
+        "strand in bed",
+        "strand in primer name",
+    ],
+)
+def test_extract_primer_sequences_right_primers(
+    tmp_path: Path,
+    primer_data: dict,
+    primer: str,
+    primer_subdir: str,
+):
+    data = primer_data[EPI2ME_LABS]
+    primer_dir = data[PATH] / data[SOURCE_SCHEMES] / primer_subdir
+    ref_fasta_path = primer_dir / data[SOURCE_REFERENCE]
+    scheme_bed_path = primer_dir / data[DEST_SCHEME_BED]
+    scheme_fasta_path = tmp_path / data[DEST_SCHEME_FASTA]
+
+    extract_primer_sequences(ref_fasta_path, scheme_bed_path, scheme_fasta_path, primer, right_primers=True)
+
+    ref_sequence = str(next(SeqIO.parse(ref_fasta_path, FASTA)).seq)
+    with open(scheme_bed_path, newline="") as bedfile:
+        bed_rows = list(csv.DictReader(bedfile, fieldnames=BED_COLS, delimiter="\t"))
+    # the left primers, then the right primers reverse complemented, in the order of the bed file
+    expected_sequences = [
+        (
+            ref_sequence[int(row[START]) : int(row[END])]
+            if "LEFT" in row[NAME]
+            else reverse_complement(ref_sequence[int(row[START]) : int(row[END])])
+        )
+        for row in bed_rows
+    ]
+    records = list(SeqIO.parse(scheme_fasta_path, FASTA))
+    assert [str(record.seq) for record in records] == expected_sequences
+    assert [record.id for record in records] == [f"{primer}_primer_seq_{seq_idx}" for seq_idx in range(len(bed_rows))]
+    # the left primers are the same as without right primers
+    left_sequences = [str(record.seq) for record in SeqIO.parse(primer_dir / data[DEST_SCHEME_FASTA], FASTA)]
+    assert expected_sequences[::2] == left_sequences
+
+
+def test_hamming_neighbours():
+    neighbours = list(hamming_neighbours("ACG"))
+
+    assert len(neighbours) == len(set(neighbours)) == 3 * 3
+    assert all(sum(a != b for a, b in zip(neighbour, "ACG")) == 1 for neighbour in neighbours)
+    assert "ACG" not in neighbours
+
+
+@pytest.mark.parametrize("fuzzy", [False, True])
+def test_create_automaton(tmp_path: Path, fuzzy: bool):
+    fasta_path = tmp_path / f"primers.{FASTA}"
+    # the second primer is a neighbour of the first one
+    fasta_path.write_text(">primer_seq_0\nACGT\n>primer_seq_1\nACGA\n")
+
+    automaton = create_automaton(fasta_path, FASTA, fuzzy)
+
+    # the primer sequences map to themselves, the neighbours to a primer sequence they derive from
+    primers = {"ACGT", "ACGA"}
+    neighbours = {neighbour for sequence in primers for neighbour in hamming_neighbours(sequence)} - primers
+    items = dict(automaton.items())
+    assert set(items) == (primers | neighbours if fuzzy else primers)
+    for sequence, primer_sequence in items.items():
+        if sequence in primers:
+            assert primer_sequence == sequence
+        else:
+            assert primer_sequence in primers and sequence in set(hamming_neighbours(primer_sequence))
+
+
 @pytest.mark.jira(identifier="ee8f4c43-c5d4-4904-8ef3-ef72035b5c5d", confirms="PSG-3621")
 def test_extract_primer_sequences_unknown_strand_error(
     tmp_path: Path,
@@ -232,3 +323,206 @@ def test_organise_primers(
     # assert generated index file is as expected
     generate_primer_index_file(SARS_COV_2, dest_schemes_path, schemes)
     assert_primer_files(dest_schemes_path, data, INDEX)
+
+    # assert the generated bundle holds the primer sequences of all schemes
+    bundle_path = tmp_path / "primer_index.bundle"
+    generate_primer_index_bundle(bundle_path, schemes)
+    bundle = load_primer_index_bundle(bundle_path)
+    scheme_sequences = {
+        scheme: [str(record.seq) for record in SeqIO.parse(schemes[scheme][FASTA], FASTA)] for scheme in schemes
+    }
+    # the same bundle from the primer sequences in memory
+    in_memory_bundle_path = tmp_path / "in_memory_primer_index.bundle"
+    generate_primer_index_bundle(in_memory_bundle_path, schemes, scheme_sequences=scheme_sequences)
+    in_memory_bundle = load_primer_index_bundle(in_memory_bundle_path)
+    assert in_memory_bundle.num_primers == bundle.num_primers
+    assert in_memory_bundle.schemes_per_sequence == bundle.schemes_per_sequence
+    assert bundle.num_primers == {scheme: len(sequences) for scheme, sequences in scheme_sequences.items()}
+    assert bundle.schemes_per_sequence == {
+        sequence: tuple(sorted(scheme for scheme in schemes if sequence in scheme_sequences[scheme]))
+        for sequences in scheme_sequences.values()
+        for sequence in sequences
+    }
+    assert dict(bundle.automaton.items()) == bundle.schemes_per_sequence
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_build_primer_schemes(
+    tmp_path: Path,
+    primer_schemes_dir: str,
+    primer_data: dict,
+    workers: int,
+):
+    data = primer_data[EPI2ME_LABS]
+    dest_schemes_path = tmp_path / primer_schemes_dir
+    source_path = tmp_path / "source"
+
+    def _prepare() -> dict:
+        # copy the input primers, mocking repository cloning
+        shutil.copytree(data[PATH], source_path, dirs_exist_ok=True)
+        return ORGANISE_PRIMERS[SARS_COV_2][EPI2ME_LABS](
+            source_path, data[SOURCE_SCHEMES], dest_schemes_path, build=False
+        )
+
+    def _pickle_mtimes() -> dict:
+        return {scheme: schemes[scheme][PICKLE].stat().st_mtime_ns for scheme in schemes}
+
+    schemes = _prepare()
+    scheme_sequences = build_primer_schemes(SARS_COV_2, dest_schemes_path, schemes, workers=workers)
+
+    # the scheme files and the index are the same as built sequentially
+    assert_primer_files(dest_schemes_path, data, DEST_SCHEME_FASTA)
+    assert_primer_files(dest_schemes_path, data, DEST_SCHEME_PICKLE)
+    num_primers = {scheme: len(sequences) for scheme, sequences in scheme_sequences.items()}
+    generate_primer_index_file(SARS_COV_2, dest_schemes_path, schemes, num_primers)
+    assert_primer_files(dest_schemes_path, data, INDEX)
+    # the primer sequences are the same as in the scheme fasta files
+    assert scheme_sequences == {
+        scheme: [str(record.seq) for record in SeqIO.parse(schemes[scheme][FASTA], FASTA)] for scheme in schemes
+    }
+    manifest = load_json(dest_schemes_path / f"{SARS_COV_2}{BUILD_MANIFEST_SUFFIX}")
+    assert {scheme: entry[PRIMER_SEQUENCES] for scheme, entry in manifest["schemes"].items()} == scheme_sequences
+
+    # nothing changed: no scheme is built again
+    mtimes = _pickle_mtimes()
+    schemes = _prepare()
+    assert build_primer_schemes(SARS_COV_2, dest_schemes_path, schemes, workers=workers) == scheme_sequences
+    assert _pickle_mtimes() == mtimes
+
+    # one primer removed from a scheme bed: only this scheme is built again
+    changed_scheme = "ARTIC_V4"
+    source_bed = source_path / data[SOURCE_SCHEMES] / "ARTIC" / "V4" / DEST_SCHEME_BED_FILENAME
+    source_bed.write_text("".join(source_bed.read_text().splitlines(keepends=True)[:-1]))
+    schemes = ORGANISE_PRIMERS[SARS_COV_2][EPI2ME_LABS](
+        source_path, data[SOURCE_SCHEMES], dest_schemes_path, build=False
+    )
+    rebuilt_scheme_sequences = build_primer_schemes(SARS_COV_2, dest_schemes_path, schemes, workers=workers)
+    rebuilt_mtimes = _pickle_mtimes()
+    assert {scheme for scheme in schemes if rebuilt_mtimes[scheme] != mtimes[scheme]} == {changed_scheme}
+    assert rebuilt_scheme_sequences[changed_scheme] == [
+        str(record.seq) for record in SeqIO.parse(schemes[changed_scheme][FASTA], FASTA)
+    ]
+
+    # a scheme removed upstream: its files are removed
+    removed_scheme_dir = schemes[changed_scheme][FASTA].parent
+    del schemes[changed_scheme]
+    assert set(build_primer_schemes(SARS_COV_2, dest_schemes_path, schemes, workers=workers)) == set(schemes)
+    assert not removed_scheme_dir.exists()
+
+
+def test_build_primer_schemes_hashes_once(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, primer_schemes_dir: str, primer_data: dict
+):
+    data = primer_data[EPI2ME_LABS]
+    dest_schemes_path = tmp_path / primer_schemes_dir
+    schemes = ORGANISE_PRIMERS[SARS_COV_2][EPI2ME_LABS](
+        data[PATH], data[SOURCE_SCHEMES], dest_schemes_path, build=False
+    )
+    monkeypatch.setattr(fetch_primers, "_REFERENCE_SEQUENCES", {})
+    hashed = []
+    fingerprint = fetch_primers.file_fingerprint
+
+    def _fingerprint(file_path: Path) -> str:
+        hashed.append(Path(file_path))
+        return fingerprint(file_path)
+
+    monkeypatch.setattr(fetch_primers, "file_fingerprint", _fingerprint)
+    build_primer_schemes(SARS_COV_2, dest_schemes_path, schemes)
+
+    # the reference and bed files are hashed once, for the build manifest
+    assert sorted(hashed) == sorted(
+        scheme_files[file_type] for scheme_files in schemes.values() for file_type in (REFERENCE, BED)
+    )
+
+
+def test_prepare_primers_cache(
+    tmp_path: Path,
+    primer_schemes_dir: str,
+    primer_data: dict,
+):
+    data = primer_data[QUICK_LAB]
+    cache_dir = tmp_path / "cache"
+    # a local repository standing for the remote one
+    repo_path = tmp_path / "repo"
+    shutil.copytree(data[PATH], repo_path)
+    repo = Repo.init(repo_path)
+    with repo.config_writer() as config:
+        config.set_value("user", "name", "test")
+        config.set_value("user", "email", "test@example.com")
+    repo.git.add(all=True)
+    repo.git.commit(message="primers")
+    commit = repo.head.commit.hexsha
+
+    with pytest.raises(FileNotFoundError, match="not found in cache"):
+        prepare_primers(
+            QUICK_LAB,
+            str(repo_path),
+            commit,
+            SARS_COV_2,
+            data[SOURCE_SCHEMES],
+            tmp_path,
+            cache_dir=cache_dir,
+            offline=True,
+        )
+
+    # cloned and cached, then organised
+    cloned_path = tmp_path / "cloned"
+    prepare_primers(
+        QUICK_LAB, str(repo_path), commit, SARS_COV_2, data[SOURCE_SCHEMES], cloned_path, cache_dir=cache_dir
+    )
+    assert len(list(cache_dir.iterdir())) == 1
+
+    # the repository is not available anymore: taken from the cache, organised as cloned
+    shutil.rmtree(repo_path)
+    dest_schemes_path = tmp_path / primer_schemes_dir
+    schemes = prepare_primers(
+        QUICK_LAB,
+        str(repo_path),
+        commit,
+        SARS_COV_2,
+        data[SOURCE_SCHEMES],
+        dest_schemes_path,
+        cache_dir=cache_dir,
+        offline=True,
+    )
+    assert_primer_files(dest_schemes_path, data, DEST_SCHEME_FASTA)
+    assert_primer_files(dest_schemes_path, data, DEST_SCHEME_BED)
+    assert_primer_files(dest_schemes_path, data, DEST_SCHEME_PICKLE)
+    for scheme in schemes:
+        for file_type in (BED, FASTA):
+            cloned_file = cloned_path / schemes[scheme][file_type].relative_to(dest_schemes_path)
+            assert schemes[scheme][file_type].read_bytes() == cloned_file.read_bytes()
+        cloned_pickle = cloned_path / schemes[scheme][PICKLE].relative_to(dest_schemes_path)
+        assert_pickle_files_are_equal(schemes[scheme][PICKLE], cloned_pickle)
+
+
+def test_load_reference_sequence(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(fetch_primers, "_REFERENCE_SEQUENCES", {})
+    monkeypatch.setattr(fetch_primers, "REFERENCE_CACHE_SIZE", 2)
+    parsed = []
+    parse = SeqIO.parse
+
+    def _parse(*args, **kwargs):
+        parsed.append(args[0])
+        return parse(*args, **kwargs)
+
+    monkeypatch.setattr(fetch_primers.SeqIO, "parse", _parse)
+    references = {}
+    for name, sequence in [("ref_1", "ACGTACGT"), ("ref_1_copy", "ACGTACGT"), ("ref_2", "TTGCA"), ("ref_3", "GGCC")]:
+        references[name] = tmp_path / f"{name}.{FASTA}"
+        references[name].write_text(f">MN908947.3\n{sequence}\n")
+
+    # the copy of a reference is not parsed again
+    assert load_reference_sequence(references["ref_1"]) == "ACGTACGT"
+    assert load_reference_sequence(references["ref_1_copy"]) == "ACGTACGT"
+    assert load_reference_sequence(references["ref_2"]) == "TTGCA"
+    assert parsed == [references["ref_1"], references["ref_2"]]
+    # beyond the cache size, the reference parsed first is evicted
+    assert load_reference_sequence(references["ref_3"]) == "GGCC"
+    assert load_reference_sequence(references["ref_1"]) == "ACGTACGT"
+    assert parsed == [references["ref_1"], references["ref_2"], references["ref_3"], references["ref_1"]]
+
+    empty_reference = tmp_path / f"empty.{FASTA}"
+    empty_reference.write_text("")
+    with pytest.raises(ValueError, match="No reference sequence"):
+        load_reference_sequence(empty_reference)
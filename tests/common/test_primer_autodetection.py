@@ -1,36 +1,74 @@
 from pathlib import Path
+from collections import Counter
+from typing import Optional
 import shutil
+import sys
 import csv
+import gzip
+import numpy as np
+import pandas as pd
 import pytest
+from Bio import SeqIO
+from Bio.Seq import reverse_complement
 
 from click.testing import CliRunner
 
 from app.scripts.fetch_primers import (
     create_automaton,
+    extract_primer_sequences,
+    generate_primer_index_bundle,
 )
 
+import app.scripts.primer_autodetection as primer_autodetection_module
 from app.scripts.primer_autodetection import (
     load_pickle,
     build_primers_automaton,
+    build_unified_automaton,
+    copy_primers_automaton,
     count_primer_matches,
     compute_primer_data,
+    match_read_prefix,
     generate_metrics,
+    load_primer_index,
+    new_primer_data,
+    primer_coverage_cols,
+    score_primers,
     select_primer,
     write_primer_data,
     write_selected_primer,
     generate_primer_autodetection_output_files,
     primer_autodetection,
     PrimerAutomaton,
+    PrimerHits,
+    PrimerMatchStats,
+    StoppingRule,
+    NO_MATCH,
     PRIMER_AUTODETECTION_PRIMER_SCORE_COL,
     COVERAGE_SUFFIX,
     PRIMER_DETECTION_SUFFIX,
     PRIMER_DATA_SUFFIX,
+    PRIMER_STATS_SUFFIX,
+    PRIMER_TIMINGS_SUFFIX,
+    READ_LENGTH_HISTOGRAM_SUFFIX,
+    READ_STATS_SUFFIX,
     UNKNOWN,
+    AUTOMATON_ENGINE,
+    MATCHING_ENGINES,
+    PACKED_ENGINE,
 )
+from app.scripts.build_primer_index_bundle import build_primer_index_bundle
+from app.scripts.util.contamination_removal_gate import GATE_NO_READS, GATE_PASSED
+from app.scripts.util.data_loading import load_json
+from app.scripts.util.fastq import iter_fastq_sequences_in_blocks, sample_bgzf_blocks
+from app.scripts.util.primer_index_bundle import BUNDLE_SUFFIX
+from app.scripts.util.read_stats import ReadStats
 from app.scripts.fetch_primers import (
     SARS_COV_2,
     SCHEME,
     PICKLE,
+    BED,
+    FASTA,
+    REFERENCE,
 )
 from app.scripts.primer_cols import (
     PRIMER_INDEX_COLS,
@@ -43,8 +81,19 @@ from app.scripts.primer_cols import (
     PRIMER_AUTODETECTION_NUMREADS_COL,
     PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL,
     PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL,
+    PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL,
+    READ_STATS_SAMPLE_ID_COL,
+    READ_STATS_NUMREADS_COL,
+    READ_STATS_TOTAL_BASES_COL,
+    READ_STATS_MIN_LENGTH_COL,
+    READ_STATS_MEAN_LENGTH_COL,
+    READ_STATS_MAX_LENGTH_COL,
+    READ_STATS_GC_FRACTION_COL,
+    READ_STATS_N_RATE_COL,
+    READ_LENGTH_COL,
+    READ_LENGTH_NUMREADS_COL,
 )
-from tests.utils_tests import assert_csvs_are_equal, assert_files_are_equal
+from tests.utils_tests import BgzfWriter, assert_csvs_are_equal, assert_files_are_equal
 
 DEFAULT_PRIMER = "ARTIC_V4-1"
 PRIMER_TEST = "primer_test"
@@ -69,6 +118,27 @@ def prefix_path_to_index(input_path: Path, output_path: Path, path_prefix: Path)
     return primers
 
 
+def write_fastq_reads(fastq_path: Path, reads: list[str]):
+    with open(fastq_path, "w") as fastq:
+        for read_idx, read in enumerate(reads):
+            fastq.write(f"@read_{read_idx}\n{read}\n+\n{'I' * len(read)}\n")
+
+
+def decompress_fastq(gzip_fastq: Path, output_path: Path) -> Path:
+    with gzip.open(gzip_fastq, "rb") as fin:
+        output_path.write_bytes(fin.read())
+    return output_path
+
+
+def build_bundle(primer_index: Path, path_prefix: Path, bundle_path: Path) -> Path:
+    rv = CliRunner().invoke(
+        build_primer_index_bundle,
+        ["--primer-index", primer_index, "--path-prefix", path_prefix, "--output-bundle", bundle_path],
+    )
+    assert rv.exit_code == 0
+    return bundle_path
+
+
 def assert_primer_coverage(primer: str, tmp_path: Path, input_path: Path):
     output_file = f"{primer}{COVERAGE_SUFFIX}"
     output_path = tmp_path / output_file
@@ -178,6 +248,70 @@ def test_build_primers_automaton(
     assert_primer_automaton(primers_automaton, primers_automaton_fixture)
 
 
+def test_build_unified_automaton(primers_automaton_fixture: dict[str, PrimerAutomaton]):
+    unified_automaton = build_unified_automaton(primers_automaton_fixture)
+
+    expected_items = {}
+    for primer, primer_auto in primers_automaton_fixture.items():
+        for sequence in primer_auto.automaton.keys():
+            expected_items.setdefault(sequence, []).append(primer)
+
+    assert dict(unified_automaton.automaton.items()) == {k: tuple(v) for k, v in expected_items.items()}
+    # integer ids of the primer sequences and schemes
+    assert unified_automaton.primer_sequences == sorted(expected_items)
+    assert unified_automaton.scheme_names == sorted(primers_automaton_fixture)
+    for sequence, primers in expected_items.items():
+        primer_id = unified_automaton.primer_ids[sequence]
+        assert unified_automaton.primer_sequences[primer_id] == sequence
+        assert [
+            unified_automaton.scheme_names[scheme_id]
+            for scheme_id in np.flatnonzero(unified_automaton.primer_schemes[primer_id])
+        ] == sorted(primers)
+
+
+def test_primer_hits_merge(primers_automaton_fixture: dict[str, PrimerAutomaton]):
+    unified_automaton = build_unified_automaton(primers_automaton_fixture)
+    first_hits = PrimerHits.empty(unified_automaton)
+    first_hits.found_primers[[0, 1]] = True
+    first_hits.numreads[0] = 2
+    first_hits.reads = 3
+    second_hits = PrimerHits.empty(unified_automaton)
+    second_hits.found_primers[[1, 2]] = True
+    second_hits.numreads[[0, 1]] = 1
+    second_hits.ambiguous_numreads[1] = 1
+    second_hits.reads = 2
+
+    merged_hits = first_hits.merge(second_hits)
+
+    assert merged_hits is first_hits
+    assert np.flatnonzero(merged_hits.found_primers).tolist() == [0, 1, 2]
+    assert merged_hits.numreads.tolist() == [3, 1]
+    assert merged_hits.ambiguous_numreads.tolist() == [0, 1]
+    assert merged_hits.reads == 5
+
+
+def test_count_primer_matches_shared_primer(primer_autodetection_sample_dir_data_path: Path):
+    # the same primer sequence in two schemes is credited to both schemes
+    primer_fasta = primer_autodetection_sample_dir_data_path / "sample_counting_primers.fasta"
+    primers_automaton = {
+        primer: PrimerAutomaton(
+            data={
+                PRIMER_AUTODETECTION_NUMREADS_COL: 0,
+                PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL: 0,
+                PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL: 0,
+            },
+            automaton=create_automaton(primer_fasta),
+        )
+        for primer in [PRIMER_TEST, f"{PRIMER_TEST}_copy"]
+    }
+    unique_hits = count_primer_matches(
+        primer_autodetection_sample_dir_data_path / "sample_counting.fastq.gz", primers_automaton
+    )
+
+    assert unique_hits == {PRIMER_TEST: {"AAGA"}, f"{PRIMER_TEST}_copy": {"AAGA"}}
+    assert primers_automaton[PRIMER_TEST].data == primers_automaton[f"{PRIMER_TEST}_copy"].data
+
+
 @pytest.mark.parametrize(
     "sample,fasta,expected_unique_hits,expected_data",
     [
@@ -193,6 +327,7 @@ def test_build_primers_automaton(
         )
     ],
 )
+@pytest.mark.parametrize("engine", MATCHING_ENGINES)
 @pytest.mark.jira(identifier="5d595f04-ef60-4c98-ae45-14000dbb4143", confirms="PSG-3621")
 def test_count_primer_matches(
     primer_autodetection_sample_dir_data_path: Path,
@@ -200,6 +335,7 @@ def test_count_primer_matches(
     fasta: str,
     expected_unique_hits: dict[str, set],
     expected_data: dict[str, int],
+    engine: str,
 ):
     # build a simplified primer_automaton obj for this test
     primers_automaton = {
@@ -212,12 +348,418 @@ def test_count_primer_matches(
             automaton=create_automaton(primer_autodetection_sample_dir_data_path / fasta),
         ),
     }
-    unique_hits = count_primer_matches(primer_autodetection_sample_dir_data_path / sample, primers_automaton)
+    unique_hits = count_primer_matches(
+        primer_autodetection_sample_dir_data_path / sample, primers_automaton, engine=engine
+    )
 
     assert unique_hits == expected_unique_hits
     assert primers_automaton[PRIMER_TEST].data == expected_data
 
 
+@pytest.mark.parametrize("right_primers", [False, True])
+@pytest.mark.parametrize("engine", MATCHING_ENGINES)
+def test_count_primer_matches_right_primers(
+    tmp_path: Path,
+    fetch_primers_data_path: Path,
+    right_primers: bool,
+    engine: str,
+):
+    schemes_path = fetch_primers_data_path / "epi2me-labs" / "data" / "primer_schemes" / SARS_COV_2
+    primers_automaton = {}
+    for primer, primer_subdir in [("ARTIC_V4", "ARTIC/V4"), ("Midnight-ONT_V2", "Midnight-ONT/V2")]:
+        scheme_fasta_path = tmp_path / f"{primer}.{FASTA}"
+        extract_primer_sequences(
+            schemes_path / primer_subdir / f"{SARS_COV_2}.{REFERENCE}.{FASTA}",
+            schemes_path / primer_subdir / f"{SARS_COV_2}.{SCHEME}.{BED}",
+            scheme_fasta_path,
+            primer,
+            right_primers=right_primers,
+        )
+        primers_automaton[primer] = PrimerAutomaton(
+            data=new_primer_data(primer, 0), automaton=create_automaton(scheme_fasta_path)
+        )
+
+    # the ARTIC V4 amplicons, read from both strands
+    ref_sequence = str(next(SeqIO.parse(schemes_path / "ARTIC/V4" / f"{SARS_COV_2}.{REFERENCE}.{FASTA}", FASTA)).seq)
+    amplicons = [ref_sequence[start:end] for start, end in [(25, 431), (324, 727), (644, 1044), (944, 1362)]]
+    sample_fastq = tmp_path / "sample.fastq"
+    write_fastq_reads(sample_fastq, amplicons + [reverse_complement(amplicon) for amplicon in amplicons])
+
+    unique_hits = count_primer_matches(sample_fastq, primers_automaton, engine=engine)
+
+    # the reverse reads start with the reverse complemented right primers
+    assert primers_automaton["ARTIC_V4"].data[PRIMER_AUTODETECTION_NUMREADS_COL] == (8 if right_primers else 4)
+    assert len(unique_hits["ARTIC_V4"]) == (8 if right_primers else 4)
+    assert primers_automaton["Midnight-ONT_V2"].data[PRIMER_AUTODETECTION_NUMREADS_COL] == 0
+
+
+def substitute_bases(sequence: str, positions: list[int]) -> str:
+    substitutes = {"A": "C", "C": "G", "G": "T", "T": "A"}
+    return "".join(substitutes[base] if position in positions else base for position, base in enumerate(sequence))
+
+
+@pytest.mark.parametrize("fuzzy_primers", [False, True])
+@pytest.mark.parametrize("index_format", ["csv", "bundle"])
+@pytest.mark.parametrize("engine", MATCHING_ENGINES)
+def test_count_primer_matches_fuzzy_primers(
+    tmp_path: Path,
+    fetch_primers_data_path: Path,
+    fuzzy_primers: bool,
+    index_format: str,
+    engine: str,
+):
+    schemes_path = fetch_primers_data_path / "epi2me-labs" / "data" / "primer_schemes" / SARS_COV_2
+    primers_automaton = {}
+    schemes = {}
+    for primer, primer_subdir in [("ARTIC_V4", "ARTIC/V4"), ("Midnight-ONT_V2", "Midnight-ONT/V2")]:
+        schemes[primer] = {FASTA: schemes_path / primer_subdir / f"{SARS_COV_2}.{SCHEME}.{FASTA}"}
+        primers_automaton[primer] = PrimerAutomaton(
+            data=new_primer_data(primer, 4), automaton=create_automaton(schemes[primer][FASTA], fuzzy=fuzzy_primers)
+        )
+    unified_automaton = None
+    if index_format == "bundle":
+        bundle_path = tmp_path / f"primer_index{BUNDLE_SUFFIX}"
+        generate_primer_index_bundle(bundle_path, schemes, fuzzy_primers)
+        loaded_index = load_primer_index(bundle_path)
+        primers_automaton, unified_automaton = loaded_index.primers_automaton, loaded_index.unified_automaton
+
+    # the ARTIC V4 amplicons: exact, with one mismatch in the primer, with two mismatches in the primer
+    ref_sequence = str(next(SeqIO.parse(schemes_path / "ARTIC/V4" / f"{SARS_COV_2}.{REFERENCE}.{FASTA}", FASTA)).seq)
+    amplicons = [ref_sequence[start:end] for start, end in [(25, 431), (324, 727), (644, 1044), (944, 1362)]]
+    reads = (
+        amplicons
+        + [substitute_bases(amplicon, [3]) for amplicon in amplicons]
+        + [substitute_bases(amplicon, [3, 7]) for amplicon in amplicons]
+    )
+    sample_fastq = tmp_path / "sample.fastq"
+    write_fastq_reads(sample_fastq, reads)
+
+    unique_hits = count_primer_matches(sample_fastq, primers_automaton, unified_automaton, engine=engine)
+
+    # the one-mismatch reads are counted separately, only if the index holds the fuzzy sequences
+    artic_data = primers_automaton["ARTIC_V4"].data
+    assert artic_data[PRIMER_AUTODETECTION_NUMREADS_COL] == 4
+    assert artic_data[PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL] == 4
+    assert unique_hits["ARTIC_V4"] == {str(record.seq) for record in SeqIO.parse(schemes["ARTIC_V4"][FASTA], FASTA)}
+    midnight_data = primers_automaton["Midnight-ONT_V2"].data
+    if fuzzy_primers:
+        assert artic_data[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL] == 4
+        assert midnight_data[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL] == 0
+    else:
+        assert PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL not in artic_data
+        assert PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL not in midnight_data
+    assert midnight_data[PRIMER_AUTODETECTION_NUMREADS_COL] == 0
+
+
+@pytest.mark.parametrize("index_format", ["csv", "bundle"])
+@pytest.mark.parametrize("engine", MATCHING_ENGINES)
+def test_count_primer_matches_fuzzy_primers_one_base_apart(tmp_path: Path, index_format: str, engine: str):
+    # the primers of the two schemes differ by their last base
+    schemes = {}
+    primers_automaton = {}
+    for primer, sequence in [("A_V1", "ACGTACGTAC"), ("B_V1", "ACGTACGTAA")]:
+        fasta_path = tmp_path / f"{primer}.{FASTA}"
+        fasta_path.write_text(f">{primer}_1_LEFT\n{sequence}\n")
+        schemes[primer] = {FASTA: fasta_path}
+        primers_automaton[primer] = PrimerAutomaton(
+            data=new_primer_data(primer, 1), automaton=create_automaton(fasta_path, fuzzy=True)
+        )
+    unified_automaton = build_unified_automaton(primers_automaton)
+    if index_format == "bundle":
+        bundle_path = tmp_path / f"primer_index{BUNDLE_SUFFIX}"
+        generate_primer_index_bundle(bundle_path, schemes, fuzzy_primers=True)
+        loaded_index = load_primer_index(bundle_path)
+        primers_automaton, unified_automaton = loaded_index.primers_automaton, loaded_index.unified_automaton
+    # the neighbours equal to the primer of the other scheme are not fuzzy sequences
+    assert "ACGTACGTAA" not in unified_automaton.fuzzy_schemes_per_sequence
+    assert "ACGTACGTAC" not in unified_automaton.fuzzy_schemes_per_sequence
+
+    # 3 exact B reads, 1 read one base away from both primers, 1 read one base away from the A primer only
+    reads = ["ACGTACGTAAGG"] * 3 + ["ACGTACGTATGG", "ACGTACGTCCGG"]
+    sample_fastq = tmp_path / "sample.fastq"
+    write_fastq_reads(sample_fastq, reads)
+
+    count_primer_matches(sample_fastq, primers_automaton, unified_automaton, engine=engine)
+
+    # the exact B reads are not fuzzy hits of A
+    a_data, b_data = primers_automaton["A_V1"].data, primers_automaton["B_V1"].data
+    assert (a_data[PRIMER_AUTODETECTION_NUMREADS_COL], a_data[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL]) == (0, 2)
+    assert (b_data[PRIMER_AUTODETECTION_NUMREADS_COL], b_data[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL]) == (3, 1)
+    primer_detection_df = pd.DataFrame(
+        [primer_auto.data for primer_auto in primers_automaton.values()],
+        columns=primer_coverage_cols(primers_automaton),
+    )
+    _, selected_primer = score_primers(primer_detection_df, UNKNOWN)
+    assert selected_primer == "B_V1"
+
+
+@pytest.mark.parametrize(
+    "numreads,fuzzy_numreads,expected_primer",
+    [
+        # the one-mismatch reads are not scored: the latest version is selected among the highest scores
+        ([5, 5], [0, 3], "ARTIC_V4"),
+        ([5, 5], [3, 3], "ARTIC_V4"),
+        ([5, 4], [0, 50], "ARTIC_V4"),
+        ([4, 5], [50, 0], "ARTIC_V3"),
+    ],
+)
+def test_score_primers_fuzzy_numreads(numreads: list[int], fuzzy_numreads: list[int], expected_primer: str):
+    # sorted by primer name (descending), as by select_primer
+    primer_detection_df = pd.DataFrame(
+        [
+            {
+                PRIMER_AUTODETECTION_PRIMER_COL: primer,
+                TOTAL_NUM_PRIMER: 4,
+                PRIMER_AUTODETECTION_NUMREADS_COL: primer_numreads,
+                PRIMER_AUTODETECTION_UNIQUE_NUMREADS_COL: 2,
+                PRIMER_AUTODETECTION_AMBIGUOUS_NUMREADS_COL: 0,
+                PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL: primer_fuzzy_numreads,
+            }
+            for primer, primer_numreads, primer_fuzzy_numreads in zip(
+                ["ARTIC_V4", "ARTIC_V3"], numreads, fuzzy_numreads
+            )
+        ]
+    )
+
+    detected_primer_df, selected_primer = score_primers(primer_detection_df, UNKNOWN)
+
+    assert selected_primer == expected_primer
+    assert detected_primer_df[PRIMER_AUTODETECTION_PRIMER_COL] == expected_primer
+
+
+@pytest.mark.parametrize(
+    "read_prefix,expected_found_primers,expected_found_schemes,expected_ambiguous_schemes",
+    [
+        ("AACAAACCAACCAACTTTCGATCTC", {"AACAAACCAACCAACTTTCGATCTC"}, ("ARTIC_V4",), ()),
+        ("AACAAACCAACCAACTTTCGATCTN", set(), (), ("ARTIC_V4",)),
+        ("GGGGGGGGGGGGGGGGGGGGGGGGG", set(), (), ()),
+    ],
+)
+def test_match_read_prefix(
+    primers_automaton_fixture: dict[str, PrimerAutomaton],
+    read_prefix: str,
+    expected_found_primers: set[str],
+    expected_found_schemes: tuple,
+    expected_ambiguous_schemes: tuple,
+):
+    automaton = build_unified_automaton(primers_automaton_fixture).automaton
+    prefix_match = match_read_prefix(automaton, read_prefix)
+
+    assert prefix_match.found_primers == expected_found_primers
+    assert prefix_match.found_schemes == expected_found_schemes
+    assert prefix_match.ambiguous_schemes == expected_ambiguous_schemes
+    if not (expected_found_schemes or expected_ambiguous_schemes):
+        assert prefix_match is NO_MATCH
+
+
+@pytest.mark.parametrize("prefix_cache_size", [0, 1024])
+def test_count_primer_matches_prefix_cache(
+    primer_autodetection_sample_dir_data_path: Path,
+    primers_automaton_fixture: dict[str, PrimerAutomaton],
+    prefix_cache_size: int,
+):
+    sample_fastq = primer_autodetection_sample_dir_data_path / "9729bce7-f0a9-4617-b6e0-6145307741d1.fastq.gz"
+    match_stats = PrimerMatchStats()
+    unique_hits = count_primer_matches(
+        sample_fastq, primers_automaton_fixture, match_stats=match_stats, prefix_cache_size=prefix_cache_size
+    )
+
+    # caching does not affect the results
+    assert {p: len(hits) for p, hits in unique_hits.items()} == {"ARTIC_V4": 2, "Midnight-ONT_V2": 0}
+    assert primers_automaton_fixture["ARTIC_V4"].data[PRIMER_AUTODETECTION_NUMREADS_COL] == 3
+    assert match_stats.reads == match_stats.prefix_cache_hits + match_stats.prefix_cache_misses
+    if prefix_cache_size:
+        assert match_stats.prefix_cache_hits > 0
+        assert match_stats.prefix_cache_hit_rate == match_stats.prefix_cache_hits / match_stats.reads
+    else:
+        assert match_stats.prefix_cache_hits == 0
+        assert match_stats.prefix_cache_hit_rate == 0
+
+
+@pytest.mark.parametrize(
+    "numreads,reads,expected_decided",
+    [
+        # clear winner
+        ([100, 10, 0], 200, True),
+        # lead not significant
+        ([100, 90, 0], 200, False),
+        # no primer found yet
+        ([0, 0, 0], 100, False),
+        # no primer found after enough reads
+        ([0, 0, 0], 1000, True),
+    ],
+)
+def test_stopping_rule_is_decided(numreads: list[int], reads: int, expected_decided: bool):
+    stopping_rule = StoppingRule(confidence=0.99)
+    assert stopping_rule.is_decided(numreads, reads) == expected_decided
+    # without confidence, the scan is never decided
+    assert not StoppingRule(max_reads=10).is_decided(numreads, reads)
+
+
+def simulate_stopping_rule(
+    stopping_rule: StoppingRule, hit_rates: list[float], looks: int, seed: int
+) -> tuple[int, Optional[int]]:
+    """
+    Evaluate the stopping rule every check_interval reads of a simulated sample, in which each read matches each
+    scheme with the given probability.
+    Return the number of the evaluation at which the scan stops (0 if it does not) and the leading scheme then
+    """
+    rng = np.random.default_rng(seed)
+    numreads = np.cumsum(rng.binomial(stopping_rule.check_interval, hit_rates, size=(looks, len(hit_rates))), axis=0)
+    for look, look_numreads in enumerate(numreads, start=1):
+        if stopping_rule.is_decided(look_numreads.tolist(), look * stopping_rule.check_interval):
+            return look, int(look_numreads.argmax())
+    return 0, None
+
+
+def test_stopping_rule_repeated_evaluations():
+    stopping_rule = StoppingRule(confidence=0.95, check_interval=100)
+
+    # a realistic lead (30% vs 25% of the reads): the scan stops on the right scheme, mostly after several evaluations
+    stops = [simulate_stopping_rule(stopping_rule, [0.3, 0.25, 0.01], 200, seed) for seed in range(20)]
+    assert all(look > 0 and leader == 0 for look, leader in stops)
+    assert sorted(look for look, _ in stops)[len(stops) // 2] > 1
+
+    # schemes with the same hit rate: the scan stops on a leader at most 1 - confidence of the time,
+    # however many evaluations
+    false_stops = sum(simulate_stopping_rule(stopping_rule, [0.3, 0.3], 200, seed)[0] > 0 for seed in range(200))
+    assert false_stops <= 200 * (1 - stopping_rule.confidence)
+
+
+@pytest.mark.parametrize(
+    "stopping_rule,expected_reads,expected_stopped_early",
+    [
+        (None, 7, False),
+        (StoppingRule(max_reads=3), 3, True),
+        (StoppingRule(max_reads=7), 7, False),
+        (StoppingRule(max_reads=100), 7, False),
+        # 2 ARTIC_V4 reads out of the first 3 reads are a significant lead at the first evaluation
+        (StoppingRule(confidence=0.8, check_interval=3), 3, True),
+        # the leads of the first reads are not significant once the evaluations are accounted for
+        (StoppingRule(confidence=0.9, check_interval=2), 7, False),
+    ],
+)
+def test_count_primer_matches_stopping_rule(
+    primer_autodetection_sample_dir_data_path: Path,
+    primers_automaton_fixture: dict[str, PrimerAutomaton],
+    stopping_rule: StoppingRule,
+    expected_reads: int,
+    expected_stopped_early: bool,
+):
+    sample_fastq = primer_autodetection_sample_dir_data_path / "9729bce7-f0a9-4617-b6e0-6145307741d1.fastq.gz"
+    match_stats = PrimerMatchStats()
+    count_primer_matches(sample_fastq, primers_automaton_fixture, match_stats=match_stats, stopping_rule=stopping_rule)
+
+    assert match_stats.reads == expected_reads
+    assert match_stats.stopped_early == expected_stopped_early
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+@pytest.mark.parametrize("stopping_rule", [None, StoppingRule(max_reads=5)], ids=["all reads", "max reads"])
+@pytest.mark.parametrize("engine", MATCHING_ENGINES)
+def test_count_primer_matches_workers(
+    monkeypatch,
+    tmp_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primers_automaton_fixture: dict[str, PrimerAutomaton],
+    compressed: bool,
+    stopping_rule: StoppingRule,
+    engine: str,
+):
+    parallel_scans = []
+    scan_sample_fastq_parallel = primer_autodetection_module._scan_sample_fastq_parallel
+
+    def _spy_scan_sample_fastq_parallel(*args, **kwargs):
+        parallel_scans.append(args[0])
+        return scan_sample_fastq_parallel(*args, **kwargs)
+
+    monkeypatch.setattr(primer_autodetection_module, "_scan_sample_fastq_parallel", _spy_scan_sample_fastq_parallel)
+    # small chunks, so that the reads of a gzipped fastq are spread across the workers
+    monkeypatch.setattr(primer_autodetection_module, "PARALLEL_CHUNK_SIZE", 4096)
+    sample_fastq = primer_autodetection_sample_dir_data_path / "9729bce7-f0a9-4617-b6e0-6145307741d1.fastq.gz"
+    if not compressed:
+        sample_fastq = decompress_fastq(sample_fastq, tmp_path / "sample.fastq")
+
+    serial_primers_automaton = {
+        primer: PrimerAutomaton(data=dict(primer_auto.data), automaton=primer_auto.automaton)
+        for primer, primer_auto in primers_automaton_fixture.items()
+    }
+    # reference: the automaton engine in the current process
+    serial_match_stats = PrimerMatchStats()
+    serial_unique_hits = count_primer_matches(
+        sample_fastq, serial_primers_automaton, match_stats=serial_match_stats, stopping_rule=stopping_rule
+    )
+
+    match_stats = PrimerMatchStats()
+    unique_hits = count_primer_matches(
+        sample_fastq,
+        primers_automaton_fixture,
+        match_stats=match_stats,
+        stopping_rule=stopping_rule,
+        workers=2,
+        engine=engine,
+    )
+
+    assert unique_hits == serial_unique_hits
+    for primer, primer_auto in primers_automaton_fixture.items():
+        assert primer_auto.data == serial_primers_automaton[primer].data
+    assert (match_stats.reads, match_stats.stopped_early) == (
+        serial_match_stats.reads,
+        serial_match_stats.stopped_early,
+    )
+    assert match_stats.reads == match_stats.prefix_cache_hits + match_stats.prefix_cache_misses
+    # the reads are scanned sequentially with a stopping rule only, whether the sample fastq is compressed or not
+    assert parallel_scans == ([sample_fastq] if stopping_rule is None else [])
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_count_primer_matches_sample_blocks(
+    tmp_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primers_automaton_fixture: dict[str, PrimerAutomaton],
+    workers: int,
+):
+    sample_fastq = primer_autodetection_sample_dir_data_path / "9729bce7-f0a9-4617-b6e0-6145307741d1.fastq.gz"
+    with gzip.open(sample_fastq, "rb") as fin:
+        sample_records = fin.read()
+    # many small blocks
+    bgzf_fastq = tmp_path / "sample.bgzf.fastq.gz"
+    with BgzfWriter(bgzf_fastq, block_size=512) as writer:
+        for _ in range(50):
+            writer.write(sample_records)
+    num_blocks = 5
+    sampled_sequences = list(iter_fastq_sequences_in_blocks(bgzf_fastq, sample_bgzf_blocks(bgzf_fastq, num_blocks)))
+    # reference: the sampled reads only, read sequentially
+    sampled_fastq = tmp_path / "sampled.fastq"
+    write_fastq_reads(sampled_fastq, sampled_sequences)
+    expected_primers_automaton = copy_primers_automaton(primers_automaton_fixture)
+    count_primer_matches(sampled_fastq, expected_primers_automaton)
+
+    match_stats = PrimerMatchStats()
+    count_primer_matches(
+        bgzf_fastq, primers_automaton_fixture, match_stats=match_stats, workers=workers, sample_blocks=num_blocks
+    )
+
+    assert (match_stats.reads, match_stats.sampled_blocks) == (len(sampled_sequences), num_blocks)
+    assert 0 < match_stats.reads < 50 * 7
+    for primer, primer_auto in primers_automaton_fixture.items():
+        assert primer_auto.data == expected_primers_automaton[primer].data
+
+    # sequential reading: all the reads are needed for the read statistics, and the other files cannot be sampled
+    for fastq_path, read_stats in [(bgzf_fastq, ReadStats()), (sample_fastq, None)]:
+        match_stats = PrimerMatchStats()
+        count_primer_matches(
+            fastq_path,
+            copy_primers_automaton(primers_automaton_fixture),
+            match_stats=match_stats,
+            workers=workers,
+            read_stats=read_stats,
+            sample_blocks=num_blocks,
+        )
+        assert match_stats.sampled_blocks == 0
+        assert match_stats.reads == (50 * 7 if fastq_path == bgzf_fastq else 7)
+
+
 @pytest.mark.parametrize(
     "sample_id,expected_data",
     [
@@ -307,8 +849,37 @@ def test_generate_metrics(
     primers = prefix_path_to_index(orig_index_path, tmp_index_path, primer_autodetection_data_path)
     sample_fastq = primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz"
 
-    generate_metrics(tmp_index_path, sample_fastq, tmp_path)
+    primers_automaton, match_stats = generate_metrics(tmp_index_path, sample_fastq, tmp_path, write_coverage=True)
 
+    assert match_stats.reads == 7
+    assert set(primers_automaton) == set(primers)
+    for primer in primers:
+        assert_primer_coverage(primer, tmp_path, expected_output_path)
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_generate_metrics_stdin(
+    tmp_path: Path,
+    primer_autodetection_data_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+    workers: int,
+    monkeypatch,
+):
+    sample_id = "9729bce7-f0a9-4617-b6e0-6145307741d1"
+    index = f"{SARS_COV_2}_primer_index.csv"
+    expected_output_path = primer_autodetection_sample_dir_data_path / "expected_output" / sample_id
+    tmp_index_path = tmp_path / index
+    primers = prefix_path_to_index(
+        primer_autodetection_primer_schemes_data_path / index, tmp_index_path, primer_autodetection_data_path
+    )
+
+    # the sample is streamed: the reads are scanned sequentially, whatever the number of workers
+    with open(primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz", "rb") as stdin:
+        monkeypatch.setattr(sys, "stdin", stdin)
+        _, match_stats = generate_metrics(tmp_index_path, "-", tmp_path, workers=workers, write_coverage=True)
+
+    assert match_stats.reads == 7
     for primer in primers:
         assert_primer_coverage(primer, tmp_path, expected_output_path)
 
@@ -393,16 +964,31 @@ def test_write_selected_primer(
     ],
 )
 @pytest.mark.jira(identifier="7d937435-6fda-49dc-80c2-1e74142a8d65", confirms="PSG-3621")
+@pytest.mark.parametrize("in_memory", [False, True], ids=["coverage files", "in memory"])
 def test_generate_primer_autodetection_output_files(
     tmp_path: Path,
     primer_autodetection_data_path: Path,
     found_dir: str,
     sample_id: str,
     primer_input: str,
+    in_memory: bool,
 ):
     input_path = primer_autodetection_data_path / found_dir
-    copy_with_wildcard(input_path, tmp_path, COVERAGE_SUFFIX)
-    generate_primer_autodetection_output_files(tmp_path, sample_id, primer_input)
+    if in_memory:
+        primers_automaton = {}
+        for coverage_path in input_path.glob(f"*{COVERAGE_SUFFIX}"):
+            with open(coverage_path, newline="") as coverage_csv:
+                data = next(csv.DictReader(coverage_csv))
+            primer = data.pop(PRIMER_AUTODETECTION_PRIMER_COL)
+            primers_automaton[primer] = PrimerAutomaton(
+                data={PRIMER_AUTODETECTION_PRIMER_COL: primer, **{col: int(value) for col, value in data.items()}},
+                automaton=None,
+            )
+        generate_primer_autodetection_output_files(tmp_path, sample_id, primer_input, primers_automaton)
+        assert not list(tmp_path.glob(f"*{COVERAGE_SUFFIX}"))
+    else:
+        copy_with_wildcard(input_path, tmp_path, COVERAGE_SUFFIX)
+        generate_primer_autodetection_output_files(tmp_path, sample_id, primer_input)
     assert_primer_detection(sample_id, tmp_path, input_path)
     assert_primer_data(sample_id, tmp_path, input_path)
     assert_selected_primer_file(sample_id, primer_autodetection_data_path, tmp_path, found_dir)
@@ -415,6 +1001,10 @@ def test_generate_primer_autodetection_output_files(
         (f"{SARS_COV_2}_primer_index.csv", "a0446f6f-7d24-478c-8d92-7c77036930d8", "unknown"),
     ],
 )
+@pytest.mark.parametrize("index_format", ["csv", "bundle"])
+@pytest.mark.parametrize(
+    "engine,shared_index", [(AUTOMATON_ENGINE, False), (PACKED_ENGINE, False), (PACKED_ENGINE, True)]
+)
 @pytest.mark.jira(identifier="e4021c9e-609f-45b5-b366-9943b1146148", confirms="PSG-3621")
 def test_primer_autodetection(
     tmp_path: Path,
@@ -425,6 +1015,9 @@ def test_primer_autodetection(
     index: str,
     sample_id: str,
     primer_input: str,
+    index_format: str,
+    engine: str,
+    shared_index: bool,
 ):
     expected_output_path = primer_autodetection_sample_dir_data_path / "expected_output" / sample_id
     orig_index_path = primer_autodetection_primer_schemes_data_path / index
@@ -432,6 +1025,15 @@ def test_primer_autodetection(
     sample_fastq = primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz"
 
     prefix_path_to_index(orig_index_path, tmp_index_path, primer_autodetection_data_path)
+    if index_format == "bundle":
+        tmp_index_path = build_bundle(
+            orig_index_path, primer_autodetection_data_path, tmp_path / f"{index}{BUNDLE_SUFFIX}"
+        )
+    shared_index_dir = tmp_path / "shm"
+    shared_index_opts = []
+    if shared_index:
+        shared_index_dir.mkdir()
+        shared_index_opts = ["--shared-index-dir", shared_index_dir]
 
     rv = CliRunner().invoke(
         primer_autodetection,
@@ -446,12 +1048,293 @@ def test_primer_autodetection(
             sample_id,
             "--primer-input",
             primer_input,
+            "--engine",
+            engine,
+            *shared_index_opts,
         ],
     )
     assert rv.exit_code == 0
+    # the coverage files are only written for debugging
+    assert not list(tmp_path.glob(f"*{COVERAGE_SUFFIX}"))
+    if shared_index:
+        assert len(list(shared_index_dir.iterdir())) == 1
+    assert load_json(tmp_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["index_load_seconds"] > 0
 
     assert_primer_detection(sample_id, tmp_path, expected_output_path)
     assert_primer_data(sample_id, tmp_path, expected_output_path)
     assert_selected_primer_file(
         sample_id, primer_autodetection_data_path, tmp_path, f"{samples_dir}/expected_output/{sample_id}"
     )
+
+
+def test_primer_autodetection_shared_index_dir_requires_packed_engine(
+    tmp_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+):
+    rv = CliRunner().invoke(
+        primer_autodetection,
+        [
+            "--primer-index",
+            primer_autodetection_primer_schemes_data_path / f"{SARS_COV_2}_primer_index.csv",
+            "--sample-fastq",
+            primer_autodetection_sample_dir_data_path / "9729bce7-f0a9-4617-b6e0-6145307741d1.fastq.gz",
+            "--output-path",
+            tmp_path,
+            "--sample-id",
+            "sample",
+            "--primer-input",
+            "unknown",
+            "--shared-index-dir",
+            tmp_path,
+        ],
+    )
+    assert rv.exit_code != 0
+    assert f"--shared-index-dir requires --engine {PACKED_ENGINE}" in rv.output
+
+
+@pytest.mark.parametrize("index_format", ["csv", "bundle"])
+def test_primer_autodetection_result_cache(
+    tmp_path: Path,
+    primer_autodetection_data_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+    index_format: str,
+):
+    sample_id = "9729bce7-f0a9-4617-b6e0-6145307741d1"
+    index = f"{SARS_COV_2}_primer_index.csv"
+    tmp_index_path = tmp_path / index
+    prefix_path_to_index(
+        primer_autodetection_primer_schemes_data_path / index, tmp_index_path, primer_autodetection_data_path
+    )
+    if index_format == "bundle":
+        tmp_index_path = build_bundle(
+            primer_autodetection_primer_schemes_data_path / index,
+            primer_autodetection_data_path,
+            tmp_path / f"{index}{BUNDLE_SUFFIX}",
+        )
+    # the same content at another path is a cache hit
+    sample_fastq = tmp_path / "sample.fastq.gz"
+    shutil.copy(primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz", sample_fastq)
+    cache_dir = tmp_path / "cache"
+
+    def run(run_name: str, *options) -> Path:
+        output_path = tmp_path / run_name
+        output_path.mkdir()
+        rv = CliRunner().invoke(
+            primer_autodetection,
+            [
+                "--primer-index",
+                tmp_index_path,
+                "--sample-fastq",
+                sample_fastq,
+                "--output-path",
+                output_path,
+                "--sample-id",
+                sample_id,
+                "--primer-input",
+                "unknown",
+                "--cache-dir",
+                cache_dir,
+                *options,
+            ],
+        )
+        assert rv.exit_code == 0
+        return output_path
+
+    scanned_path = run("scanned")
+    assert len(list(cache_dir.iterdir())) == 1
+    cached_path = run("cached", "--engine", MATCHING_ENGINES[-1])
+    not_cached_path = run("not_cached", "--no-cache")
+
+    assert not load_json(scanned_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["result_cache_hit"]
+    assert load_json(cached_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["result_cache_hit"]
+    assert not load_json(not_cached_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["result_cache_hit"]
+    for suffix in [PRIMER_DETECTION_SUFFIX, PRIMER_DATA_SUFFIX, "_primer.txt"]:
+        assert (cached_path / f"{sample_id}{suffix}").read_bytes() == (
+            scanned_path / f"{sample_id}{suffix}"
+        ).read_bytes()
+
+    # the results depend on the stopping rule
+    run("stopped_early", "--max-reads", "3")
+    assert len(list(cache_dir.iterdir())) == 2
+
+    # results cached without read statistics are not reused when the read statistics are requested
+    read_stats_path = run("read_stats", "--read-stats")
+    cached_read_stats_path = run("cached_read_stats", "--read-stats")
+    assert not load_json(read_stats_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["result_cache_hit"]
+    assert load_json(cached_read_stats_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["result_cache_hit"]
+    for suffix in [READ_STATS_SUFFIX, READ_LENGTH_HISTOGRAM_SUFFIX]:
+        assert (cached_read_stats_path / f"{sample_id}{suffix}").read_bytes() == (
+            read_stats_path / f"{sample_id}{suffix}"
+        ).read_bytes()
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+@pytest.mark.parametrize("workers", [1, 2])
+@pytest.mark.parametrize("early_stopping_opts", [[], ["--max-reads", "3"]], ids=["all reads", "max reads"])
+def test_primer_autodetection_read_stats(
+    tmp_path: Path,
+    primer_autodetection_data_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+    compressed: bool,
+    workers: int,
+    early_stopping_opts: list[str],
+):
+    sample_id = "9729bce7-f0a9-4617-b6e0-6145307741d1"
+    index = f"{SARS_COV_2}_primer_index.csv"
+    tmp_index_path = tmp_path / index
+    prefix_path_to_index(
+        primer_autodetection_primer_schemes_data_path / index, tmp_index_path, primer_autodetection_data_path
+    )
+    sample_fastq = primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz"
+    with gzip.open(sample_fastq, "rt") as fastq_file:
+        sequences = [str(record.seq) for record in SeqIO.parse(fastq_file, "fastq")]
+    if not compressed:
+        sample_fastq = decompress_fastq(sample_fastq, tmp_path / "sample.fastq")
+
+    rv = CliRunner().invoke(
+        primer_autodetection,
+        [
+            "--primer-index",
+            tmp_index_path,
+            "--sample-fastq",
+            sample_fastq,
+            "--output-path",
+            tmp_path,
+            "--sample-id",
+            sample_id,
+            "--primer-input",
+            "unknown",
+            "--workers",
+            workers,
+            "--read-stats",
+            *early_stopping_opts,
+        ],
+    )
+    assert rv.exit_code == 0
+
+    # the read statistics cover all the reads, even if the scan stops early
+    bases = "".join(sequences)
+    with open(tmp_path / f"{sample_id}{READ_STATS_SUFFIX}", newline="") as read_stats_csv:
+        assert list(csv.DictReader(read_stats_csv)) == [
+            {
+                READ_STATS_SAMPLE_ID_COL: sample_id,
+                READ_STATS_NUMREADS_COL: str(len(sequences)),
+                READ_STATS_TOTAL_BASES_COL: str(len(bases)),
+                READ_STATS_MIN_LENGTH_COL: str(min(map(len, sequences))),
+                READ_STATS_MEAN_LENGTH_COL: str(len(bases) / len(sequences)),
+                READ_STATS_MAX_LENGTH_COL: str(max(map(len, sequences))),
+                READ_STATS_GC_FRACTION_COL: str(
+                    (bases.count("G") + bases.count("C")) / (len(bases) - bases.count("N"))
+                ),
+                READ_STATS_N_RATE_COL: str(bases.count("N") / len(bases)),
+            }
+        ]
+    with open(tmp_path / f"{sample_id}{READ_LENGTH_HISTOGRAM_SUFFIX}", newline="") as histogram_csv:
+        assert [
+            (int(row[READ_LENGTH_COL]), int(row[READ_LENGTH_NUMREADS_COL])) for row in csv.DictReader(histogram_csv)
+        ] == sorted(Counter(map(len, sequences)).items())
+
+
+@pytest.mark.parametrize("cache", [False, True], ids=["no cache", "cache"])
+def test_primer_autodetection_timings(
+    tmp_path: Path,
+    primer_autodetection_data_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+    cache: bool,
+):
+    sample_id = "9729bce7-f0a9-4617-b6e0-6145307741d1"
+    index = f"{SARS_COV_2}_primer_index.csv"
+    tmp_index_path = tmp_path / index
+    prefix_path_to_index(
+        primer_autodetection_primer_schemes_data_path / index, tmp_index_path, primer_autodetection_data_path
+    )
+    sample_fastq = primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz"
+    output_path = tmp_path / "output"
+    output_path.mkdir()
+    cache_opts = ["--cache-dir", tmp_path / "cache"] if cache else []
+
+    rv = CliRunner().invoke(
+        primer_autodetection,
+        [
+            "--primer-index",
+            tmp_index_path,
+            "--sample-fastq",
+            sample_fastq,
+            "--output-path",
+            output_path,
+            "--sample-id",
+            sample_id,
+            "--primer-input",
+            "unknown",
+            "--timings",
+            *cache_opts,
+        ],
+    )
+    assert rv.exit_code == 0
+
+    reads = load_json(output_path / f"{sample_id}{PRIMER_STATS_SUFFIX}")["reads"]
+    stages = {
+        timing["stage"]: timing for timing in load_json(output_path / f"{sample_id}{PRIMER_TIMINGS_SUFFIX}")["stages"]
+    }
+    expected_stages = {
+        "load_primer_index",
+        "count_primer_matches",
+        "generate_metrics",
+        "generate_primer_autodetection_output_files",
+    }
+    if cache:
+        expected_stages.add("fingerprint_sample_fastq")
+    assert set(stages) == expected_stages
+    assert stages["count_primer_matches"]["reads"] == stages["generate_metrics"]["reads"] == reads > 0
+    assert stages["load_primer_index"]["reads"] == 0
+    # the stages are nested in generate_metrics
+    assert stages["generate_metrics"]["wall_seconds"] >= stages["count_primer_matches"]["wall_seconds"]
+    for timing in stages.values():
+        assert timing["wall_seconds"] >= 0 and timing["cpu_seconds"] >= 0 and timing["bytes_read"] >= 0
+        assert timing["peak_rss_mb"] > 0
+
+
+@pytest.mark.parametrize("gate", [GATE_PASSED, GATE_NO_READS])
+def test_primer_autodetection_contamination_removal_gate(
+    tmp_path: Path,
+    primer_autodetection_data_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+    gate: str,
+):
+    sample_id = "9729bce7-f0a9-4617-b6e0-6145307741d1"
+    index = f"{SARS_COV_2}_primer_index.csv"
+    tmp_index_path = tmp_path / index
+    prefix_path_to_index(
+        primer_autodetection_primer_schemes_data_path / index, tmp_index_path, primer_autodetection_data_path
+    )
+    gate_path = tmp_path / f"{sample_id}_contamination_removal_gate.txt"
+    gate_path.write_text(f"{gate}\n")
+    output_path = tmp_path / "output"
+    output_path.mkdir()
+
+    rv = CliRunner().invoke(
+        primer_autodetection,
+        [
+            "--primer-index",
+            tmp_index_path,
+            "--sample-fastq",
+            primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz",
+            "--output-path",
+            output_path,
+            "--sample-id",
+            sample_id,
+            "--primer-input",
+            "unknown",
+            "--contamination-removal-gate",
+            gate_path,
+        ],
+    )
+    assert rv.exit_code == 0
+    # a gated sample has no primer autodetection output, as a sample without cleaned reads
+    assert (output_path / f"{sample_id}{PRIMER_STATS_SUFFIX}").is_file() == (gate == GATE_PASSED)
+    assert bool(list(output_path.iterdir())) == (gate == GATE_PASSED)
@@ -0,0 +1,113 @@
+from pathlib import Path
+import csv
+import pytest
+
+from click.testing import CliRunner
+
+from app.scripts.fetch_primers import SARS_COV_2
+from app.scripts.primer_autodetection import PRIMER_STATS_SUFFIX, COVERAGE_SUFFIX
+from app.scripts.primer_autodetection_batch import (
+    load_manifest,
+    primer_autodetection_batch,
+    ManifestSample,
+)
+from app.scripts.primer_cols import PRIMER_AUTODETECTION_MANIFEST_COLS
+from tests.common.test_primer_autodetection import (
+    prefix_path_to_index,
+    assert_primer_detection,
+    assert_primer_data,
+    assert_selected_primer_file,
+)
+
+SAMPLE_IDS = ["9729bce7-f0a9-4617-b6e0-6145307741d1", "a0446f6f-7d24-478c-8d92-7c77036930d8"]
+
+
+def write_manifest(manifest_path: Path, rows: list[list[str]]) -> None:
+    with open(manifest_path, "w", newline="") as manifest_csv:
+        writer = csv.writer(manifest_csv)
+        writer.writerow(PRIMER_AUTODETECTION_MANIFEST_COLS)
+        writer.writerows(rows)
+
+
+def test_load_manifest(tmp_path: Path):
+    manifest_path = tmp_path / "manifest.csv"
+    write_manifest(
+        manifest_path, [["sample_1", "sample_1.fastq.gz", "unknown"], ["sample_2", "/data/s2.fq", "ARTIC_V4"]]
+    )
+
+    assert load_manifest(manifest_path) == [
+        ManifestSample(sample_id="sample_1", sample_fastq=tmp_path / "sample_1.fastq.gz", primer_input="unknown"),
+        ManifestSample(sample_id="sample_2", sample_fastq=Path("/data/s2.fq"), primer_input="ARTIC_V4"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "content,expected_error",
+    [
+        ("sample_id,fastq\nsample_1,sample_1.fastq.gz\n", "missing the columns: primer_input"),
+        ("sample_id,fastq,primer_input\nsample_1,a.fastq.gz,unknown\nsample_2,,unknown\n", "empty values in rows: 3"),
+        (
+            "sample_id,fastq,primer_input\nsample_1,a.fastq.gz,unknown\nsample_1,b.fastq.gz,unknown\n",
+            "duplicated sample ids: sample_1",
+        ),
+    ],
+)
+def test_load_manifest_invalid(tmp_path: Path, content: str, expected_error: str):
+    manifest_path = tmp_path / "manifest.csv"
+    manifest_path.write_text(content)
+
+    with pytest.raises(ValueError, match=expected_error):
+        load_manifest(manifest_path)
+
+
+@pytest.mark.parametrize("jobs", [1, 2])
+def test_primer_autodetection_batch(
+    tmp_path: Path,
+    primer_autodetection_data_path: Path,
+    primer_autodetection_sample_dir_data_path: Path,
+    primer_autodetection_primer_schemes_data_path: Path,
+    samples_dir: str,
+    jobs: int,
+):
+    index = f"{SARS_COV_2}_primer_index.csv"
+    tmp_index_path = tmp_path / index
+    prefix_path_to_index(
+        primer_autodetection_primer_schemes_data_path / index, tmp_index_path, primer_autodetection_data_path
+    )
+    manifest_path = tmp_path / "manifest.csv"
+    write_manifest(
+        manifest_path,
+        [
+            [sample_id, str(primer_autodetection_sample_dir_data_path / f"{sample_id}.fastq.gz"), "unknown"]
+            for sample_id in SAMPLE_IDS
+        ],
+    )
+    output_path = tmp_path / "output"
+    output_path.mkdir()
+
+    rv = CliRunner().invoke(
+        primer_autodetection_batch,
+        [
+            "--primer-index",
+            tmp_index_path,
+            "--manifest",
+            manifest_path,
+            "--output-path",
+            output_path,
+            "--jobs",
+            jobs,
+        ],
+    )
+    assert rv.exit_code == 0
+
+    # the coverage files of the samples are not left behind
+    assert not list(output_path.glob(f"**/*{COVERAGE_SUFFIX}"))
+    assert not [path for path in output_path.iterdir() if path.is_dir()]
+    for sample_id in SAMPLE_IDS:
+        expected_output_path = primer_autodetection_sample_dir_data_path / "expected_output" / sample_id
+        assert (output_path / f"{sample_id}{PRIMER_STATS_SUFFIX}").is_file()
+        assert_primer_detection(sample_id, output_path, expected_output_path)
+        assert_primer_data(sample_id, output_path, expected_output_path)
+        assert_selected_primer_file(
+            sample_id, primer_autodetection_data_path, output_path, f"{samples_dir}/expected_output/{sample_id}"
+        )
@@ -1,9 +1,40 @@
 from pathlib import Path
 import pytest
 import json
+import pandas as pd
 from click.testing import CliRunner
 
-from app.scripts.generate_pipeline_results_files import generate_pipeline_results_files
+from app.scripts.generate_pipeline_results_files import (
+    generate_pipeline_results_files,
+    _generate_notifications,
+    load_data_from_csv,
+    EXPECTED_NCOV_HEADERS,
+    EXPECTED_PANGOLIN_HEADERS,
+    NCOV_SAMPLE_ID_COL,
+    PANGOLIN_SAMPLE_ID_COL,
+    FAILED_CONTAMINATION_REMOVAL,
+    UNKNOWN_CONTAMINATION_REMOVAL,
+    UNKNOWN_PRIMER_AUTODETECTION,
+    UNKNOWN_NCOV,
+    UNKNOWN_PANGOLIN,
+)
+from app.scripts.contamination_removal import (
+    CONTAMINATION_REMOVAL_SAMPLE_ID_COL,
+    EXPECTED_CONTAMINATION_REMOVAL_HEADERS,
+)
+from app.scripts.primer_cols import (
+    PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL,
+    PRIMER_AUTODETECTION_SAMPLE_ID_COL,
+    EXPECTED_PRIMER_AUTODETECTION_HEADERS,
+    READ_STATS_SAMPLE_ID_COL,
+    READ_STATS_NUMREADS_COL,
+    READ_STATS_TOTAL_BASES_COL,
+    READ_STATS_MIN_LENGTH_COL,
+    READ_STATS_MEAN_LENGTH_COL,
+    READ_STATS_MAX_LENGTH_COL,
+    READ_STATS_GC_FRACTION_COL,
+    READ_STATS_N_RATE_COL,
+)
 from app.scripts.util.metadata import SAMPLE_ID
 from tests.utils_tests import assert_csvs_are_equal, assert_jsons_are_equal
 
@@ -135,3 +166,249 @@ def test_generate_pipeline_results_files(
     }
 
     assert exp_resultfiles_json_dict_full_path == calc_resultfiles_json_dict
+
+
+def test_generate_pipeline_results_files_read_stats(tmp_path: Path, pipeline_results_files_data_path: Path):
+    input_path = pipeline_results_files_data_path / "sars_cov_2"
+    output_results_csv_file = tmp_path / "results.csv"
+    # a sample without reads has no read statistics
+    read_stats = pd.DataFrame(
+        {
+            READ_STATS_SAMPLE_ID_COL: ["0774181d-fb20-4a73-b887-38af7eda9b38", "e80f3c63-d139-4c14-bd72-7a43897ab40d"],
+            READ_STATS_NUMREADS_COL: [100, 50],
+            READ_STATS_TOTAL_BASES_COL: [15000, 7000],
+            READ_STATS_MIN_LENGTH_COL: [100, 90],
+            READ_STATS_MEAN_LENGTH_COL: [150.0, 140.0],
+            READ_STATS_MAX_LENGTH_COL: [151, 151],
+            READ_STATS_GC_FRACTION_COL: [0.38, 0.4],
+            READ_STATS_N_RATE_COL: [0.001, 0.0],
+        }
+    )
+    read_stats.to_csv(tmp_path / "read_stats.csv", index=False)
+
+    rv = CliRunner().invoke(
+        generate_pipeline_results_files,
+        [
+            "--analysis-run-name",
+            "just_a_name",
+            "--metadata-file",
+            input_path / "metadata_illumina.csv",
+            "--pangolin-csv-file",
+            input_path / "all_lineages_report.csv",
+            "--contamination-removal-csv-file",
+            input_path / "contamination_removal.csv",
+            "--primer-autodetection-csv-file",
+            input_path / "primer_autodetection.csv",
+            "--read-stats-csv-file",
+            tmp_path / "read_stats.csv",
+            "--ncov-qc-csv-file",
+            input_path / "ncov_test.qc.csv",
+            "--output-results-csv-file",
+            output_results_csv_file,
+            "--output-results-json-file",
+            tmp_path / "results.json",
+            "--output-resultfiles-json-file",
+            tmp_path / "resultfiles.json",
+            "--output-path",
+            tmp_path,
+            "--sequencing-technology",
+            "illumina",
+        ],
+    )
+    assert rv.exit_code == 0
+
+    df_results = pd.read_csv(output_results_csv_file)
+    read_stats_cols = [col.upper() for col in read_stats.columns if col != READ_STATS_SAMPLE_ID_COL]
+    # the other columns are unchanged
+    df_results.drop(columns=read_stats_cols).to_csv(tmp_path / "results_without_read_stats.csv", index=False)
+    assert_csvs_are_equal(
+        tmp_path / "results_without_read_stats.csv", input_path / "results_illumina_ont.csv", SAMPLE_ID
+    )
+    df_read_stats = df_results.set_index(SAMPLE_ID)[read_stats_cols]
+    assert df_read_stats.loc["0774181d-fb20-4a73-b887-38af7eda9b38"].tolist() == [
+        100,
+        15000,
+        100,
+        150.0,
+        151,
+        0.38,
+        0.001,
+    ]
+    assert df_read_stats.loc["56a63f60-764d-4fc7-8764-a46023cbe324"].isna().all()
+
+
+def test_generate_pipeline_results_files_fuzzy_primers(tmp_path: Path, pipeline_results_files_data_path: Path):
+    input_path = pipeline_results_files_data_path / "sars_cov_2"
+    output_results_csv_file = tmp_path / "results.csv"
+    # primer autodetection with a primer index holding the primer sequences with one mismatch
+    primer_autodetection = pd.read_csv(input_path / "primer_autodetection.csv")
+    primer_autodetection[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL] = range(len(primer_autodetection))
+    primer_autodetection.to_csv(tmp_path / "primer_autodetection.csv", index=False)
+
+    rv = CliRunner().invoke(
+        generate_pipeline_results_files,
+        [
+            "--analysis-run-name",
+            "just_a_name",
+            "--metadata-file",
+            input_path / "metadata_illumina.csv",
+            "--pangolin-csv-file",
+            input_path / "all_lineages_report.csv",
+            "--contamination-removal-csv-file",
+            input_path / "contamination_removal.csv",
+            "--primer-autodetection-csv-file",
+            tmp_path / "primer_autodetection.csv",
+            "--ncov-qc-csv-file",
+            input_path / "ncov_test.qc.csv",
+            "--output-results-csv-file",
+            output_results_csv_file,
+            "--output-results-json-file",
+            tmp_path / "results.json",
+            "--output-resultfiles-json-file",
+            tmp_path / "resultfiles.json",
+            "--output-path",
+            tmp_path,
+            "--sequencing-technology",
+            "illumina",
+        ],
+    )
+    assert rv.exit_code == 0
+
+    df_results = pd.read_csv(output_results_csv_file)
+    # the other columns are unchanged
+    df_results.drop(columns=[PRIMER_AUTODETECTION_FUZZY_NUMREADS_COL.upper()]).to_csv(
+        tmp_path / "results_without_fuzzy_numreads.csv", index=False
+    )
+    assert_csvs_are_equal(
+        tmp_path / "results_without_fuzzy_numreads.csv", input_path / "results_illumina_ont.csv", SAMPLE_ID
+    )
+
+
+def test_generate_pipeline_results_files_gated_samples(tmp_path: Path, pipeline_results_files_data_path: Path):
+    input_path = pipeline_results_files_data_path / "sars_cov_2"
+    output_results_csv_file = tmp_path / "results.csv"
+    output_resultfiles_json_file = tmp_path / "resultfiles.json"
+    # the sample without reads kept is gated by the contamination removal: it has no primer autodetection output
+    gated_sample = "985347c5-ff6a-454c-ac34-bc353d05dd70"
+    primer_autodetection = pd.read_csv(input_path / "primer_autodetection.csv")
+    primer_autodetection = primer_autodetection[
+        primer_autodetection[PRIMER_AUTODETECTION_SAMPLE_ID_COL] != gated_sample
+    ]
+    primer_autodetection.to_csv(tmp_path / "primer_autodetection.csv", index=False)
+
+    rv = CliRunner().invoke(
+        generate_pipeline_results_files,
+        [
+            "--analysis-run-name",
+            "just_a_name",
+            "--metadata-file",
+            input_path / "metadata_illumina.csv",
+            "--pangolin-csv-file",
+            input_path / "all_lineages_report.csv",
+            "--contamination-removal-csv-file",
+            input_path / "contamination_removal.csv",
+            "--primer-autodetection-csv-file",
+            tmp_path / "primer_autodetection.csv",
+            "--ncov-qc-csv-file",
+            input_path / "ncov_test.qc.csv",
+            "--output-results-csv-file",
+            output_results_csv_file,
+            "--output-results-json-file",
+            tmp_path / "results.json",
+            "--output-resultfiles-json-file",
+            output_resultfiles_json_file,
+            "--output-path",
+            tmp_path,
+            "--sequencing-technology",
+            "illumina",
+        ],
+    )
+    assert rv.exit_code == 0
+
+    # the gated sample failed, as without the gate, and the other samples are unchanged
+    df_results = pd.read_csv(output_results_csv_file).set_index(SAMPLE_ID)
+    df_expected = pd.read_csv(input_path / "results_illumina_ont.csv").set_index(SAMPLE_ID)
+    assert df_results.loc[gated_sample, "STATUS"] == "Failed"
+    assert pd.isna(df_results.loc[gated_sample, "PRIMER_DETECTED"])
+    pd.testing.assert_frame_equal(
+        df_results.drop(index=gated_sample).sort_index(),
+        df_expected.drop(index=gated_sample).sort_index(),
+        check_like=True,
+    )
+    with open(output_resultfiles_json_file) as json_fd:
+        resultfiles = json.load(json_fd)
+    assert not [
+        result_file for result_file in resultfiles[gated_sample] if "primer_autodetection" in result_file["file"]
+    ]
+
+    # the gated sample failed the contamination removal QC, it is not unknown to any stage
+    _, events = _generate_notifications(
+        "just_a_name",
+        sorted(df_results.index),
+        load_data_from_csv(
+            input_path / "contamination_removal.csv",
+            EXPECTED_CONTAMINATION_REMOVAL_HEADERS,
+            CONTAMINATION_REMOVAL_SAMPLE_ID_COL,
+        ),
+        load_data_from_csv(
+            tmp_path / "primer_autodetection.csv",
+            EXPECTED_PRIMER_AUTODETECTION_HEADERS,
+            PRIMER_AUTODETECTION_SAMPLE_ID_COL,
+        ),
+        load_data_from_csv(input_path / "ncov_test.qc.csv", EXPECTED_NCOV_HEADERS, NCOV_SAMPLE_ID_COL),
+        load_data_from_csv(input_path / "all_lineages_report.csv", EXPECTED_PANGOLIN_HEADERS, PANGOLIN_SAMPLE_ID_COL),
+    )
+    assert gated_sample in events[FAILED_CONTAMINATION_REMOVAL].samples
+    for unknown_event in [UNKNOWN_CONTAMINATION_REMOVAL, UNKNOWN_PRIMER_AUTODETECTION, UNKNOWN_NCOV, UNKNOWN_PANGOLIN]:
+        assert gated_sample not in list(events[unknown_event].samples)
+
+
+def test_generate_pipeline_results_files_contamination_removal_batch(
+    tmp_path: Path, pipeline_results_files_data_path: Path
+):
+    input_path = pipeline_results_files_data_path / "sars_cov_2"
+    resultfiles = {}
+    for batch_opts in ([], ["--contamination-removal-batch"]):
+        output_resultfiles_json_file = tmp_path / f"resultfiles{len(batch_opts)}.json"
+        rv = CliRunner().invoke(
+            generate_pipeline_results_files,
+            [
+                "--analysis-run-name",
+                "just_a_name",
+                "--metadata-file",
+                input_path / "metadata_illumina.csv",
+                "--pangolin-csv-file",
+                input_path / "all_lineages_report.csv",
+                "--contamination-removal-csv-file",
+                input_path / "contamination_removal.csv",
+                "--primer-autodetection-csv-file",
+                input_path / "primer_autodetection.csv",
+                "--ncov-qc-csv-file",
+                input_path / "ncov_test.qc.csv",
+                "--output-results-csv-file",
+                tmp_path / "results.csv",
+                "--output-results-json-file",
+                tmp_path / "results.json",
+                "--output-resultfiles-json-file",
+                output_resultfiles_json_file,
+                "--output-path",
+                tmp_path,
+                "--sequencing-technology",
+                "illumina",
+                *batch_opts,
+            ],
+        )
+        assert rv.exit_code == 0
+        with open(output_resultfiles_json_file) as json_fd:
+            resultfiles[bool(batch_opts)] = json.load(json_fd)
+
+    # the contamination removal csv file of the run is not a sample result file
+    assert resultfiles[True] == {
+        sample_id: [
+            result_file
+            for result_file in result_files
+            if not result_file["file"].endswith("_contamination_removal.csv")
+        ]
+        for sample_id, result_files in resultfiles[False].items()
+    }
+    assert resultfiles[True] != resultfiles[False]
@@ -0,0 +1,84 @@
+from pathlib import Path
+import gzip
+import pytest
+
+from app.scripts.util.bgzf import (
+    BGZF_MAX_BLOCK_SIZE,
+    bgzf_index_path,
+    is_bgzf,
+    iter_bgzf_blocks,
+    load_bgzf_index,
+    scan_bgzf_blocks,
+)
+from tests.utils_tests import BGZF_EOF, BgzfWriter, write_bgzf
+
+DATA = b"".join(b"@read_%d\nACGTTGCA\n+\nIIIIIIII\n" % i for i in range(20000))
+
+
+@pytest.mark.parametrize("index", [True, False], ids=["index", "no index"])
+def test_write_bgzf(tmp_path: Path, index: bool):
+    bgzf_path = tmp_path / "data.gz"
+    write_bgzf(bgzf_path, [DATA[i : i + 1000] for i in range(0, len(DATA), 1000)], index=index)
+
+    # readable by any gzip reader
+    with gzip.open(bgzf_path, "rb") as gzip_file:
+        assert gzip_file.read() == DATA
+    assert is_bgzf(bgzf_path)
+    assert bgzf_index_path(bgzf_path).is_file() == index
+
+    block_offsets = load_bgzf_index(bgzf_path)
+    assert block_offsets == scan_bgzf_blocks(bgzf_path)
+    assert len(block_offsets) > 1 and block_offsets[0] == (0, 0)
+    compressed_offsets = [compressed_offset for compressed_offset, _ in block_offsets]
+    assert all(0 < end - start <= BGZF_MAX_BLOCK_SIZE for start, end in zip(compressed_offsets, compressed_offsets[1:]))
+
+    # each block is decompressed on its own
+    with open(bgzf_path, "rb") as bgzf_file:
+        for (compressed_offset, uncompressed_offset), (_, next_uncompressed_offset) in zip(
+            block_offsets, block_offsets[1:]
+        ):
+            bgzf_file.seek(compressed_offset)
+            assert next(iter_bgzf_blocks(bgzf_file)) == DATA[uncompressed_offset:next_uncompressed_offset]
+        bgzf_file.seek(0)
+        assert b"".join(iter_bgzf_blocks(bgzf_file)) == DATA
+
+
+def test_bgzf_writer_block_size(tmp_path: Path):
+    bgzf_path = tmp_path / "data.gz"
+    with BgzfWriter(bgzf_path, block_size=100) as writer:
+        writer.write(DATA[:250])
+        writer.write(DATA[250:1000])
+
+    assert writer.block_offsets == scan_bgzf_blocks(bgzf_path)
+    assert [uncompressed_offset for _, uncompressed_offset in writer.block_offsets] == list(range(0, 1000, 100))
+    with gzip.open(bgzf_path, "rb") as gzip_file:
+        assert gzip_file.read() == DATA[:1000]
+
+    with pytest.raises(ValueError):
+        BgzfWriter(tmp_path / "invalid.gz", block_size=0)
+
+
+def test_is_bgzf(tmp_path: Path):
+    gzip_path = tmp_path / "data.gz"
+    with gzip.open(gzip_path, "wb") as gzip_file:
+        gzip_file.write(DATA)
+    plain_path = tmp_path / "data.txt"
+    plain_path.write_bytes(DATA)
+    empty_path = tmp_path / "empty"
+    empty_path.write_bytes(b"")
+
+    assert not is_bgzf(gzip_path)
+    assert not is_bgzf(plain_path)
+    assert not is_bgzf(empty_path)
+
+
+def test_iter_bgzf_blocks_corrupted(tmp_path: Path):
+    bgzf_path = tmp_path / "data.gz"
+    write_bgzf(bgzf_path, [DATA[:1000]], index=False)
+    content = bytearray(bgzf_path.read_bytes())
+    # the CRC32 of the single data block, followed by its ISIZE and by the end of file block
+    content[-len(BGZF_EOF) - 8] ^= 0xFF
+    bgzf_path.write_bytes(bytes(content))
+
+    with open(bgzf_path, "rb") as bgzf_file, pytest.raises(ValueError, match="Corrupted"):
+        list(iter_bgzf_blocks(bgzf_file))
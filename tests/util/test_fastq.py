@@ -0,0 +1,271 @@
+from pathlib import Path
+import gzip
+import os
+import shutil
+import sys
+import threading
+import pytest
+from Bio import SeqIO
+
+from app.scripts.util.fastq import (
+    DECOMPRESSION_BACKENDS,
+    PIGZ_BACKEND,
+    STDIN_PATH,
+    available_decompression_backends,
+    is_gzipped,
+    is_stream,
+    iter_fastq_chunks,
+    iter_fastq_records,
+    iter_fastq_sequences,
+    iter_fastq_sequences_in_blocks,
+    iter_fastq_sequences_in_chunk,
+    iter_fastq_sequences_in_range,
+    open_fastq,
+    sample_bgzf_blocks,
+    split_fastq,
+)
+from tests.utils_tests import BgzfWriter
+
+
+SAMPLE_FASTQ = "9729bce7-f0a9-4617-b6e0-6145307741d1.fastq.gz"
+
+
+def _expected_records(fastq_gz: Path) -> list[tuple[str, str, str]]:
+    with gzip.open(fastq_gz, "rt") as fastq_file:
+        return [
+            (
+                record.id,
+                str(record.seq),
+                "".join(chr(q + 33) for q in record.letter_annotations["phred_quality"]),
+            )
+            for record in SeqIO.parse(fastq_file, "fastq")
+        ]
+
+
+@pytest.fixture
+def plain_fastq(tmp_path: Path, primer_autodetection_sample_dir_data_path: Path) -> Path:
+    fastq_path = tmp_path / "sample.fastq"
+    with gzip.open(primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ, "rb") as fin:
+        fastq_path.write_bytes(fin.read())
+    return fastq_path
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_iter_fastq_sequences(primer_autodetection_sample_dir_data_path: Path, plain_fastq: Path, compressed: bool):
+    sample_fastq = primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ
+    expected_sequences = [seq for _, seq, _ in _expected_records(sample_fastq)]
+
+    sequences = list(iter_fastq_sequences(sample_fastq if compressed else plain_fastq))
+
+    assert sequences == expected_sequences
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_iter_fastq_records(primer_autodetection_sample_dir_data_path: Path, plain_fastq: Path, compressed: bool):
+    sample_fastq = primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ
+
+    records = list(iter_fastq_records(sample_fastq if compressed else plain_fastq))
+
+    assert records == _expected_records(sample_fastq)
+
+
+def test_iter_fastq_records_invalid(tmp_path: Path):
+    fastq_path = tmp_path / "invalid.fastq"
+    fastq_path.write_text(">read_1\nACGT\n+\nIIII\n")
+
+    with pytest.raises(ValueError, match="Invalid FASTQ record"):
+        list(iter_fastq_records(fastq_path))
+
+
+def test_is_gzipped(primer_autodetection_sample_dir_data_path: Path, plain_fastq: Path):
+    assert is_gzipped(primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ)
+    assert not is_gzipped(plain_fastq)
+
+
+@pytest.mark.parametrize("num_chunks", [1, 2, 3, 5, 100])
+def test_split_fastq(tmp_path: Path, num_chunks: int):
+    # quality lines starting with '@' must not be mistaken for record headers
+    fastq_path = tmp_path / "sample.fastq"
+    records = [(f"read_{i}", "ACGT" * (i + 1), "@" * 4 * (i + 1)) for i in range(10)]
+    fastq_path.write_text("".join(f"@{name}\n{seq}\n+\n{qual}\n" for name, seq, qual in records))
+
+    byte_ranges = split_fastq(fastq_path, num_chunks)
+
+    assert byte_ranges[0][0] == 0
+    assert byte_ranges[-1][1] == fastq_path.stat().st_size
+    assert all(end == next_start for (_, end), (next_start, _) in zip(byte_ranges, byte_ranges[1:]))
+    assert [
+        sequence for start, end in byte_ranges for sequence in iter_fastq_sequences_in_range(fastq_path, start, end)
+    ] == [seq for _, seq, _ in records]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 50, 1 << 20])
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_iter_fastq_chunks(tmp_path: Path, chunk_size: int, compressed: bool):
+    # quality lines starting with '@' must not be mistaken for record headers, the last line has no newline
+    records = [(f"read_{i}", "ACGT" * (i + 1), "@" * 4 * (i + 1)) for i in range(10)]
+    content = "".join(f"@{name}\n{seq}\n+\n{qual}\n" for name, seq, qual in records).rstrip().encode()
+    fastq_path = tmp_path / "sample.fastq"
+    fastq_path.write_bytes(gzip.compress(content) if compressed else content)
+
+    chunks = list(iter_fastq_chunks(fastq_path, chunk_size))
+
+    assert b"".join(chunks) == content
+    assert all(chunk.count(b"\n") % 4 == 0 for chunk in chunks[:-1])
+    assert [sequence for chunk in chunks for sequence in iter_fastq_sequences_in_chunk(chunk)] == [
+        seq for _, seq, _ in records
+    ]
+
+
+@pytest.fixture
+def fake_pigz(tmp_path: Path, monkeypatch) -> None:
+    # stand-in for pigz when it is not installed, sharing its command line
+    pigz_path = tmp_path / "bin" / "pigz"
+    pigz_path.parent.mkdir()
+    pigz_path.write_text('#!/bin/sh\nexec gzip "$@"\n')
+    pigz_path.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{pigz_path.parent}:{os.environ['PATH']}")
+
+
+@pytest.mark.parametrize("decompression_backend", DECOMPRESSION_BACKENDS)
+def test_iter_fastq_sequences_decompression_backend(
+    primer_autodetection_sample_dir_data_path: Path, fake_pigz: None, decompression_backend: str
+):
+    if decompression_backend not in available_decompression_backends():
+        pytest.skip(f"{decompression_backend} is not installed")
+    sample_fastq = primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ
+    expected_sequences = [seq for _, seq, _ in _expected_records(sample_fastq)]
+
+    sequences = list(iter_fastq_sequences(sample_fastq, decompression_backend))
+
+    assert sequences == expected_sequences
+
+
+def test_open_fastq_pigz_failure(tmp_path: Path, fake_pigz: None):
+    fastq_path = tmp_path / "truncated.fastq.gz"
+    fastq_path.write_bytes(gzip.compress(b"@read_1\nACGT\n+\nIIII\n")[:-10])
+
+    with pytest.raises(OSError, match="failed to decompress"):
+        with open_fastq(fastq_path, PIGZ_BACKEND) as fastq_file:
+            fastq_file.read()
+
+
+def test_open_fastq_unknown_backend(plain_fastq: Path):
+    with pytest.raises(ValueError, match="Decompression backend unknown is not available"):
+        with open_fastq(plain_fastq, "unknown"):
+            pass
+
+
+def test_is_stream(tmp_path: Path, plain_fastq: Path):
+    fifo_path = tmp_path / "sample.fifo"
+    os.mkfifo(fifo_path)
+    assert is_stream(STDIN_PATH)
+    assert is_stream(fifo_path)
+    assert not is_stream(plain_fastq)
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_iter_fastq_sequences_stdin(
+    primer_autodetection_sample_dir_data_path: Path, plain_fastq: Path, compressed: bool, monkeypatch
+):
+    fastq_gz = primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ
+    with open(fastq_gz if compressed else plain_fastq, "rb") as stdin:
+        monkeypatch.setattr(sys, "stdin", stdin)
+        sequences = list(iter_fastq_sequences(STDIN_PATH))
+        # the standard input is left open
+        assert not stdin.closed
+    assert sequences == [sequence for _, sequence, _ in _expected_records(fastq_gz)]
+
+
+@pytest.mark.parametrize("compressed", [True, False], ids=["gzip", "plain"])
+def test_iter_fastq_sequences_named_pipe(
+    tmp_path: Path, primer_autodetection_sample_dir_data_path: Path, plain_fastq: Path, compressed: bool
+):
+    fastq_gz = primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ
+    fifo_path = tmp_path / "sample.fifo"
+    os.mkfifo(fifo_path)
+
+    def write_fifo():
+        with open(fastq_gz if compressed else plain_fastq, "rb") as fin, open(fifo_path, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+
+    writer = threading.Thread(target=write_fifo)
+    writer.start()
+    sequences = list(iter_fastq_sequences(fifo_path))
+    writer.join()
+    assert sequences == [sequence for _, sequence, _ in _expected_records(fastq_gz)]
+
+
+def _write_bgzf_fastq(fastq_path: Path, records: list[tuple[str, str, str]], block_size: int) -> list[int]:
+    """
+    Return the uncompressed offset of each record
+    """
+    record_offsets = []
+    offset = 0
+    with BgzfWriter(fastq_path, block_size=block_size) as writer:
+        for name, seq, qual in records:
+            record = f"@{name}\n{seq}\n+\n{qual}\n".encode()
+            writer.write(record)
+            record_offsets.append(offset)
+            offset += len(record)
+    return record_offsets
+
+
+@pytest.mark.parametrize("read_length", [10, 500], ids=["short reads", "reads longer than blocks"])
+@pytest.mark.parametrize("num_blocks", [1, 3, 10])
+def test_iter_fastq_sequences_in_blocks(tmp_path: Path, read_length: int, num_blocks: int):
+    # unique sequences: the read index in base 4. Quality lines starting with '@' must not be mistaken for headers
+    records = [
+        (f"read_{i}", "".join("ACGT"[i // 4**d % 4] for d in range(5)).ljust(read_length, "T"), "@" * read_length)
+        for i in range(200)
+    ]
+    fastq_path = tmp_path / "sample.fastq.gz"
+    record_offsets = _write_bgzf_fastq(fastq_path, records, block_size=256)
+    read_ids = {seq: read_id for read_id, (_, seq, _) in enumerate(records)}
+
+    sampled_blocks = sample_bgzf_blocks(fastq_path, num_blocks)
+    sampled_ids = [read_ids[seq] for seq in iter_fastq_sequences_in_blocks(fastq_path, sampled_blocks)]
+
+    assert len(sampled_blocks) == num_blocks
+    assert sampled_blocks[0][2] == 0
+    # each read once, in file order
+    assert sampled_ids == sorted(set(sampled_ids))
+    # the reads starting within the sampled blocks, including the reads starting at the very beginning of a block
+    assert set(sampled_ids) == {
+        read_id
+        for read_id, offset in enumerate(record_offsets)
+        if any(start <= offset < end for _, _, start, end in sampled_blocks)
+    }
+    if num_blocks > 1 and read_length == 10:
+        # evenly spaced over the file (a block may hold no read start if the reads are longer than the blocks)
+        assert sampled_ids[-1] > len(records) // 2
+
+
+def test_iter_fastq_sequences_in_blocks_at_block_starts(tmp_path: Path):
+    # 64 bytes per record: each block of 256 bytes starts with a record
+    records = [
+        (f"r{i:05d}", "".join("ACGT"[i // 4**d % 4] for d in range(5)).ljust(26, "T"), "I" * 26) for i in range(64)
+    ]
+    fastq_path = tmp_path / "sample.fastq.gz"
+    record_offsets = _write_bgzf_fastq(fastq_path, records, block_size=256)
+    assert record_offsets[4] == 256
+
+    sampled_blocks = sample_bgzf_blocks(fastq_path, 4)
+    sampled_sequences = list(iter_fastq_sequences_in_blocks(fastq_path, sampled_blocks))
+
+    # the 4 reads of each sampled block, the first one included
+    assert sampled_sequences == [
+        seq
+        for (_, seq, _), offset in zip(records, record_offsets)
+        if any(start <= offset < end for *_, start, end in sampled_blocks)
+    ]
+    assert len(sampled_sequences) == 16
+
+
+def test_sample_bgzf_blocks_sequential_fallback(tmp_path: Path, primer_autodetection_sample_dir_data_path: Path):
+    # gzip but not BGZF
+    assert sample_bgzf_blocks(primer_autodetection_sample_dir_data_path / SAMPLE_FASTQ, 2) is None
+    # not more blocks than sampled
+    fastq_path = tmp_path / "sample.fastq.gz"
+    _write_bgzf_fastq(fastq_path, [("read_0", "ACGT", "IIII")], block_size=256)
+    assert sample_bgzf_blocks(fastq_path, 1) is None
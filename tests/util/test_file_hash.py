@@ -0,0 +1,16 @@
+from pathlib import Path
+import os
+
+from app.scripts.util.file_hash import file_fingerprint
+
+
+def test_file_fingerprint(tmp_path: Path):
+    file_path = tmp_path / "sample.fastq"
+    file_path.write_bytes(b"@read\nACGT\n+\nIIII\n")
+    copy_path = tmp_path / "copy.fastq"
+    copy_path.write_bytes(file_path.read_bytes())
+    os.utime(copy_path, (0, 0))
+
+    assert file_fingerprint(file_path) == file_fingerprint(copy_path)
+    copy_path.write_bytes(b"@read\nACGA\n+\nIIII\n")
+    assert file_fingerprint(file_path) != file_fingerprint(copy_path)
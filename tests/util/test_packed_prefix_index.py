@@ -0,0 +1,90 @@
+import pytest
+import ahocorasick
+
+from app.scripts.util.packed_prefix_index import PackedPrefixIndex
+
+SEQUENCES = [
+    "AGA",
+    "AAGA",
+    "ATGA",
+    "GTAT",
+    "ACGTACGTACGTACGTACGTACGTACGTACGT",
+    "ACGTACGTACGTACGTACGTACGTACGTACGTA",
+    "ACGTACGTACGTACGTACGTACGTACGTACGTAC",
+    "ACGTACGTACGTACGTACGTACGTACGTACGTTT",
+]
+
+
+def automaton_matches(read_prefix: str) -> tuple[tuple, tuple]:
+    """
+    Reference matches: the exact and wildcard-only sequence ids found by an ahocorasick automaton
+    """
+    automaton = ahocorasick.Automaton()
+    for sequence_id, sequence in enumerate(SEQUENCES):
+        automaton.add_word(sequence, sequence_id)
+    exact = {automaton.get(key) for key in automaton.keys(read_prefix, "?", ahocorasick.MATCH_AT_MOST_PREFIX)}
+    wildcard = (
+        {automaton.get(key) for key in automaton.keys(read_prefix, "N", ahocorasick.MATCH_AT_MOST_PREFIX)} - exact
+        if "N" in read_prefix
+        else set()
+    )
+    return tuple(sorted(exact)), tuple(sorted(wildcard))
+
+
+def test_packed_prefix_index_match():
+    read_prefixes = [
+        "AAGATT",
+        "AAGATT",
+        "ANGATT",
+        "AGANNN",
+        "NNNNNN",
+        "AG",
+        "",
+        "aaga",
+        "AAGx",
+        "ACGTACGTACGTACGTACGTACGTACGTACGTAC",
+        "ACGTACGTACGTACGTACGTACGTACGTACGTACGTACGT",
+        "ACGTACGTACGTACGTACGTACGTACGTACGTNN",
+        "ACGTACGTACGTACGTACGTACGTACGTACGNAC",
+        "TTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTTT",
+    ]
+    index = PackedPrefixIndex(SEQUENCES)
+    packed_matches = index.match(read_prefixes)
+
+    expected_outcomes: dict = {}
+    for read_prefix in read_prefixes:
+        outcome = automaton_matches(read_prefix)
+        expected_outcomes[outcome] = expected_outcomes.get(outcome, 0) + 1
+    assert packed_matches.outcomes == expected_outcomes
+    # prefixes equal up to the max sequence length, and prefixes of invalid bases only, are matched once
+    assert packed_matches.distinct_prefixes == len(set(read_prefixes)) - 2
+    assert index.match([]).outcomes == {}
+
+
+def test_packed_prefix_index_invalid_sequence():
+    with pytest.raises(ValueError, match="Cannot pack sequences"):
+        PackedPrefixIndex(["ACGT", "ACNT"])
+
+
+def test_packed_prefix_index_match_wildcard_ids():
+    # only AGA (id 0) and ATGA (id 2) are matched upon wildcards
+    index = PackedPrefixIndex(SEQUENCES, wildcard_ids=[0, 2])
+    packed_matches = index.match(["ANGATT", "AGANNN", "NNNNNN", "AAGATT"])
+
+    assert packed_matches.outcomes == {
+        # AAGA (id 1) also matches ANGATT and NNNNNN upon wildcards, but it is not a wildcard sequence
+        ((), (2,)): 1,
+        ((0,), ()): 1,
+        ((), (0, 2)): 1,
+        ((1,), ()): 1,
+    }
+
+
+def test_packed_prefix_index_from_arrays():
+    read_prefixes = ["AAGATT", "ANGATT", "NNNNNN", "ACGTACGTACGTACGTACGTACGTACGTACGTAC", "TTTT"]
+    index = PackedPrefixIndex(SEQUENCES, wildcard_ids=[0, 2])
+    rebuilt_index = PackedPrefixIndex.from_arrays(index.arrays())
+
+    assert (rebuilt_index.num_sequences, rebuilt_index.max_length) == (len(SEQUENCES), index.max_length)
+    assert rebuilt_index.match(read_prefixes) == index.match(read_prefixes)
+    assert PackedPrefixIndex.from_arrays(PackedPrefixIndex([]).arrays()).match(["AGA"]).outcomes == {((), ()): 1}
@@ -0,0 +1,84 @@
+from pathlib import Path
+import pytest
+
+from app.scripts.util.primer_index_bundle import (
+    is_primer_index_bundle,
+    load_primer_index_bundle,
+    write_primer_index_bundle,
+    BUNDLE_HEADER,
+)
+
+
+@pytest.fixture
+def bundle_path(tmp_path: Path) -> Path:
+    bundle_path = tmp_path / "primer_index.bundle"
+    write_primer_index_bundle(
+        bundle_path,
+        num_primers={"scheme_B": 3, "scheme_A": 2},
+        scheme_sequences={"scheme_B": ["ACGT", "TTGCA", "ACGT"], "scheme_A": ["ACGT", "GGGAC"]},
+    )
+    return bundle_path
+
+
+def test_load_primer_index_bundle(bundle_path: Path):
+    bundle = load_primer_index_bundle(bundle_path)
+
+    assert bundle.num_primers == {"scheme_A": 2, "scheme_B": 3}
+    assert bundle.schemes_per_sequence == {
+        "ACGT": ("scheme_A", "scheme_B"),
+        "GGGAC": ("scheme_A",),
+        "TTGCA": ("scheme_B",),
+    }
+    assert dict(bundle.automaton.items()) == bundle.schemes_per_sequence
+    assert bundle.max_primer_length == 5
+    assert len(bundle.checksum) == 64
+    assert bundle.load_seconds > 0
+    assert is_primer_index_bundle(bundle_path)
+    # no temporary file is left behind
+    assert list(bundle_path.parent.iterdir()) == [bundle_path]
+
+
+def test_load_primer_index_bundle_fuzzy_sequences(tmp_path: Path):
+    bundle_path = tmp_path / "primer_index.bundle"
+    write_primer_index_bundle(
+        bundle_path,
+        num_primers={"scheme_A": 1, "scheme_B": 1},
+        scheme_sequences={"scheme_A": ["ACGT"], "scheme_B": ["ACGA"]},
+        fuzzy_scheme_sequences={"scheme_A": ["ACGA", "ACGTT"], "scheme_B": ["ACGT", "CCGA"]},
+    )
+
+    bundle = load_primer_index_bundle(bundle_path)
+
+    assert bundle.schemes_per_sequence == {"ACGT": ("scheme_A",), "ACGA": ("scheme_B",)}
+    assert bundle.fuzzy_schemes_per_sequence == {
+        "ACGA": ("scheme_A",),
+        "ACGT": ("scheme_B",),
+        "ACGTT": ("scheme_A",),
+        "CCGA": ("scheme_B",),
+    }
+    # the fuzzy sequences that are not primer sequences have no scheme in the automaton
+    assert dict(bundle.automaton.items()) == {**bundle.schemes_per_sequence, "ACGTT": (), "CCGA": ()}
+    assert bundle.max_primer_length == 5
+
+
+def test_load_primer_index_bundle_no_fuzzy_sequences(bundle_path: Path):
+    assert load_primer_index_bundle(bundle_path).fuzzy_schemes_per_sequence == {}
+
+
+@pytest.mark.parametrize(
+    "corrupt,expected_error",
+    [
+        (lambda content: b"NOTINDEX" + content[8:], "is not a primer index bundle"),
+        (lambda content: content[:8] + b"\x00\x02" + content[10:], "has version 2, expected version 1"),
+        (lambda content: content[:-1], "is truncated"),
+        (lambda content: content[:10], "is truncated"),
+        (lambda content: content[:-1] + bytes([content[-1] ^ 1]), "checksum mismatch"),
+    ],
+)
+def test_load_primer_index_bundle_invalid(bundle_path: Path, corrupt, expected_error: str):
+    content = bundle_path.read_bytes()
+    assert len(content) > BUNDLE_HEADER.size
+    bundle_path.write_bytes(corrupt(content))
+
+    with pytest.raises(ValueError, match=expected_error):
+        load_primer_index_bundle(bundle_path)
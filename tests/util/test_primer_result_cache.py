@@ -0,0 +1,47 @@
+from pathlib import Path
+import os
+
+from app.scripts.util.primer_result_cache import (
+    evict_cached_results,
+    load_cached_result,
+    result_cache_key,
+    store_cached_result,
+    RESULT_CACHE_SUFFIX,
+)
+
+
+def test_result_cache_key():
+    key = result_cache_key(sample_fastq="abc", primer_index="def", stopping_rule=None)
+    assert len(key) == 64
+    assert key == result_cache_key(primer_index="def", stopping_rule=None, sample_fastq="abc")
+    assert key != result_cache_key(sample_fastq="abc", primer_index="def", stopping_rule={"max_reads": 10})
+
+
+def test_store_cached_result(tmp_path: Path):
+    cache_dir = tmp_path / "cache"
+    result = {"primer_data": {"ARTIC_V3": {"numreads": 3}}, "reads": 7}
+
+    assert load_cached_result(cache_dir, "key") is None
+    store_cached_result(cache_dir, "key", result)
+    assert load_cached_result(cache_dir, "key") == result
+    # no temporary file is left behind
+    assert [path.name for path in cache_dir.iterdir()] == [f"key{RESULT_CACHE_SUFFIX}"]
+
+    # corrupted entries are removed
+    (cache_dir / f"key{RESULT_CACHE_SUFFIX}").write_text("{")
+    assert load_cached_result(cache_dir, "key") is None
+    assert not list(cache_dir.iterdir())
+
+
+def test_evict_cached_results(tmp_path: Path):
+    for age, key in enumerate(["recent", "used", "old"]):
+        store_cached_result(tmp_path, key, {"value": "x" * 100})
+        os.utime(tmp_path / f"{key}{RESULT_CACHE_SUFFIX}", ns=(0, (10 - age) * 10**9))
+    entry_size = (tmp_path / f"old{RESULT_CACHE_SUFFIX}").stat().st_size
+    # a cache hit makes an entry the most recently used
+    assert load_cached_result(tmp_path, "used") is not None
+
+    removed = evict_cached_results(tmp_path, max_bytes=2 * entry_size)
+    assert removed == [tmp_path / f"old{RESULT_CACHE_SUFFIX}"]
+    assert evict_cached_results(tmp_path, max_bytes=entry_size) == [tmp_path / f"recent{RESULT_CACHE_SUFFIX}"]
+    assert [path.name for path in tmp_path.iterdir()] == [f"used{RESULT_CACHE_SUFFIX}"]
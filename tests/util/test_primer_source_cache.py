@@ -0,0 +1,91 @@
+from pathlib import Path
+import io
+import tarfile
+import pytest
+
+from app.scripts.util.primer_source_cache import extract_source_tarball, source_cache_path, store_source_tarball
+
+
+def test_source_cache_path(tmp_path: Path):
+    cache_path = source_cache_path(tmp_path, "https://github.com/org/primers.git", "abc123", "schemes")
+
+    assert cache_path.parent == tmp_path
+    assert cache_path.name.startswith("primers-abc123-")
+    # keyed by repository, commit and primer schemes subpath
+    assert cache_path == source_cache_path(tmp_path, "https://github.com/org/primers.git", "abc123", "schemes")
+    assert cache_path != source_cache_path(tmp_path, "https://github.com/org/primers.git", "abc124", "schemes")
+    assert cache_path != source_cache_path(tmp_path, "https://github.com/other/primers.git", "abc123", "schemes")
+    assert cache_path != source_cache_path(tmp_path, "https://github.com/org/primers.git", "abc123", ".")
+
+
+@pytest.mark.parametrize("source_schemes", ["data/schemes", "."])
+def test_store_extract_source_tarball(tmp_path: Path, source_schemes: str):
+    repo_path = tmp_path / "repo"
+    scheme_file = repo_path / "data" / "schemes" / "ARTIC" / "V4" / "scheme.bed"
+    scheme_file.parent.mkdir(parents=True)
+    scheme_file.write_text("MN908947.3\t30\t54\tnCoV-2019_1_LEFT\t1\t+\n")
+    other_file = repo_path / "README.md"
+    other_file.write_text("primers\n")
+    (repo_path / ".git").mkdir()
+    (repo_path / ".git" / "HEAD").write_text("ref: refs/heads/main\n")
+    cache_path = tmp_path / "cache" / "primers.tar.gz"
+
+    store_source_tarball(cache_path, repo_path, source_schemes)
+    extracted_path = tmp_path / "extracted"
+    extract_source_tarball(cache_path, extracted_path)
+
+    # the primer schemes subtree only, at the same path, without the git metadata
+    assert [path.name for path in (tmp_path / "cache").iterdir()] == [cache_path.name]
+    assert (extracted_path / scheme_file.relative_to(repo_path)).read_text() == scheme_file.read_text()
+    assert (extracted_path / other_file.relative_to(repo_path)).is_file() == (source_schemes == ".")
+    assert not (extracted_path / ".git").exists()
+
+
+@pytest.mark.parametrize(
+    "member_name,member_type,linkname",
+    [
+        ("../outside.bed", tarfile.REGTYPE, ""),
+        ("{tmp_path}/outside.bed", tarfile.REGTYPE, ""),
+        ("schemes/link.bed", tarfile.SYMTYPE, "../../outside.bed"),
+        ("schemes/link.bed", tarfile.SYMTYPE, "/etc/passwd"),
+        ("schemes/link.bed", tarfile.LNKTYPE, "../outside.bed"),
+        ("schemes/device", tarfile.CHRTYPE, ""),
+    ],
+)
+@pytest.mark.parametrize("data_filter", [True, False], ids=["data filter", "no data filter"])
+def test_extract_source_tarball_rejects_unsafe_members(
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    member_name: str,
+    member_type: bytes,
+    linkname: str,
+    data_filter: bool,
+):
+    member_name = member_name.format(tmp_path=tmp_path)
+    cache_path = tmp_path / "primers.tar.gz"
+    with tarfile.open(cache_path, mode="w:gz") as tar:
+        content = b"MN908947.3\t30\t54\tnCoV-2019_1_LEFT\t1\t+\n"
+        scheme_member = tarfile.TarInfo("schemes/scheme.bed")
+        scheme_member.size = len(content)
+        tar.addfile(scheme_member, io.BytesIO(content))
+        unsafe_member = tarfile.TarInfo(member_name)
+        unsafe_member.type = member_type
+        unsafe_member.linkname = linkname
+        tar.addfile(unsafe_member, io.BytesIO(b"") if member_type == tarfile.REGTYPE else None)
+    if not data_filter:
+        # as on the Python versions without extraction filters
+        monkeypatch.delattr(tarfile, "data_filter")
+
+    extracted_path = tmp_path / "extracted"
+    if data_filter and member_name.startswith("/"):
+        # the data filter extracts the absolute paths within the directory
+        extract_source_tarball(cache_path, extracted_path)
+        assert (extracted_path / member_name.lstrip("/")).is_file()
+    else:
+        with pytest.raises((ValueError, tarfile.TarError)):
+            extract_source_tarball(cache_path, extracted_path)
+
+    assert not (tmp_path / "outside.bed").exists()
+    if not data_filter:
+        # nothing is extracted
+        assert not extracted_path.exists()
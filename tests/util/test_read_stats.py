@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from app.scripts.util.read_stats import ReadStats
+
+SEQUENCES = ["ACGT", "GGCCN", "", "ATNNA", "acgtg"]
+
+
+def test_read_stats_update():
+    read_stats = ReadStats()
+    read_stats.update(SEQUENCES[:2])
+    read_stats.update(SEQUENCES[2:])
+    read_stats.update([])
+
+    assert read_stats.numreads == 5
+    assert read_stats.total_bases == 19
+    assert read_stats.gc_bases == 2 + 4 + 0 + 3
+    assert read_stats.n_bases == 3
+    assert read_stats.length_histogram.tolist() == [1, 0, 0, 0, 1, 3]
+    assert (read_stats.min_length, read_stats.max_length) == (0, 5)
+    assert read_stats.mean_length == pytest.approx(19 / 5)
+    assert read_stats.gc_fraction == pytest.approx(9 / 16)
+    assert read_stats.n_rate == pytest.approx(3 / 19)
+
+
+def test_read_stats_empty():
+    read_stats = ReadStats()
+    assert (read_stats.numreads, read_stats.min_length, read_stats.max_length) == (0, 0, 0)
+    assert read_stats.mean_length == read_stats.gc_fraction == read_stats.n_rate == 0.0
+    assert read_stats.to_dict()["length_histogram"] == {}
+
+
+@pytest.mark.parametrize("batch_size", [1, 2, 100])
+def test_read_stats_observe_merge(monkeypatch, batch_size: int):
+    monkeypatch.setattr("app.scripts.util.read_stats.READ_STATS_BATCH_SIZE", batch_size)
+    expected = ReadStats()
+    expected.update(SEQUENCES)
+
+    first, second = ReadStats(), ReadStats()
+    assert list(first.observe(SEQUENCES[:3])) == SEQUENCES[:3]
+    assert list(second.observe(SEQUENCES[3:])) == SEQUENCES[3:]
+    merged = ReadStats().merge(second).merge(first)
+
+    assert merged.to_dict() == expected.to_dict()
+    assert np.array_equal(merged.length_histogram, expected.length_histogram)
+    assert ReadStats.from_dict(merged.to_dict()).to_dict() == expected.to_dict()
+    # JSON keys are strings
+    json_dict = {**expected.to_dict(), "length_histogram": {"0": 1, "4": 1, "5": 3}}
+    assert ReadStats.from_dict(json_dict).to_dict() == expected.to_dict()
@@ -0,0 +1,86 @@
+from pathlib import Path
+import os
+import tempfile
+import numpy as np
+
+from app.scripts.util.packed_prefix_index import PackedPrefixIndex
+from app.scripts.util.shared_packed_index import (
+    load_shared_packed_index,
+    publish_packed_index,
+    remove_stale_packed_indexes,
+    shared_index_path,
+)
+
+SEQUENCES = ["AGA", "AAGA", "ATGA", "ACGTACGTACGTACGTACGTACGTACGTACGTAC"]
+READ_PREFIXES = ["AAGATT", "ANGATT", "NNNNNN", "ACGTACGTACGTACGTACGTACGTACGTACGTAC", "TTTT"]
+
+
+def test_load_shared_packed_index(tmp_path: Path):
+    built = []
+
+    def build_index() -> PackedPrefixIndex:
+        built.append(True)
+        return PackedPrefixIndex(SEQUENCES)
+
+    index = load_shared_packed_index(tmp_path, "checksum", build_index)
+    index_path = shared_index_path(tmp_path, "checksum")
+    assert [path.name for path in tmp_path.iterdir()] == [index_path.name]
+    # the other processes attach the published arrays, memory-mapped, without building the index
+    attached_index = load_shared_packed_index(tmp_path, "checksum", build_index)
+    assert len(built) == 1
+    assert isinstance(attached_index.arrays()[f"keys_{len(SEQUENCES[0])}"], np.memmap)
+    assert attached_index.match(READ_PREFIXES) == index.match(READ_PREFIXES) == build_index().match(READ_PREFIXES)
+
+    # another primer index
+    load_shared_packed_index(tmp_path, "other_checksum", build_index)
+    assert len(built) == 3
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_load_shared_packed_index_fallback(tmp_path: Path, monkeypatch):
+    local_dir = tmp_path / "local"
+    local_dir.mkdir()
+    monkeypatch.setattr(tempfile, "tempdir", str(local_dir))
+    not_a_dir = tmp_path / "not_a_dir"
+    not_a_dir.touch()
+    expected_matches = PackedPrefixIndex(SEQUENCES).match(READ_PREFIXES)
+
+    # the node-wide directory is missing or cannot be written: the local temporary directory is used instead
+    for shared_index_dir in [tmp_path / "missing", not_a_dir]:
+        index = load_shared_packed_index(shared_index_dir, "checksum", lambda: PackedPrefixIndex(SEQUENCES))
+        assert index.match(READ_PREFIXES) == expected_matches
+    assert [path.name for path in local_dir.iterdir()] == [shared_index_path(local_dir, "checksum").name]
+
+    # neither can be written: the index is kept in memory
+    monkeypatch.setattr(tempfile, "tempdir", str(not_a_dir))
+    index = load_shared_packed_index(not_a_dir, "other_checksum", lambda: PackedPrefixIndex(SEQUENCES))
+    assert index.match(READ_PREFIXES) == expected_matches
+    assert not isinstance(index.arrays()[f"keys_{len(SEQUENCES[0])}"], np.memmap)
+
+
+def test_publish_packed_index_concurrently(tmp_path: Path):
+    index_path = shared_index_path(tmp_path, "checksum")
+    publish_packed_index(PackedPrefixIndex(SEQUENCES), index_path)
+    # a process publishing the same index afterwards keeps the published copy, and leaves no temporary directory
+    publish_packed_index(PackedPrefixIndex(SEQUENCES[:1]), index_path)
+
+    assert [path.name for path in tmp_path.iterdir()] == [index_path.name]
+    index = load_shared_packed_index(tmp_path, "checksum", lambda: PackedPrefixIndex([]))
+    assert index.num_sequences == len(SEQUENCES)
+
+
+def test_remove_stale_packed_indexes(tmp_path: Path):
+    stale_path = shared_index_path(tmp_path, "stale")
+    publish_packed_index(PackedPrefixIndex(SEQUENCES), stale_path)
+    os.utime(stale_path, (0, 0))
+    used_path = shared_index_path(tmp_path, "used")
+    publish_packed_index(PackedPrefixIndex(SEQUENCES), used_path)
+    os.utime(used_path, (0, 0))
+    # attaching an index updates its last use
+    load_shared_packed_index(tmp_path, "used", lambda: PackedPrefixIndex([]))
+    other_path = tmp_path / "other"
+    other_path.mkdir()
+    os.utime(other_path, (0, 0))
+
+    assert remove_stale_packed_indexes(tmp_path) == [stale_path]
+    assert sorted(path.name for path in tmp_path.iterdir()) == sorted([used_path.name, other_path.name])
@@ -0,0 +1,50 @@
+from pathlib import Path
+import pytest
+
+from app.scripts.util.stage_timings import StageTimings
+
+
+class RecordingLogger:
+    def __init__(self):
+        self.records = []
+
+    def info(self, message: str, **fields):
+        self.records.append((message, fields))
+
+
+def test_stage_timings_measure(tmp_path: Path):
+    input_file = tmp_path / "input.bin"
+    input_file.write_bytes(b"x" * 100000)
+    logger = RecordingLogger()
+    stage_timings = StageTimings(logger=logger)
+
+    with stage_timings.measure("outer") as outer:
+        with stage_timings.measure("read") as timing:
+            with open(input_file, "rb", buffering=0) as fin:
+                fin.read()
+            timing.reads = 10
+        outer.reads = 10
+
+    assert [timing.stage for timing in stage_timings.stages] == ["read", "outer"]
+    read_timing, outer_timing = stage_timings.stages
+    assert read_timing.bytes_read >= 100000
+    assert outer_timing.bytes_read >= read_timing.bytes_read
+    assert outer_timing.wall_seconds >= read_timing.wall_seconds > 0
+    assert read_timing.cpu_seconds >= 0 and read_timing.peak_rss_mb > 0
+    assert read_timing.reads_per_second == pytest.approx(10 / read_timing.wall_seconds)
+
+    assert [(message, fields["stage"]) for message, fields in logger.records] == [
+        ("Stage completed", "read"),
+        ("Stage completed", "outer"),
+    ]
+    assert logger.records[0][1] == read_timing.to_dict()
+    assert stage_timings.to_dict() == {"stages": [read_timing.to_dict(), outer_timing.to_dict()]}
+
+
+def test_stage_timings_failed_stage():
+    stage_timings = StageTimings()
+    with pytest.raises(ValueError):
+        with stage_timings.measure("failing"):
+            raise ValueError("failed")
+    assert not stage_timings.stages
+    assert StageTimings().to_dict() == {"stages": []}
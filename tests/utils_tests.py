@@ -1,8 +1,26 @@
 from pathlib import Path
+from typing import Iterable
 import json
+import struct
+import zlib
 import pandas as pd
 from pandas.testing import assert_frame_equal
 
+from app.scripts.util.bgzf import (
+    BGZF_BLOCK_OFFSETS_TYPE,
+    BGZF_HEADER_PREFIX,
+    BGZF_MAX_BLOCK_SIZE,
+    BGZF_SUBFIELD_ID,
+    GZIP_FIXED_HEADER_SIZE,
+    GZIP_FOOTER_SIZE,
+    bgzf_index_path,
+)
+
+# at most this number of uncompressed bytes per BGZF block, so that the compressed block fits in 64 KB
+BGZF_MAX_BLOCK_INPUT = 0xFF00
+# the empty block terminating a BGZF file
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
 
 def assert_files_are_equal(file1: Path, file2: Path) -> None:
     with open(file1, "r") as f1:
@@ -42,3 +60,103 @@ def json_to_string(input_path: Path) -> str:
 
 def assert_jsons_are_equal(file1: Path, file2: Path) -> None:
     assert json_to_string(file1) == json_to_string(file2)
+
+
+# BGZF writer of the test fastq files (the pipeline writes BGZF with bgzip)
+def _bgzf_header(block_size: int) -> bytes:
+    # MTIME 0, XFL 0, OS unknown (255), XLEN 6, then the BC subfield holding the block size minus 1
+    return BGZF_HEADER_PREFIX + struct.pack("<IBBH2sHH", 0, 0, 255, 6, BGZF_SUBFIELD_ID, 2, block_size - 1)
+
+
+def compress_bgzf_block(data: bytes, compresslevel: int = 6) -> bytes:
+    """
+    Compress data (at most BGZF_MAX_BLOCK_INPUT bytes) into one BGZF block
+
+    :param data: the uncompressed data
+    :param compresslevel: the deflate compression level
+    :return: the BGZF block
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -zlib.MAX_WBITS)
+    cdata = compressor.compress(data) + compressor.flush()
+    block_size = GZIP_FIXED_HEADER_SIZE + 6 + len(cdata) + GZIP_FOOTER_SIZE
+    if block_size > BGZF_MAX_BLOCK_SIZE:
+        raise ValueError(f"BGZF block of {len(data)} bytes too large once compressed")
+    return _bgzf_header(block_size) + cdata + struct.pack("<II", zlib.crc32(data), len(data))
+
+
+class BgzfWriter:
+    """
+    Write a BGZF file, recording the offsets of its blocks for the block index.
+    Use as a context manager: the end of file block is written on exit
+    """
+
+    def __init__(self, output_path: Path, compresslevel: int = 6, block_size: int = BGZF_MAX_BLOCK_INPUT):
+        if not 0 < block_size <= BGZF_MAX_BLOCK_INPUT:
+            raise ValueError(f"The BGZF block size must be between 1 and {BGZF_MAX_BLOCK_INPUT}")
+        self.output_path = Path(output_path)
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        # (compressed offset, uncompressed offset) of each block written
+        self.block_offsets: list[BGZF_BLOCK_OFFSETS_TYPE] = []
+        self._output = open(self.output_path, "wb")
+        self._buffer = bytearray()
+        self._compressed_offset = 0
+        self._uncompressed_offset = 0
+
+    def __enter__(self) -> "BgzfWriter":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def _write_block(self, data: bytes) -> None:
+        block = compress_bgzf_block(data, self.compresslevel)
+        self._output.write(block)
+        self.block_offsets.append((self._compressed_offset, self._uncompressed_offset))
+        self._compressed_offset += len(block)
+        self._uncompressed_offset += len(data)
+
+    def write(self, data: bytes) -> None:
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            self._write_block(bytes(self._buffer[: self.block_size]))
+            del self._buffer[: self.block_size]
+
+    def close(self) -> None:
+        if self._output.closed:
+            return
+        if self._buffer:
+            self._write_block(bytes(self._buffer))
+            self._buffer.clear()
+        self._output.write(BGZF_EOF)
+        self._output.close()
+
+
+def write_bgzf(output_path: Path, chunks: Iterable[bytes], compresslevel: int = 6, index: bool = True) -> None:
+    """
+    Write the chunks of data to a BGZF file
+
+    :param output_path: the BGZF file
+    :param chunks: the uncompressed data
+    :param compresslevel: the deflate compression level
+    :param index: whether to write the block index to <output_path>.gzi too
+    """
+    with BgzfWriter(output_path, compresslevel) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+    if index:
+        write_bgzf_index(bgzf_index_path(output_path), writer.block_offsets)
+
+
+def write_bgzf_index(index_path: Path, block_offsets: list[BGZF_BLOCK_OFFSETS_TYPE]) -> None:
+    """
+    Write a block index in the gzi format
+
+    :param index_path: the index file
+    :param block_offsets: the (compressed offset, uncompressed offset) of each block, the first block included
+    """
+    entries = [offsets for offsets in block_offsets if offsets != (0, 0)]
+    with open(index_path, "wb") as index_file:
+        index_file.write(struct.pack("<Q", len(entries)))
+        for compressed_offset, uncompressed_offset in entries:
+            index_file.write(struct.pack("<QQ", compressed_offset, uncompressed_offset))